@@ -0,0 +1,129 @@
+"""
+P2P File Sharing - asyncio Server Engine
+Serves tracker connections on a single event loop instead of one thread each
+"""
+
+import asyncio
+import threading
+from collections import deque
+
+from protocol import MessageDecoder, ProtocolError, encode_message
+
+
+class TrackerProtocol(asyncio.Protocol):
+    """One tracker connection, driven by the event loop
+
+    Incoming bytes go through the shared frame decoder and each complete
+    request is answered by the same handlers as the threaded engine.
+    Reading pauses while the transport's write buffer is full, so a client
+    that stops reading its replies cannot make the server buffer without
+    bound. With a state store, replies wait in order until the changes
+    they confirm are on disk, without blocking the loop.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.decoder = MessageDecoder()
+        self.transport = None
+        self.address = None
+        self.replies = deque()  # [(seq, data)] waiting for the state log
+        self.waiting = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+        self.server.metrics.connection_opened()
+
+    def connection_lost(self, exc):
+        self.server.metrics.connection_closed()
+
+    def data_received(self, data):
+        try:
+            payloads = self.decoder.feed(data)
+        except ProtocolError as e:
+            self.server.log.warning("Protocol error from %s: %s", self.address, e)
+            self.transport.close()
+            return
+
+        if payloads:
+            # Replies to pipelined requests go out in a single write
+            data = b''.join(
+                encode_message(self.server.handle_request(payload))
+                for payload in payloads
+            )
+            store = self.server.store
+            seq = store.pending_seq() if store else 0
+            if not seq and not self.replies:
+                self.transport.write(data)
+                return
+            self.replies.append((seq, data))
+            self._send_durable()
+
+    def _durable(self):
+        self.waiting = False
+        self._send_durable()
+
+    def _send_durable(self):
+        """Write the queued replies whose changes are durable, in order"""
+        store = self.server.store
+        while self.replies and store.is_durable(self.replies[0][0]):
+            self.transport.write(self.replies.popleft()[1])
+        if self.replies and not self.waiting:
+            self.waiting = True
+            loop = asyncio.get_running_loop()
+            store.on_durable(self.replies[0][0],
+                             lambda: loop.call_soon_threadsafe(self._durable))
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+
+class AsyncioEngine:
+    """Runs the tracker's accept/serve loop on asyncio in a background thread"""
+
+    def __init__(self, server):
+        self.server = server
+        self.loop = None
+        self.listener = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.error = None
+
+    def start(self, sock):
+        """Serve connections accepted on an already bound, listening socket"""
+        self.thread = threading.Thread(target=self._run, args=(sock,), daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+
+    def _run(self, sock):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.listener = self.loop.run_until_complete(self.loop.create_server(
+                lambda: TrackerProtocol(self.server),
+                sock=sock
+            ))
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            self.loop.close()
+            return
+
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.listener.close()
+            self.loop.close()
+
+    def stop(self):
+        """Stop the event loop and close the listener"""
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread:
+            self.thread.join(timeout=5)
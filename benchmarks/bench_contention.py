@@ -0,0 +1,113 @@
+"""
+Benchmark - Tracker Lock Contention
+Measures how tracker request throughput scales with threads for a single
+lock shard (the old global lock) and for a sharded registry
+
+Usage:
+    python benchmarks/bench_contention.py [--threads 1,2,4,8] [--shards 1,16]
+                                          [--duration 3] [--files 2000]
+
+Each thread plays one registered host and calls the P2PServer request
+handlers directly (no sockets), with a mix of publishes of new files,
+fetches, discovers and pings spread over every host. Results are printed
+as JSON. With the GIL enabled the threads still take turns running Python
+code, so sharding mostly removes lock waits; on a free-threaded
+interpreter (python3.13t and later) it is what lets them run in parallel.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import P2PServer  # noqa: E402
+
+MIX = (('publish', 2), ('fetch', 5), ('discover', 1), ('ping', 2))
+
+
+def make_server(shards, hosts, files):
+    server = P2PServer(host='127.0.0.1', port=0, shards=shards, log_level='off')
+    for host in range(hosts):
+        hostname = f'host{host}'
+        server.handle_register({'hostname': hostname, 'ip': '127.0.0.1', 'port': 7000 + host})
+        server.handle_publish({
+            'hostname': hostname,
+            'files': [{'filename': f'{hostname}/file{i}'} for i in range(files)]
+        })
+    return server
+
+
+def worker(server, index, hosts, files, deadline, counts):
+    rng = random.Random(index)
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    hostname = f'host{index}'
+    published = files
+    done = 0
+    while time.perf_counter() < deadline:
+        for name in rng.choices(names, weights, k=64):
+            if name == 'publish':
+                server.handle_publish({'hostname': hostname, 'filename': f'{hostname}/new{published}'})
+                published += 1
+            elif name == 'fetch':
+                other = rng.randrange(hosts)
+                server.handle_fetch({'hostname': hostname,
+                                     'filename': f'host{other}/file{rng.randrange(files)}'})
+            elif name == 'discover':
+                server.handle_discover({'hostname': f'host{rng.randrange(hosts)}'})
+            else:
+                server.handle_ping({'hostname': f'host{rng.randrange(hosts)}'})
+        done += 64
+    counts[index] = done
+
+
+def measure(shards, threads, duration, files):
+    server = make_server(shards, threads, files)
+    counts = [0] * threads
+    deadline = time.perf_counter() + duration
+    workers = [threading.Thread(target=worker, args=(server, i, threads, files, deadline, counts))
+               for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return round(sum(counts) / elapsed, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure tracker throughput under lock contention')
+    parser.add_argument('--threads', default='1,2,4,8', help='comma-separated thread counts')
+    parser.add_argument('--shards', default='1,16', help='comma-separated shard counts')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds per measurement')
+    parser.add_argument('--files', type=int, default=2000, help='files seeded per host')
+    args = parser.parse_args()
+    thread_counts = [int(n) for n in args.threads.split(',')]
+    shard_counts = [int(n) for n in args.shards.split(',')]
+
+    gil_check = getattr(sys, '_is_gil_enabled', None)
+    results = {
+        'python': sys.version.split()[0],
+        'gil_enabled': gil_check() if gil_check else True,
+        'cpus': os.cpu_count(),
+        'requests_per_sec': {}
+    }
+    for shards in shard_counts:
+        row = {}
+        for threads in thread_counts:
+            row[str(threads)] = measure(shards, threads, args.duration, args.files)
+        results['requests_per_sec'][f'{shards}_shards'] = row
+    for row in results['requests_per_sec'].values():
+        base = row[str(thread_counts[0])]
+        row['scaling'] = round(row[str(thread_counts[-1])] / base, 2) if base else None
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark - Tracker Server Engines
+Compares the threaded and asyncio engines on idle connection capacity
+and request throughput
+
+Usage:
+    python benchmarks/bench_engines.py [--idle 10000] [--clients 64] [--duration 5]
+
+The server runs in a separate process so its memory and thread count can
+be measured on their own. Results are printed as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import HEADER, HEADER_SIZE, encode_message  # noqa: E402
+from server import ENGINES, P2PServer  # noqa: E402
+
+
+def raise_fd_limit():
+    """Allow as many open sockets as the hard limit permits"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def run_server(engine, port_queue):
+    """Server process entry point"""
+    raise_fd_limit()
+    sys.stdout = open(os.devnull, 'w')
+    server = P2PServer(host='127.0.0.1', port=0, engine=engine, backlog=4096, log_level='off')
+    server.start()
+    server.handle_register({'hostname': 'bench', 'ip': '127.0.0.1', 'port': 0})
+    port_queue.put(server.port)
+    while True:
+        time.sleep(3600)
+
+
+def process_stats(pid):
+    """Resident memory (KiB) and thread count of a process, from /proc"""
+    stats = {'rss_kib': None, 'threads': None}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    stats['rss_kib'] = int(line.split()[1])
+                elif line.startswith('Threads:'):
+                    stats['threads'] = int(line.split()[1])
+    except OSError:
+        pass
+    return stats
+
+
+async def round_trip(reader, writer, request):
+    writer.write(encode_message(request))
+    await writer.drain()
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER_SIZE))
+    return json.loads(await reader.readexactly(length))
+
+
+async def open_idle_connections(port, count, batch=500):
+    """Open count connections that never send anything"""
+    connections = []
+    failures = 0
+    for start in range(0, count, batch):
+        results = await asyncio.gather(
+            *(asyncio.open_connection('127.0.0.1', port)
+              for _ in range(min(batch, count - start))),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                failures += 1
+            else:
+                connections.append(result)
+    return connections, failures
+
+
+async def measure_latency(port, samples=200):
+    """Median ping round trip in milliseconds on a fresh connection"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        await round_trip(reader, writer, {'command': 'ping', 'hostname': 'bench'})
+        timings.append((time.perf_counter() - started) * 1000)
+    writer.close()
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+async def drive_load(port, clients, duration):
+    """Closed-loop load: each client sends a ping as soon as the last reply arrives"""
+    deadline = time.perf_counter() + duration
+    request = {'command': 'ping', 'hostname': 'bench'}
+
+    async def client():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        completed = 0
+        while time.perf_counter() < deadline:
+            await round_trip(reader, writer, request)
+            completed += 1
+        writer.close()
+        return completed
+
+    started = time.perf_counter()
+    counts = await asyncio.gather(*(client() for _ in range(clients)))
+    return sum(counts) / (time.perf_counter() - started)
+
+
+async def bench_engine(engine, args):
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_server, args=(engine, port_queue), daemon=True)
+    process.start()
+    port = port_queue.get(timeout=10)
+    result = {'engine': engine}
+
+    try:
+        result['requests_per_sec'] = round(await drive_load(port, args.clients, args.duration), 1)
+        result['baseline'] = process_stats(process.pid)
+
+        connections, failures = await open_idle_connections(port, args.idle)
+        await asyncio.sleep(1)
+        result['idle'] = {
+            'requested': args.idle,
+            'open': len(connections),
+            'failed': failures,
+            'median_ping_ms': round(await measure_latency(port), 3),
+            **process_stats(process.pid)
+        }
+        for _, writer in connections:
+            writer.close()
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        process.terminate()
+        process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare tracker server engines')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument('--idle', type=int, default=10000, help='idle connections to hold open')
+    parser.add_argument('--clients', type=int, default=64, help='concurrent clients for the throughput test')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of load per engine')
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    if limit < args.idle + 100:
+        print(f"warning: open file limit {limit} is below --idle {args.idle}", file=sys.stderr)
+
+    results = [asyncio.run(bench_engine(engine, args)) for engine in args.engines]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark - Tracker State Recovery
+Measures cold-start recovery of the durable registry from the operation
+log alone and from a compacted snapshot, plus group-commit throughput
+
+Usage:
+    python benchmarks/bench_recovery.py [--entries 1000000] [--hosts 1000]
+                                        [--batch 100] [--threads 16]
+
+--entries file entries are published by --hosts hosts in publish
+operations of --batch files. Recovery times are measured in a fresh
+registry exactly as P2PServer does it at startup. The group-commit test
+has --threads threads each publishing single files and waiting for them
+to be durable, and reports how many operations shared each fsync.
+Results are printed as JSON.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from registry import Registry  # noqa: E402
+from storage import StateStore  # noqa: E402
+
+
+def directory_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def populate(directory, entries, hosts, batch):
+    """Write the state through a live store; returns seconds taken"""
+    registry = Registry()
+    store = StateStore(directory, compact_after=float('inf'))
+    store.recover(registry)
+    store.open(registry)
+    started = time.perf_counter()
+    per_host = entries // hosts
+    for host in range(hosts):
+        hostname = f'host{host}'
+        registry.register(hostname, '127.0.0.1', 7000 + host)
+        for first in range(0, per_host, batch):
+            registry.publish(hostname, [{'filename': f'{hostname}/file{i}'}
+                                        for i in range(first, min(first + batch, per_host))])
+    store.wait(store.last_seq)
+    elapsed = time.perf_counter() - started
+    return store, registry, elapsed
+
+
+def recover(directory):
+    registry = Registry()
+    store = StateStore(directory)
+    started = time.perf_counter()
+    records, operations = store.recover(registry)
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': round(elapsed, 3),
+        'snapshot_records': records,
+        'log_operations': operations,
+        'clients': registry.client_count(),
+        'files': registry.file_count(),
+        'disk_bytes': directory_size(directory),
+    }
+
+
+def group_commit(directory, threads, duration):
+    """Concurrent single-file publishes, each waiting for its fsync"""
+    registry = Registry()
+    store = StateStore(directory)
+    store.recover(registry)
+    store.open(registry)
+    fsyncs = [0]
+    real_fsync = os.fsync
+
+    def counting_fsync(fd):
+        fsyncs[0] += 1
+        real_fsync(fd)
+
+    storage.os.fsync = counting_fsync
+    counts = [0] * threads
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        hostname = f'writer{index}'
+        registry.register(hostname, '127.0.0.1', 9000 + index)
+        while time.perf_counter() < deadline:
+            registry.publish(hostname, [{'filename': f'{hostname}/new{counts[index]}'}])
+            store.wait(store.pending_seq())
+            counts[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    store.close()
+    storage.os.fsync = real_fsync
+    total = sum(counts)
+    return {
+        'threads': threads,
+        'durable_publishes_per_sec': round(total / elapsed, 1),
+        'fsyncs': fsyncs[0],
+        'publishes_per_fsync': round(total / fsyncs[0], 2) if fsyncs[0] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure durable tracker state recovery')
+    parser.add_argument('--entries', type=int, default=1000000, help='published file entries')
+    parser.add_argument('--hosts', type=int, default=1000, help='hosts the entries are spread over')
+    parser.add_argument('--batch', type=int, default=100, help='files per publish operation')
+    parser.add_argument('--threads', type=int, default=16, help='writers in the group-commit test')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds of the group-commit test')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_recovery_')
+    try:
+        store, registry, write_seconds = populate(directory, args.entries, args.hosts, args.batch)
+        results = {
+            'entries': registry.file_count(),
+            'write': {'seconds': round(write_seconds, 3),
+                      'entries_per_sec': round(registry.file_count() / write_seconds)},
+        }
+        results['recover_from_log'] = recover(directory)
+
+        started = time.perf_counter()
+        store.compact()
+        while store.snapshot_thread is None and store.generation == 0:
+            time.sleep(0.01)
+        while store.snapshot_thread is not None:
+            time.sleep(0.01)
+        results['snapshot_seconds'] = round(time.perf_counter() - started, 3)
+        store.close()
+        results['recover_from_snapshot'] = recover(directory)
+
+        shutil.rmtree(directory)
+        os.mkdir(directory)
+        results['group_commit'] = group_commit(directory, args.threads, args.duration)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark - Zero-Copy vs Buffered File Serving
+Measures throughput and sender CPU time of transfer.send_file_data with
+os.sendfile and with the buffered fallback loop
+
+Usage:
+    python benchmarks/bench_sendfile.py [--size-mb 512] [--rounds 3]
+
+A separate process receives and discards the data over loopback TCP, so
+only the sending side's CPU time is counted. Results are printed as JSON.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfer import BLOCK_SIZE, send_file_data  # noqa: E402
+
+
+def sink(listener):
+    """Receiver process: drain every connection into a reused buffer"""
+    buffer = bytearray(BLOCK_SIZE)
+    while True:
+        conn, _ = listener.accept()
+        with conn:
+            while conn.recv_into(buffer):
+                pass
+
+
+def make_file(size):
+    f = tempfile.NamedTemporaryFile(prefix='bench_sendfile_', delete=False)
+    block = os.urandom(1024 * 1024)
+    written = 0
+    while written < size:
+        chunk = block[:min(len(block), size - written)]
+        f.write(chunk)
+        written += len(chunk)
+    f.close()
+    return f.name
+
+
+def measure(port, path, size, zero_copy):
+    with socket.create_connection(('127.0.0.1', port)) as sock, open(path, 'rb') as f:
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        send_file_data(sock, f, size, zero_copy=zero_copy)
+        cpu = time.thread_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+    return {'seconds': wall, 'cpu_seconds': cpu}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sendfile and buffered file serving')
+    parser.add_argument('--size-mb', type=int, default=512, help='file size in MiB')
+    parser.add_argument('--rounds', type=int, default=3, help='transfers per mode (best is reported)')
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    path = make_file(size)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    receiver = multiprocessing.Process(target=sink, args=(listener,), daemon=True)
+    receiver.start()
+
+    results = []
+    try:
+        for mode, zero_copy in (('sendfile', True), ('buffered', False)):
+            runs = [measure(listener.getsockname()[1], path, size, zero_copy)
+                    for _ in range(args.rounds)]
+            best = min(runs, key=lambda run: run['seconds'])
+            results.append({
+                'mode': mode,
+                'bytes': size,
+                'bytes_per_sec': round(size / best['seconds']),
+                'seconds': round(best['seconds'], 4),
+                'cpu_seconds': round(min(run['cpu_seconds'] for run in runs), 4),
+                'cpu_seconds_per_gib': round(
+                    min(run['cpu_seconds'] for run in runs) * (1 << 30) / size, 4
+                ),
+            })
+    finally:
+        receiver.terminate()
+        listener.close()
+        os.unlink(path)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Benchmark - Load Generator for Tracker and Peers
+Starts an in-process P2PServer and simulated P2PClients on localhost,
+drives a configurable mix of operations and reports throughput, latency
+percentiles and memory as JSON
+
+Usage:
+    python benchmarks/loadgen.py [--engine asyncio] [--clients 20] [--threads 8]
+                                 [--duration 10] [--mix publish=4,fetch=4,ping=2]
+                                 [--sizes 64K,1M,16M] [--output results.json]
+
+Operations in --mix (relative weights):
+    register   re-register a host (from a separate pool so seeded files survive)
+    publish    announce a new filename
+    fetch      look up holders of a published filename
+    discover   list the files of a host
+    ping       check whether a host is alive
+    download   download a seeded file of one of --sizes from a peer
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client import P2PClient  # noqa: E402
+from server import ENGINES, P2PServer  # noqa: E402
+
+OPERATIONS = ('register', 'publish', 'fetch', 'discover', 'ping', 'download')
+DEFAULT_MIX = 'register=1,publish=4,fetch=4,discover=1,ping=2,download=1'
+
+
+def parse_size(text):
+    """Parse sizes such as 512, 64K, 1M or 2G into bytes"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_mix(text):
+    weights = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def memory_stats():
+    stats = {'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    stats['rss_kib'] = int(line.split()[1])
+    except OSError:
+        pass
+    return stats
+
+
+class LoadGenerator:
+    """Owns the server, the simulated clients and the recorded samples"""
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.server = None
+        self.clients = []
+        self.seeded = []  # (filename, size, holder)
+        self.published = []
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.samples = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.download_bytes = 0
+
+    def setup(self):
+        self.server = P2PServer(host='127.0.0.1', port=0, engine=self.args.engine,
+                                backlog=max(128, self.args.threads * 4), log_level='off')
+        self.server.start()
+        for i in range(self.args.clients):
+            client = P2PClient(f'load{i}', '127.0.0.1', self.server.port, 0)
+            client.start_peer_server()
+            ok, message = client.connect_to_server()
+            if not ok:
+                raise RuntimeError(f"client load{i} failed to register: {message}")
+            self.clients.append(client)
+
+        # Seed one real file per size so downloads have something to move
+        for size in self.args.sizes:
+            holder = self.clients[len(self.seeded) % len(self.clients)]
+            source = os.path.join(self.args.workdir, f'seed_{size}.bin')
+            with open(source, 'wb') as f:
+                remaining = size
+                while remaining:
+                    chunk = os.urandom(min(remaining, 1024 * 1024))
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            filename = f'seed_{size}.bin'
+            ok, message = holder.publish(source, filename)
+            if not ok:
+                raise RuntimeError(f"seeding {filename} failed: {message}")
+            self.seeded.append((filename, size, holder))
+            self.published.append(filename)
+
+    def teardown(self):
+        for client in self.clients:
+            client.stop()
+        if self.server:
+            self.server.stop()
+
+    def pick_client(self):
+        return self.random.choice(self.clients)
+
+    def run_operation(self, name, downloader):
+        client = self.pick_client()
+        if name == 'register':
+            with self.lock:
+                self.counter += 1
+                hostname = f'reg{self.counter % max(1, self.args.clients)}'
+            request = {'command': 'register', 'hostname': hostname,
+                       'ip': '127.0.0.1', 'port': client.client_port}
+        elif name == 'publish':
+            with self.lock:
+                self.counter += 1
+                filename = f'{client.hostname}-file{self.counter}'
+                self.published.append(filename)
+            request = {'command': 'publish', 'hostname': client.hostname, 'filename': filename}
+        elif name == 'fetch':
+            request = {'command': 'fetch', 'hostname': client.hostname,
+                       'filename': self.random.choice(self.published)}
+        elif name == 'discover':
+            request = {'command': 'discover', 'hostname': self.pick_client().hostname}
+        elif name == 'ping':
+            request = {'command': 'ping', 'hostname': self.pick_client().hostname}
+        else:
+            return self.run_download(downloader)
+
+        response = client.session.request(request)
+        return response['status'] == 'success' or name == 'fetch', 0
+
+    def run_download(self, downloader):
+        filename, size, holder = self.random.choice(self.seeded)
+        peer = {'hostname': holder.hostname, 'ip': '127.0.0.1', 'port': holder.client_port}
+        ok, _ = downloader.download_from_peer(peer, filename)
+        (downloader.repository_path / filename).unlink(missing_ok=True)
+        return ok, size if ok else 0
+
+    def worker(self, names, weights, deadline):
+        rng = random.Random(self.random.random())
+        # Each thread downloads into its own repository so .part files never collide
+        downloader = P2PClient(f'dl{threading.get_ident()}', '127.0.0.1', self.server.port, 0)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok, moved = self.run_operation(name, downloader)
+            except Exception:
+                ok, moved = False, 0
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                if ok:
+                    self.samples[name].append(elapsed)
+                    self.download_bytes += moved
+                else:
+                    self.errors[name] += 1
+
+    def run(self):
+        names = [name for name, weight in self.args.mix.items() if weight > 0]
+        weights = [self.args.mix[name] for name in names]
+        deadline = time.perf_counter() + self.args.duration
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.worker, args=(names, weights, deadline))
+                   for _ in range(self.args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        operations = {}
+        total = 0
+        for name in OPERATIONS:
+            samples = sorted(self.samples[name])
+            if not samples and not self.errors[name]:
+                continue
+            total += len(samples)
+            operations[name] = {
+                'count': len(samples),
+                'errors': self.errors[name],
+                'ops_per_sec': round(len(samples) / elapsed, 2),
+                'p50_ms': round(percentile(samples, 0.50) * 1000, 3) if samples else None,
+                'p95_ms': round(percentile(samples, 0.95) * 1000, 3) if samples else None,
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 3) if samples else None,
+            }
+        return {
+            'config': {
+                'engine': self.args.engine,
+                'clients': self.args.clients,
+                'threads': self.args.threads,
+                'duration': self.args.duration,
+                'mix': self.args.mix,
+                'sizes': self.args.sizes,
+            },
+            'elapsed_sec': round(elapsed, 3),
+            'total_ops_per_sec': round(total / elapsed, 2),
+            'download_bytes_per_sec': round(self.download_bytes / elapsed),
+            'operations': operations,
+            'memory': memory_stats(),
+            'tracker': {
+                'clients': self.server.registry.client_count(),
+                'indexed_files': self.server.registry.file_count(),
+                'lock_waits': self.server.metrics.snapshot()['lock_waits'],
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the tracker and peers in-process')
+    parser.add_argument('--engine', choices=ENGINES, default='threaded')
+    parser.add_argument('--clients', type=int, default=20, help='simulated P2PClients')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent load threads')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'operation weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--sizes', type=lambda text: [parse_size(s) for s in text.split(',')],
+                        default=[64 * 1024, 1024 * 1024, 16 * 1024 * 1024],
+                        help='seeded file sizes for downloads (default: 64K,1M,16M)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    original_dir = os.getcwd()
+    args.workdir = tempfile.mkdtemp(prefix='p2p_loadgen_')
+    os.chdir(args.workdir)  # client repositories are created relative to the cwd
+
+    generator = LoadGenerator(args)
+    try:
+        # Server and client progress prints go nowhere during the run
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            try:
+                generator.setup()
+                elapsed = generator.run()
+                report = generator.report(elapsed)
+            finally:
+                generator.teardown()
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output_path:
+        with open(output_path, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
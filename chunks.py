@@ -0,0 +1,126 @@
+"""
+P2P File Sharing - Chunk Index
+Content-addressed view of a client repository: which file holds each piece
+
+Storage is deduplicated per whole file only: files stay stored under their
+published names, and a file is shared on disk only with files of identical
+content. Two versions that differ slightly are each stored in full; the
+index saves their transfer (a download takes pieces already held from
+disk), not their storage.
+"""
+
+import json
+import os
+import threading
+
+CHUNKS_FILE = '.chunks.json'
+
+
+class ChunkIndex:
+    """Maps repository files to their pieces, and piece hashes back to files
+
+    Every file with a known manifest is recorded by name with its piece
+    list (the manifest). The reverse maps answer "is a piece with this
+    SHA-256 already held, and where" and "is a file with this root already
+    held", so a download can take those pieces from disk instead of the
+    network and identical files can share storage. The data itself stays
+    in the named files; a location found here is verified before use.
+
+    Names imported with --link share their data with the user's own file.
+    They are marked linked: their pieces may be read, but no other name is
+    ever hardlinked to them.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}  # {filename: manifest}
+        self.locations = {}  # {piece digest: {(filename, offset, length)}}
+        self.roots = {}  # {root hash: {filename}}
+        self.linked = set()  # names whose data is a file outside the repository
+        if path is not None:
+            try:
+                with open(path) as f:
+                    files = json.load(f)
+            except (OSError, ValueError):
+                files = {}
+            for filename, manifest in files.items():
+                if manifest.pop('linked', False):
+                    self.linked.add(filename)
+                self._add_locked(filename, manifest)
+
+    def _add_locked(self, filename, manifest):
+        self.files[filename] = manifest
+        size = manifest['size']
+        piece_size = manifest['piece_size']
+        for index, digest in enumerate(manifest['pieces']):
+            offset = index * piece_size
+            self.locations.setdefault(digest, set()).add(
+                (filename, offset, min(piece_size, size - offset)))
+        self.roots.setdefault(manifest['root'], set()).add(filename)
+
+    def _remove_locked(self, filename):
+        manifest = self.files.pop(filename, None)
+        if manifest is None:
+            return False
+        for digest in manifest['pieces']:
+            holders = self.locations.get(digest)
+            if holders is None:
+                continue
+            for location in [location for location in holders if location[0] == filename]:
+                holders.discard(location)
+            if not holders:
+                del self.locations[digest]
+        names = self.roots[manifest['root']]
+        names.discard(filename)
+        if not names:
+            del self.roots[manifest['root']]
+        return True
+
+    def add(self, filename, manifest):
+        """Record (or replace) the manifest of a repository file"""
+        with self.lock:
+            self._remove_locked(filename)
+            self._add_locked(filename, manifest)
+
+    def remove(self, filename):
+        with self.lock:
+            return self._remove_locked(filename)
+
+    def get(self, filename):
+        with self.lock:
+            return self.files.get(filename)
+
+    def locate(self, digest):
+        """(filename, offset, length) of every known copy of a piece"""
+        with self.lock:
+            return list(self.locations.get(digest, ()))
+
+    def set_linked(self, filename, linked):
+        """Record whether a name's data belongs to a file outside the repository"""
+        with self.lock:
+            if linked:
+                self.linked.add(filename)
+            else:
+                self.linked.discard(filename)
+
+    def is_linked(self, filename):
+        with self.lock:
+            return filename in self.linked
+
+    def with_root(self, root):
+        """Names of the files whose content has this root hash"""
+        with self.lock:
+            return set(self.roots.get(root, ()))
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            files = {filename: dict(manifest, linked=True) if filename in self.linked else manifest
+                     for filename, manifest in self.files.items()}
+            data = json.dumps(files, separators=(',', ':'))
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
@@ -2,16 +2,59 @@
 P2P File Sharing - Client with Command-Line Interface
 """
 
+import hashlib
 import socket
 import threading
-import json
+import time
 import os
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from chunks import CHUNKS_FILE, ChunkIndex
+from compression import CompressionCache, FrameReader, available_codecs, choose_codec, send_compressed
+from delta import (DELTA_MIN_SIZE, MAX_DELTA_BLOCK, MIN_DELTA_BLOCK, block_size_for,
+                   compute_delta, send_delta_data, signatures, wire_ops)
+from manifest import ManifestBuilder, hash_file
+from partial import PARTIAL_DIR, PartialDownload
+from peer_stats import PEER_STATS_FILE, PeerStats
+from protocol import recv_message, send_message
+from ratelimit import RateLimits, format_rate, parse_rate
+from repository import IMPORT_MODES, REGISTRY_FILE, PublishedRegistry, place_file
+from session import TrackerSession
+from swarm import RANGE_SIZE, SwarmDownload
+from transfer import BLOCK_SIZE, PIECE_SIZE, recv_file_data, send_file_data
+from uploads import PER_PEER_UPLOADS, UPLOAD_QUEUE, UPLOAD_SLOTS, PeerBusy, UploadSlots
+
+
+# Upper bound on manifest pieces per batched publish request (keeps frames small)
+MAX_BATCH_PIECES = 200000
+
+# Seconds between heartbeats (lowered to a third of the server's expiry time if needed)
+HEARTBEAT_INTERVAL = 20.0
+
+# Peer selection: probe timeout, parallel probes, and the throughput assumed
+# for peers this client has not downloaded from yet (bytes per second)
+PROBE_TIMEOUT = 2.0
+PROBE_WORKERS = 16
+ASSUMED_THROUGHPUT = 10 * 1024 * 1024
+
+# Search results shown per page
+SEARCH_PAGE = 50
+
+# Pending connections the peer server's listen queue holds
+PEER_BACKLOG = 128
+
+# Peer connections handled beyond the upload slots and queue (stat, probe, refusals)
+CONTROL_CONNECTIONS = 8
+
 
 class P2PClient:
-    def __init__(self, hostname, server_host='127.0.0.1', server_port=5000, client_port=6000):
+    def __init__(self, hostname, server_host='127.0.0.1', server_port=5000, client_port=6000,
+                 swarm_workers=4, stall_timeout=10.0, import_mode='copy',
+                 upload_slots=UPLOAD_SLOTS, upload_queue=UPLOAD_QUEUE,
+                 per_peer_uploads=PER_PEER_UPLOADS):
+        if import_mode not in IMPORT_MODES:
+            raise ValueError(f"import_mode must be one of {', '.join(IMPORT_MODES)}")
         self.hostname = hostname
         self.server_host = server_host
         self.server_port = server_port
@@ -22,11 +65,61 @@ class P2PClient:
         self.running = False
         self.peer_server_socket = None
         
+        # Swarm downloads: parallel range workers, and how long a peer may stall
+        self.swarm_workers = swarm_workers
+        self.stall_timeout = stall_timeout
+        
+        # Rounds of re-fetching pieces that failed verification before giving up
+        self.verify_attempts = 3
+        
+        # Bulk publish: parallel file imports, and files per publish request
+        self.import_workers = 8
+        self.publish_batch_size = 1000
+        
+        # How publish brings files in: copy, link (no data copy) or inplace
+        self.import_mode = import_mode
+        self.published = PublishedRegistry(self.repository_path)
+        
+        # One persistent connection carries every request to the server
+        self.session = TrackerSession(server_host, server_port)
+        
+        # Heartbeats keep this client registered
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.heartbeat_stop = threading.Event()
+        self.heartbeat_thread = None
+        
+        # Manifests of repository files, indexed by piece and root hash: used to
+        # re-publish, to take pieces already held from disk, and to share storage
+        self.chunks = ChunkIndex(self.repository_path / CHUNKS_FILE)
+        
+        # Throughput, round-trip time and failures measured for each remote peer
+        self.peer_stats = PeerStats(self.repository_path / PEER_STATS_FILE)
+        
+        # Uploads run in a bounded number of slots; their load is reported to
+        # probing peers and in heartbeats
+        self.uploads = UploadSlots(upload_slots, upload_queue, per_peer_uploads)
+        # Bounds the threads handling peer connections; the rest wait in the listen queue
+        self.connection_slots = threading.BoundedSemaphore(
+            upload_slots + upload_queue + CONTROL_CONNECTIONS)
+        
+        # Rounds of retrying peers that answered busy before giving up
+        self.busy_retries = 3
+        
+        # Upload/download bandwidth limits, in total and per connection (0 = unlimited)
+        self.limits = RateLimits()
+        
+        # Codecs offered when downloading (empty turns compression off), and
+        # compressed blocks kept for the next peer downloading the same file
+        self.codecs = available_codecs()
+        self.compression_cache = CompressionCache()
+        
+        # Fetch a new version of a file held locally as a delta against the old copy
+        self.delta_sync = True
+        
     def connect_to_server(self):
         """Connect to central server and register"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.server_host, self.server_port))
+            self.session.connect()
             
             # Register with server
             register_request = {
@@ -36,21 +129,68 @@ class P2PClient:
                 'port': self.client_port
             }
             
-            sock.send(json.dumps(register_request).encode('utf-8'))
-            response = json.loads(sock.recv(4096).decode('utf-8'))
-            sock.close()
+            response = self.session.request(register_request)
             
-            return response['status'] == 'success', response.get('message', 'Unknown error')
+            if response['status'] != 'success':
+                return False, response.get('message', 'Unknown error')
+            ttl = response.get('ttl')
+            if ttl:
+                self.heartbeat_interval = min(HEARTBEAT_INTERVAL, ttl / 3)
+            self.start_heartbeat()
+            return True, response.get('message', 'Unknown error')
         except Exception as e:
             return False, str(e)
             
+    def start_heartbeat(self):
+        """Start sending periodic heartbeats to the server, once"""
+        if self.heartbeat_thread is None:
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, daemon=True)
+            self.heartbeat_thread.start()
+            
+    def heartbeat_loop(self):
+        while not self.heartbeat_stop.wait(self.heartbeat_interval):
+            try:
+                self.send_heartbeat()
+            except Exception as e:
+                print(f"[ERROR] Heartbeat failed: {e}")
+                
+    def send_heartbeat(self):
+        """Send one heartbeat; re-join if the server has dropped this client"""
+        response = self.session.request({'command': 'heartbeat', 'hostname': self.hostname,
+                                         'load': self.uploads.load()})
+        if response['status'] == 'success':
+            return True
+        if response.get('registered') is False:
+            print("[CLIENT] Server no longer knows this client, registering again")
+            self.rejoin()
+        return False
+        
+    def rejoin(self):
+        """Register again and re-announce every repository file"""
+        success, message = self.connect_to_server()
+        if not success:
+            raise ConnectionError(message)
+        entries = []
+        for filename in self.list_repository_files():
+            entry = {'filename': filename}
+            manifest = self.chunks.get(filename)
+            if manifest is not None:
+                entry['manifest'] = manifest
+            entries.append(entry)
+        pending = [self.submit_publish_batch(entries[i:i + self.publish_batch_size])
+                   for i in range(0, len(entries), self.publish_batch_size)]
+        for future in pending:
+            future.result(self.session.timeout)
+        print(f"[CLIENT] Re-published {len(entries)} file(s)")
+            
     def start_peer_server(self):
         """Start server to handle incoming file requests from peers"""
         try:
             self.peer_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.peer_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.peer_server_socket.bind(('0.0.0.0', self.client_port))
-            self.peer_server_socket.listen(5)
+            self.peer_server_socket.listen(PEER_BACKLOG)
+            self.client_port = self.peer_server_socket.getsockname()[1]  # resolves port 0
             self.running = True
             
             accept_thread = threading.Thread(target=self.accept_peer_connections, daemon=True)
@@ -65,6 +205,9 @@ class P2PClient:
     def accept_peer_connections(self):
         """Accept connections from other peers"""
         while self.running:
+            # At the limit, new connections wait in the listen queue
+            if not self.connection_slots.acquire(timeout=1.0):
+                continue
             try:
                 peer_socket, address = self.peer_server_socket.accept()
                 print(f"[CLIENT] Incoming connection from {address}")
@@ -75,138 +218,440 @@ class P2PClient:
                 )
                 thread.start()
             except Exception as e:
+                self.connection_slots.release()
                 if self.running:
                     print(f"[ERROR] Error accepting peer connection: {e}")
                     
     def handle_peer_request(self, peer_socket):
-        """Handle file download request from peer"""
+        """Handle file download request from peer
+
+        A peer that does not send its request (or, for a download, its
+        acknowledgment) within stall_timeout is dropped, so idle
+        connections cannot hold the handler threads or upload slots.
+        """
         try:
-            data = peer_socket.recv(4096).decode('utf-8')
-            request = json.loads(data)
+            peer_socket.settimeout(self.stall_timeout)
+            request = recv_message(peer_socket)
+            if request is None:
+                return
             
-            if request['command'] == 'download':
-                filename = request['filename']
-                filepath = self.repository_path / filename
-                
-                if filepath.exists():
-                    # Send file
-                    with open(filepath, 'rb') as f:
-                        file_data = f.read()
-                        
-                    response = {
-                        'status': 'success',
-                        'filename': filename,
-                        'size': len(file_data)
-                    }
-                    peer_socket.send(json.dumps(response).encode('utf-8'))
-                    peer_socket.recv(1024)  # Wait for acknowledgment
-                    
-                    # Send file data
-                    peer_socket.sendall(file_data)
-                    print(f"[CLIENT] Sent file '{filename}' to peer")
-                else:
-                    response = {'status': 'error', 'message': 'File not found'}
-                    peer_socket.send(json.dumps(response).encode('utf-8'))
+            command = request.get('command')
+            if command == 'download':
+                self.serve_download(peer_socket, request)
+            elif command == 'stat':
+                self.serve_stat(peer_socket, request)
+            elif command == 'delta':
+                self.serve_delta(peer_socket, request)
+            elif command == 'probe':
+                send_message(peer_socket, {'status': 'success', 'uploads': self.uploads.load()})
+            else:
+                send_message(peer_socket, {'status': 'error', 'message': 'Unknown command'})
                     
+        except TimeoutError:
+            print("[CLIENT] Dropped a peer connection that stopped responding")
         except Exception as e:
             print(f"[ERROR] Error handling peer request: {e}")
         finally:
             peer_socket.close()
+            self.connection_slots.release()
             
-    def publish(self, local_path, filename):
+    def serve_stat(self, peer_socket, request):
+        """Report the size of a file in the repository"""
+        filepath = self.peer_path(request.get('filename'))
+        if filepath is not None and filepath.is_file():
+            response = {
+                'status': 'success',
+                'filename': request['filename'],
+                'size': filepath.stat().st_size
+            }
+        else:
+            response = {'status': 'error', 'message': 'File not found'}
+        send_message(peer_socket, response)
+        
+    def serve_download(self, peer_socket, request):
+        """Send a whole file, or the byte range given by offset/length"""
+        filename = request.get('filename')
+        filepath = self.peer_path(filename)
+        
+        if filepath is None or not filepath.is_file():
+            response = {'status': 'error', 'message': 'File not found'}
+            send_message(peer_socket, response)
+            return
+            
+        # Stream the file in blocks instead of reading it whole
+        with open(filepath, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            offset = request.get('offset', 0)
+            length = request.get('length', file_size - offset)
+            if not (0 <= offset <= file_size and 0 <= length <= file_size - offset):
+                send_message(peer_socket, {'status': 'error', 'message': 'Invalid range'})
+                return
+            codec = choose_codec(request.get('codecs'), filepath, f, length, self.compression_cache)
+                
+            # Wait for an upload slot, or tell the peer when to come back
+            peer = request.get('hostname') or peer_socket.getpeername()[0]
+            if not self.uploads.acquire(peer):
+                send_message(peer_socket, {
+                    'status': 'busy',
+                    'message': 'No upload slot free, try again later',
+                    'retry_after': self.uploads.retry_after()
+                })
+                return
+            response = {
+                'status': 'success',
+                'filename': filename,
+                'size': length,
+                'offset': offset,
+                'file_size': file_size
+            }
+            if codec:
+                response['codec'] = codec
+            try:
+                send_message(peer_socket, response)
+                if recv_message(peer_socket) is None:  # Wait for acknowledgment
+                    return
+                    
+                # A rate-limited downloader may take longer than the timeout per block
+                peer_socket.settimeout(None)
+                
+                # Send file data
+                f.seek(offset)
+                throttle = self.limits.throttle('upload')
+                if codec:
+                    send_compressed(peer_socket, f, length, codec, filepath, self.compression_cache,
+                                    throttle=throttle)
+                else:
+                    send_file_data(peer_socket, f, length, throttle=throttle)
+            finally:
+                self.uploads.release(peer)
+        print(f"[CLIENT] Sent file '{filename}' to peer")
+        
+    def serve_delta(self, peer_socket, request):
+        """Send a file as a delta against the requester's old copy
+
+        The request carries the block size, the size of the old copy and
+        the [weak, strong] signature of each of its blocks. The response
+        lists the ops; the data of the new ranges follows the acknowledgment.
+        """
+        filename = request.get('filename')
+        filepath = self.peer_path(filename)
+        block_size = request.get('block_size')
+        old_size = request.get('old_size')
+        old_signatures = request.get('signatures')
+        if not (isinstance(block_size, int) and MIN_DELTA_BLOCK <= block_size <= MAX_DELTA_BLOCK
+                and isinstance(old_size, int) and isinstance(old_signatures, list)
+                and len(old_signatures) == (old_size + block_size - 1) // block_size):
+            send_message(peer_socket, {'status': 'error', 'message': 'Invalid delta request'})
+            return
+        if filepath is None or not filepath.is_file():
+            send_message(peer_socket, {'status': 'error', 'message': 'File not found'})
+            return
+            
+        peer = request.get('hostname') or peer_socket.getpeername()[0]
+        if not self.uploads.acquire(peer):
+            send_message(peer_socket, {
+                'status': 'busy',
+                'message': 'No upload slot free, try again later',
+                'retry_after': self.uploads.retry_after()
+            })
+            return
+        try:
+            with open(filepath, 'rb') as f:
+                ops = compute_delta(f, block_size, old_signatures, old_size)
+                data_bytes = sum(length for kind, _, length in ops if kind == 'data')
+                send_message(peer_socket, {
+                    'status': 'success',
+                    'filename': filename,
+                    'size': os.fstat(f.fileno()).st_size,
+                    'ops': wire_ops(ops),
+                    'data_bytes': data_bytes
+                })
+                if recv_message(peer_socket) is None:  # Wait for acknowledgment
+                    return
+                peer_socket.settimeout(None)
+                send_delta_data(peer_socket, f, ops, throttle=self.limits.throttle('upload'))
+        finally:
+            self.uploads.release(peer)
+        print(f"[CLIENT] Sent '{filename}' to peer as a delta ({data_bytes} new bytes)")
+        
+    def resolve_path(self, filename):
+        """Path of a published file: its in-place source, or the repository copy"""
+        source = self.published.get(filename)
+        if source is not None:
+            return Path(source)
+        return self.repository_path / filename
+        
+    def peer_path(self, filename):
+        """resolve_path() for a name sent by a peer, or None if it is not a published file
+
+        Names that lead out of the repository (absolute, through '..' or a
+        linked directory) and the client's own bookkeeping files are
+        refused. The last component is not resolved: a file imported with
+        --link may be a symlink to the user's file.
+        """
+        if not isinstance(filename, str) or not filename:
+            return None
+        if self.published.get(filename) is not None:
+            return self.resolve_path(filename)
+        path = self.repository_path / filename
+        root = self.repository_path.resolve()
+        parent = path.parent.resolve()
+        if path.name in ('', '.', '..') or (parent != root and root not in parent.parents):
+            return None
+        first = (parent / path.name).relative_to(root).parts[0]
+        if first in (PARTIAL_DIR, REGISTRY_FILE, CHUNKS_FILE, PEER_STATS_FILE):
+            return None
+        return path
+        
+    def publish(self, local_path, filename, mode=None):
         """Publish a file to the repository"""
         try:
             # Check if local file exists
-            if not os.path.exists(local_path):
+            if not os.path.isfile(local_path):
                 return False, f"Local file not found: {local_path}"
             
-            # Copy file to repository
-            dest_path = self.repository_path / filename
-            shutil.copy2(local_path, dest_path)
-            print(f"[CLIENT] Copied '{local_path}' to repository as '{filename}'")
+            method, manifest = self.import_file(local_path, filename, mode)
+            self.published.save()
+            print(f"[CLIENT] Imported '{local_path}' into repository as '{filename}' ({method})")
             
             # Notify server
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.server_host, self.server_port))
+            return self.announce(filename, manifest)
+                
+        except Exception as e:
+            return False, str(e)
             
-            request = {
-                'command': 'publish',
-                'hostname': self.hostname,
-                'filename': filename
-            }
+    def import_file(self, local_path, filename, mode=None):
+        """Bring a file into the repository and hash its pieces
+
+        'copy' copies the data, hashing it in the same pass. 'link'
+        hardlinks, reflinks or symlinks the source instead, copying only
+        when it is on another device. 'inplace' leaves the file where it is
+        and records its path in the published registry (saved by the
+        caller). Returns (method, manifest).
+        """
+        mode = mode or self.import_mode
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"Unknown import mode: {mode}")
+        dest_path = self.repository_path / filename
+        if mode == 'inplace':
+            # The registered source supersedes any older repository copy
+            manifest = hash_file(local_path)
+            dest_path.unlink(missing_ok=True)
+            self.published.add(filename, local_path)
+            return 'in place', manifest
             
-            sock.send(json.dumps(request).encode('utf-8'))
-            response = json.loads(sock.recv(4096).decode('utf-8'))
-            sock.close()
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        self.published.remove(filename)
+        method, manifest = place_file(local_path, dest_path, mode)
+        self.chunks.set_linked(filename, method in ('hardlink', 'symlink'))
+        if method == 'copy' and self.link_duplicate(filename, manifest):
+            method = 'deduplicated'
+        return method, manifest
+        
+    def link_duplicate(self, filename, manifest):
+        """Make filename a hardlink to a repository file with the same content
+
+        Returns the name of that file, or None if there is no such file (or
+        it no longer matches its recorded root hash). Only copies the
+        repository owns are linked to: files served in place or imported
+        with --link share the user's data and can change under the
+        repository.
+        """
+        dest_path = self.repository_path / filename
+        for other in sorted(self.chunks.with_root(manifest['root'])):
+            if (other == filename or self.published.get(other) is not None
+                    or self.chunks.is_linked(other)):
+                continue
+            other_path = self.repository_path / other
+            try:
+                if other_path.is_symlink() or other_path.stat().st_size != manifest['size']:
+                    continue
+                if hash_file(other_path)['root'] != manifest['root']:
+                    self.chunks.remove(other)  # changed since it was indexed
+                    continue
+                dest_path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = dest_path.with_name(dest_path.name + '.link')
+                temp_path.unlink(missing_ok=True)
+                os.link(other_path, temp_path)
+                os.replace(temp_path, dest_path)
+            except OSError:
+                continue
+            return other
+        return None
+        
+    def publish_many(self, local_dir, prefix=None, mode=None):
+        """Publish every file under a directory
+
+        Files are imported into the repository on a thread pool and
+        announced to the server in batched publish requests, pipelined on
+        the session. Each file is published under its path relative to
+        local_dir, optionally below prefix.
+        """
+        try:
+            root = Path(local_dir)
+            if not root.is_dir():
+                return False, f"Local directory not found: {local_dir}"
+                
+            sources = []
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    path = Path(dirpath) / name
+                    relative = path.relative_to(root).as_posix()
+                    sources.append((path, f"{prefix}/{relative}" if prefix else relative))
+            if not sources:
+                return False, f"No files found in {local_dir}"
+                
+            print(f"[CLIENT] Importing {len(sources)} file(s) from '{local_dir}'...")
             
-            if response['status'] == 'success':
-                print(f"[CLIENT] Published '{filename}' to server")
-                return True, "File published successfully"
-            else:
-                return False, response.get('message', 'Unknown error')
+            pending = []
+            batch = []
+            batch_pieces = 0
+            failures = []
+            with ThreadPoolExecutor(max_workers=self.import_workers) as pool:
+                imports = pool.map(lambda source: self._import_entry(*source, mode), sources)
+                for (path, filename), (entry, error) in zip(sources, imports):
+                    if error:
+                        failures.append(f"{path}: {error}")
+                        continue
+                    batch.append(entry)
+                    batch_pieces += len(entry['manifest']['pieces'])
+                    # Bound each message by file count and by manifest size
+                    if len(batch) >= self.publish_batch_size or batch_pieces >= MAX_BATCH_PIECES:
+                        pending.append(self.submit_publish_batch(batch))
+                        batch = []
+                        batch_pieces = 0
+            if batch:
+                pending.append(self.submit_publish_batch(batch))
+            self.published.save()
+            self.save_chunks()
                 
+            published = 0
+            for future in pending:
+                response = future.result(self.session.timeout)
+                if response['status'] == 'success':
+                    published += response['published']
+                else:
+                    failures.append(response.get('message', 'Unknown error'))
+                    
+            print(f"[CLIENT] Published {published} file(s) to server")
+            if failures:
+                return False, f"{len(failures)} file(s) failed, first: {failures[0]}"
+            return True, f"{published} files published successfully"
+            
         except Exception as e:
             return False, str(e)
             
-    def fetch(self, filename):
-        """Fetch a file from a peer"""
+    def _import_entry(self, local_path, filename, mode=None):
+        """Import one file for publish_many; returns (entry, error)"""
+        try:
+            manifest = self.import_file(local_path, filename, mode)[1]
+            self.chunks.add(filename, manifest)
+            return {'filename': filename, 'manifest': manifest}, None
+        except Exception as e:
+            return None, str(e)
+            
+    def submit_publish_batch(self, entries):
+        """Send one batched publish request without waiting for the reply"""
+        return self.session.submit({
+            'command': 'publish',
+            'hostname': self.hostname,
+            'files': entries
+        })
+            
+    def announce(self, filename, manifest=None):
+        """Tell the server that a repository file is available from this client"""
+        request = {
+            'command': 'publish',
+            'hostname': self.hostname,
+            'filename': filename
+        }
+        if manifest is not None:
+            request['manifest'] = manifest
+            self.chunks.add(filename, manifest)
+            self.save_chunks()
+        
+        response = self.session.request(request)
+        
+        if response['status'] == 'success':
+            print(f"[CLIENT] Published '{filename}' to server")
+            return True, "File published successfully"
+        else:
+            return False, response.get('message', 'Unknown error')
+            
+    def search(self, query, mode=None, limit=SEARCH_PAGE, cursor=None):
+        """Ask the tracker for published filenames matching a query
+
+        Returns (True, results, next_cursor) or (False, message, None).
+        """
+        request = {'command': 'search', 'query': query, 'limit': limit}
+        if mode:
+            request['mode'] = mode
+        if cursor is not None:
+            request['cursor'] = cursor
+        try:
+            response = self.session.request(request)
+        except Exception as e:
+            return False, str(e), None
+        if response['status'] != 'success':
+            return False, response.get('message', 'Unknown error'), None
+        return True, response['results'], response.get('next_cursor')
+        
+    def fetch(self, filename, swarm=False):
+        """Fetch a file from a peer, or from all peers at once when swarm is set"""
         try:
             print(f"[CLIENT] Fetching '{filename}'...")
             
             # Ask server for peers with the file
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.server_host, self.server_port))
-            
             request = {
                 'command': 'fetch',
                 'hostname': self.hostname,
                 'filename': filename
             }
             
-            sock.send(json.dumps(request).encode('utf-8'))
-            response = json.loads(sock.recv(4096).decode('utf-8'))
-            sock.close()
+            response = self.session.request(request)
             
             if response['status'] != 'success':
                 return False, response.get('message', 'Unknown error')
                 
             peers = response['peers']
+            manifest = response.get('manifest')
+            if manifest is not None:
+                # The same content under another name needs no transfer at all
+                other = self.link_duplicate(filename, manifest)
+                if other is not None:
+                    self.finish_local(filename)
+                    self.announce(filename, manifest)
+                    print(f"[CLIENT] Successfully fetched '{filename}'")
+                    return True, f"Same content as '{other}', linked without downloading"
             if not peers:
                 return False, 'No peers found with the file'
                 
+            # Best peer first: probed latency and load, weighed with past throughput
+            peers = self.rank_peers(peers, manifest['size'] if manifest else RANGE_SIZE)
             print(f"[CLIENT] Found {len(peers)} peer(s) with the file:")
             for i, peer in enumerate(peers, 1):
                 print(f"  {i}. {peer['hostname']} ({peer['ip']}:{peer['port']})")
             
-            # Select peer to download from
-            if len(peers) == 1:
-                # Only one peer available, use it directly
-                peer = peers[0]
-                print(f"[CLIENT] Downloading from {peer['hostname']}...")
-            else:
-                # Multiple peers available, let user choose
-                while True:
-                    try:
-                        choice = input(f"[CLIENT] Choose a peer (1-{len(peers)}): ").strip()
-                        peer_index = int(choice) - 1
-                        if 0 <= peer_index < len(peers):
-                            peer = peers[peer_index]
-                            print(f"[CLIENT] Downloading from {peer['hostname']}...")
-                            break
-                        else:
-                            print(f"[ERROR] Please enter a number between 1 and {len(peers)}")
-                    except ValueError:
-                        print("[ERROR] Please enter a valid number")
-                    except KeyboardInterrupt:
-                        print("\n[CLIENT] Download cancelled")
-                        return False, "User cancelled download"
+            if manifest is not None and self.is_delta_candidate(filename, manifest):
+                success, message = self.delta_download(peers[0], filename, manifest)
+                if success:
+                    self.announce(filename, manifest)
+                    print(f"[CLIENT] Successfully fetched '{filename}'")
+                    return success, message
+                print(f"[CLIENT] Delta sync failed ({message}), downloading the whole file")
             
-            success, message = self.download_from_peer(peer, filename)
+            if swarm:
+                success, message = self.swarm_download(peers, filename, manifest)
+                if success:
+                    self.announce(filename, manifest)
+                    print(f"[CLIENT] Successfully fetched '{filename}'")
+                return success, message
+            
+            success, message = self.download_from_peers(peers, filename, manifest)
             
             if success:
-                # Publish the downloaded file
-                local_path = str(self.repository_path / filename)
-                self.publish(local_path, filename)
+                # Announce the downloaded file so others can fetch it from us
+                self.announce(filename, manifest)
                 print(f"[CLIENT] Successfully fetched '{filename}'")
                 
             return success, message
@@ -214,59 +659,461 @@ class P2PClient:
         except Exception as e:
             return False, str(e)
             
-    def download_from_peer(self, peer, filename):
-        """Download a file from a specific peer"""
+    def probe_peer(self, peer):
+        """Measure a peer's round-trip time; returns its uploads in progress
+
+        Returns None if the peer cannot be reached. A peer that does not
+        know the probe command is reachable, with the load the server reported.
+        """
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((peer['ip'], peer['port']))
-            
-            request = {
-                'command': 'download',
-                'filename': filename
-            }
+            with socket.create_connection((peer['ip'], peer['port']), timeout=PROBE_TIMEOUT) as sock:
+                started = time.perf_counter()
+                send_message(sock, {'command': 'probe'})
+                response = recv_message(sock)
+                rtt = time.perf_counter() - started
+        except OSError:
+            self.peer_stats.record_failure(peer['hostname'])
+            return None
+        if response is None:
+            self.peer_stats.record_failure(peer['hostname'])
+            return None
+        self.peer_stats.record_rtt(peer['hostname'], rtt)
+        if response['status'] == 'success':
+            return response.get('uploads', 0)
+        return peer.get('load', 0)
+        
+    def estimate_seconds(self, peer, size, load):
+        """Expected time to download size bytes from a peer serving load uploads"""
+        stats = self.peer_stats.get(peer['hostname']) or {}
+        throughput = stats.get('throughput') or ASSUMED_THROUGHPUT
+        seconds = (stats.get('rtt') or 0.0) + size * (load + 1) / throughput
+        # Each failure per transfer doubles the estimate, so flaky peers sink
+        return seconds * (1 + stats.get('failures', 0) / (stats.get('transfers', 0) + 1))
+        
+    def rank_peers(self, peers, size):
+        """Order peers by expected download time, probing them in parallel
+
+        Unreachable peers go last, in the order the server gave them.
+        """
+        if len(peers) < 2:
+            return list(peers)
+        with ThreadPoolExecutor(max_workers=min(len(peers), PROBE_WORKERS)) as executor:
+            loads = list(executor.map(self.probe_peer, peers))
+        reachable = [(self.estimate_seconds(peer, size, load), i)
+                     for i, (peer, load) in enumerate(zip(peers, loads)) if load is not None]
+        order = [i for _, i in sorted(reachable)]
+        order += [i for i, load in enumerate(loads) if load is None]
+        return [peers[i] for i in order]
+        
+    def open_download(self, peer, request, timeout=None):
+        """Send a download request to a peer; returns (socket, response)
+
+        On success the acknowledgment has been sent and the file data is
+        ready to be read from the returned socket.
+        """
+        started = time.perf_counter()
+        sock = socket.create_connection((peer['ip'], peer['port']), timeout=timeout)
+        # The TCP handshake takes one round trip
+        self.peer_stats.record_rtt(peer['hostname'], time.perf_counter() - started)
+        try:
+            send_message(sock, request)
+            response = recv_message(sock)
+            if response is None:
+                raise ConnectionError('Peer closed the connection')
+            if response['status'] == 'success':
+                # Send acknowledgment
+                send_message(sock, {'command': 'ack'})
+                return sock, response
+        except Exception:
+            sock.close()
+            raise
+        sock.close()
+        return None, response
+        
+    def is_delta_candidate(self, filename, manifest):
+        """Whether an older copy of filename is held and worth a delta sync"""
+        if not self.delta_sync:
+            return False
+        old_manifest = self.chunks.get(filename)
+        if old_manifest is not None and old_manifest['root'] == manifest['root']:
+            return False  # same version: its pieces are reused as they are
+        try:
+            return self.resolve_path(filename).stat().st_size >= DELTA_MIN_SIZE
+        except OSError:
+            return False
+        
+    def delta_download(self, peer, filename, manifest):
+        """Fetch a new version of a held file as a delta against the old copy
+
+        The new file is built next to the old one from the old copy's
+        matching blocks and the new data, checked against the manifest's
+        root hash, and only then moved into place.
+        """
+        old_path = self.resolve_path(filename)
+        block_size = block_size_for(old_path.stat().st_size)
+        request = {
+            'command': 'delta',
+            'hostname': self.hostname,
+            'filename': filename,
+            'block_size': block_size,
+            'old_size': old_path.stat().st_size,
+            'signatures': signatures(old_path, block_size)
+        }
+        print(f"[CLIENT] Requesting a delta from {peer['hostname']}...")
+        try:
+            sock, response = self.open_download(peer, request, timeout=self.stall_timeout)
+        except Exception as e:
+            self.peer_stats.record_failure(peer['hostname'])
+            return False, str(e)
+        if sock is None:
+            return False, response.get('message', 'Unknown error')
             
-            sock.send(json.dumps(request).encode('utf-8'))
-            response = json.loads(sock.recv(4096).decode('utf-8'))
+        temp_path = self.repository_path / PARTIAL_DIR / (filename + '.delta')
+        temp_path.parent.mkdir(parents=True, exist_ok=True)
+        builder = ManifestBuilder(manifest['piece_size'])
+        throttle = self.limits.throttle('download')
+        started = time.perf_counter()
+        try:
+            with open(old_path, 'rb') as old, open(temp_path, 'wb') as new:
+                for op in response['ops']:
+                    if len(op) == 1:
+                        recv_file_data(sock, new, op[0], hasher=builder, throttle=throttle)
+                        continue
+                    old.seek(op[0])
+                    remaining = op[1]
+                    while remaining:
+                        data = old.read(min(BLOCK_SIZE, remaining))
+                        if not data:
+                            raise EOFError('Old copy changed during the delta sync')
+                        builder.update(data)
+                        new.write(data)
+                        remaining -= len(data)
+        except Exception as e:
+            self.peer_stats.record_failure(peer['hostname'])
+            temp_path.unlink(missing_ok=True)
+            return False, str(e)
+        finally:
+            sock.close()
+        self.peer_stats.record_transfer(peer['hostname'], response['data_bytes'],
+                                        time.perf_counter() - started)
+        self.save_peer_stats()
+        if builder.finish()['root'] != manifest['root']:
+            temp_path.unlink(missing_ok=True)
+            return False, 'delta result does not match the manifest'
             
-            if response['status'] != 'success':
-                sock.close()
-                return False, response.get('message', 'Unknown error')
+        os.replace(temp_path, self.repository_path / filename)
+        self.finish_local(filename)
+        return True, (f"File updated from {peer['hostname']} with {response['data_bytes']} "
+                      f"new bytes of {manifest['size']}")
+        
+    def download_from_peers(self, peers, filename, manifest=None):
+        """Download from the first peer that can serve the file, in order
+
+        Each attempt resumes the partial download. Peers that answered busy
+        get another round after the shortest retry hint they gave.
+        """
+        success, message = False, 'No peer could serve the file'
+        for _ in range(self.busy_retries + 1):
+            busy = []
+            for peer in peers:
+                try:
+                    success, message = self.download_from_peer(peer, filename, manifest)
+                except PeerBusy as e:
+                    print(f"[CLIENT] {peer['hostname']} is busy")
+                    busy.append((e.retry_after, peer))
+                    message = f"{peer['hostname']} is busy"
+                    continue
+                if success:
+                    return success, message
+                print(f"[CLIENT] Download from {peer['hostname']} failed: {message}")
+            if not busy:
+                break
+            delay = min(retry_after for retry_after, _ in busy)
+            print(f"[CLIENT] Retrying busy peer(s) in {delay} seconds")
+            time.sleep(delay)
+            peers = [peer for _, peer in busy]
+        return success, message
+        
+    def download_from_peer(self, peer, filename, manifest=None):
+        """Download a file from a specific peer, resuming an earlier attempt
+
+        With a manifest every piece is verified as it arrives, and pieces
+        that fail are requested again on their own. Raises PeerBusy if the
+        peer has no upload slot free.
+        """
+        try:
+            partial, message = self.open_partial([peer], filename, manifest)
+            if partial is None:
+                return False, message
                 
-            # Send acknowledgment
-            sock.send(b'OK')
-            
-            # Receive file data
-            file_size = response['size']
-            file_data = b''
-            
-            while len(file_data) < file_size:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                file_data += chunk
+            print(f"[CLIENT] Downloading from {peer['hostname']}...")
+            try:
+                for _ in range(self.verify_attempts):
+                    ranges = partial.missing_ranges()
+                    if not ranges:
+                        break
+                    for offset, length in ranges:
+                        self.download_range(peer, filename, partial, offset, length, manifest)
+            except PeerBusy:
+                partial.save(force=True)
+                raise
+            except Exception as e:
+                return False, self.interrupted_message(partial, e)
+            finally:
+                self.save_peer_stats()
+                
+            if not partial.is_complete():
+                partial.save(force=True)
+                return False, f"Pieces from {peer['hostname']} kept failing verification"
                 
+            self.finish_partial(partial, filename)
+            return True, f'File downloaded from {peer["hostname"]}'
+            
+        except PeerBusy:
+            raise
+        except Exception as e:
+            return False, str(e)
+            
+    def open_partial(self, peers, filename, manifest=None):
+        """Load or create the partial download state for a file
+
+        The size comes from the manifest when there is one, otherwise from
+        a stat request. Returns (partial, message); partial is None if the
+        size could not be determined.
+        """
+        if manifest is not None:
+            file_size = manifest['size']
+            piece_size = manifest['piece_size']
+            root = manifest['root']
+        else:
+            file_size = self.stat_from_peers(peers, filename)
+            piece_size = PIECE_SIZE
+            root = None
+        if file_size is None:
+            return None, 'No peer could report the file size'
+        partial = PartialDownload.open(self.repository_path, filename, file_size, piece_size, root)
+        done = partial.done_bytes()
+        if done:
+            print(f"[CLIENT] Resuming '{filename}': {done}/{file_size} bytes already downloaded")
+        if manifest is not None:
+            self.fill_from_chunks(partial, manifest)
+        return partial, None
+        
+    def fill_from_chunks(self, partial, manifest):
+        """Copy missing pieces that the repository already holds into a download
+
+        Each piece is hashed as it is read, so only data matching the
+        manifest is used; a file that no longer matches is dropped from the
+        chunk index. Returns the number of bytes reused.
+        """
+        reused = 0
+        sources = {}  # {filename: open file}
+        try:
+            with open(partial.part_path, 'r+b') as part:
+                for index, digest in enumerate(manifest['pieces']):
+                    if index in partial.done:
+                        continue
+                    for other, offset, length in self.chunks.locate(digest):
+                        try:
+                            source = sources.get(other)
+                            if source is None:
+                                source = sources[other] = open(self.resolve_path(other), 'rb')
+                            source.seek(offset)
+                            data = source.read(length)
+                        except OSError:
+                            continue
+                        if hashlib.sha256(data).hexdigest() != digest:
+                            self.chunks.remove(other)
+                            continue
+                        part.seek(partial.piece_range(index)[0])
+                        part.write(data)
+                        partial.mark_done(index)
+                        reused += length
+                        break
+        finally:
+            for source in sources.values():
+                source.close()
+        if reused:
+            partial.save(force=True)
+            print(f"[CLIENT] Reused {reused} bytes already in the repository")
+        return reused
+        
+    def finish_partial(self, partial, filename):
+        """Move a completed download into the repository"""
+        dest_path = self.repository_path / filename
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        partial.finish(dest_path)
+        self.finish_local(filename)
+        
+    def finish_local(self, filename):
+        """Forget what was known about the old version of a replaced file"""
+        self.chunks.remove(filename)
+        self.chunks.set_linked(filename, False)
+        if self.published.remove(filename):
+            # The new repository copy replaces a file that was served in place
+            self.published.save()
+        
+    def interrupted_message(self, partial, error):
+        """Save progress after a failed download and describe it"""
+        partial.save(force=True)
+        return (f"Download interrupted ({error}); {partial.done_bytes()}/{partial.size} bytes "
+                f"kept, fetch again to resume")
+        
+    def stat_from_peers(self, peers, filename):
+        """Ask peers for a file's size; returns the first answer"""
+        for peer in peers:
+            try:
+                with socket.create_connection((peer['ip'], peer['port']), timeout=self.stall_timeout) as sock:
+                    send_message(sock, {'command': 'stat', 'filename': filename})
+                    response = recv_message(sock)
+                if response and response['status'] == 'success':
+                    return response['size']
+            except OSError:
+                self.peer_stats.record_failure(peer['hostname'])
+                continue
+        return None
+        
+    def download_range(self, peer, filename, partial, offset, length, manifest=None, transfer=None):
+        """Download one piece-aligned byte range into a partial download
+
+        Returns the (offset, length) of pieces that failed verification
+        against the manifest; they are left missing so they can be fetched
+        again on their own. Raises PeerBusy if the peer has no upload slot.
+        Cancelling transfer (a swarm.Transfer) shuts the connection down.
+        """
+        request = {
+            'command': 'download',
+            'hostname': self.hostname,
+            'filename': filename,
+            'offset': offset,
+            'length': length
+        }
+        if self.codecs:
+            request['codecs'] = self.codecs
+        
+        # The timeout turns a stalled peer into an error so the range is reassigned
+        try:
+            sock, response = self.open_download(peer, request, timeout=self.stall_timeout)
+        except Exception:
+            self.peer_stats.record_failure(peer['hostname'])
+            raise
+        if sock is None:
+            if response.get('status') == 'busy':
+                # Not the peer's fault: it is serving others
+                raise PeerBusy(response.get('message', 'Peer busy'), response.get('retry_after', 1.0))
+            self.peer_stats.record_failure(peer['hostname'])
+            raise ConnectionError(response.get('message', 'Unknown error'))
+        if transfer is not None:
+            transfer.on_cancel(lambda: sock.shutdown(socket.SHUT_RDWR))
+        corrupt = []
+        throttle = self.limits.throttle('download')
+        started = time.perf_counter()
+        try:
+            if response['size'] != length:
+                raise ConnectionError(f"Peer offered {response['size']} bytes, expected {length}")
+            # A compressed range arrives as frames that are decoded on the way in
+            reader = FrameReader(sock, response['codec']) if response.get('codec') else None
+            with open(partial.part_path, 'r+b') as f:
+                f.seek(offset)
+                first = offset // partial.piece_size
+                last = (offset + length + partial.piece_size - 1) // partial.piece_size
+                for index in range(first, last):
+                    if transfer is not None and transfer.cancelled:
+                        raise ConnectionError("Range finished by another peer")
+                    piece_length = partial.piece_range(index)[1]
+                    hasher = hashlib.sha256() if manifest is not None else None
+                    if reader is not None:
+                        reader.recv_file_data(f, piece_length, hasher=hasher, throttle=throttle)
+                    else:
+                        recv_file_data(sock, f, piece_length, hasher=hasher, throttle=throttle)
+                    if hasher is not None and hasher.hexdigest() != manifest['pieces'][index]:
+                        print(f"[CLIENT] Piece {index} of '{filename}' from {peer['hostname']} failed verification")
+                        corrupt.append(partial.piece_range(index))
+                        continue
+                    # Record each piece once it has been written out
+                    f.flush()
+                    partial.mark_done(index)
+                    partial.save()
+        except Exception:
+            if transfer is None or not transfer.cancelled:
+                self.peer_stats.record_failure(peer['hostname'])
+            raise
+        finally:
             sock.close()
+        if corrupt:
+            self.peer_stats.record_failure(peer['hostname'])
+        self.peer_stats.record_transfer(peer['hostname'], length, time.perf_counter() - started)
+        return corrupt
             
-            # Save file
-            filepath = self.repository_path / filename
-            with open(filepath, 'wb') as f:
-                f.write(file_data)
+    def swarm_download(self, peers, filename, manifest=None):
+        """Download a file in ranges from several peers in parallel"""
+        try:
+            partial, message = self.open_partial(peers, filename, manifest)
+            if partial is None:
+                return False, message
                 
-            return True, f'File downloaded from {peer["hostname"]}'
+            print(f"[CLIENT] Swarming {partial.size} bytes from {len(peers)} peer(s)...")
+            
+            # Ranges are written straight into place in the .part file
+            download = SwarmDownload(
+                peers,
+                partial.size,
+                lambda peer, offset, length, transfer: self.download_range(
+                    peer, filename, partial, offset, length, manifest, transfer),
+                workers=self.swarm_workers,
+                ranges=partial.missing_ranges(max_length=RANGE_SIZE)
+            )
+            try:
+                bytes_from = download.run()
+            except Exception as e:
+                return False, self.interrupted_message(partial, e)
+            finally:
+                self.save_peer_stats()
+            if not partial.is_complete():
+                return False, self.interrupted_message(partial, 'pieces missing after swarm')
+                
+            self.finish_partial(partial, filename)
+            sources = ', '.join(f"{host} ({count} bytes)" for host, count in bytes_from.items() if count)
+            return True, f'File downloaded from {sources or "peers"}'
             
         except Exception as e:
             return False, str(e)
             
     def list_repository_files(self):
-        """List files in the local repository"""
-        files = [f.name for f in self.repository_path.iterdir() if f.is_file()]
-        return files
+        """List files in the local repository, including subdirectories"""
+        files = set(self.published.names())
+        for dirpath, dirnames, filenames in os.walk(self.repository_path):
+            # In-progress downloads are not repository files
+            dirnames[:] = [d for d in dirnames if d != PARTIAL_DIR]
+            for name in filenames:
+                files.add((Path(dirpath) / name).relative_to(self.repository_path).as_posix())
+        files.discard(REGISTRY_FILE)
+        files.discard(PEER_STATS_FILE)
+        files.discard(CHUNKS_FILE)
+        return sorted(files)
+        
+    def save_chunks(self):
+        """Persist the chunk index; it can be rebuilt by publishing again"""
+        try:
+            self.chunks.save()
+        except OSError as e:
+            print(f"[CLIENT] Could not save the chunk index: {e}")
+        
+    def save_peer_stats(self):
+        """Persist the peer statistics; a failure only costs the history"""
+        try:
+            self.peer_stats.save()
+        except OSError as e:
+            print(f"[CLIENT] Could not save peer statistics: {e}")
         
     def stop(self):
-        """Stop the peer server"""
+        """Stop the peer server, heartbeats and the server session"""
         self.running = False
+        self.heartbeat_stop.set()
         if self.peer_server_socket:
             self.peer_server_socket.close()
+        self.session.close()
+        self.save_peer_stats()
 
 
 def main():
@@ -313,8 +1160,15 @@ def main():
     print("\n" + "=" * 60)
     print("Client Commands:")
     print("  publish <lname> <fname> - Publish a local file to repository")
-    print("  fetch <fname>           - Fetch a file from peers")
+    print("  publish <dir> [prefix]  - Publish every file under a directory")
+    print("    [--link|--inplace]      link or serve in place instead of copying")
+    print("                            (a copy identical to a repository file is stored once)")
+    print("  fetch <fname> [--swarm] - Fetch a file from peers")
+    print("  search <query>          - Find files published on the network")
+    print("    [--prefix|--glob]         match a prefix or glob instead of a substring")
     print("  list                    - List files in local repository")
+    print("  stats                   - Show transfer statistics per peer")
+    print("  limit [up|down <rate>]  - Show or set bandwidth limits")
     print("  quit                    - Exit client")
     print("=" * 60)
     
@@ -333,37 +1187,121 @@ def main():
                 break
                 
             elif cmd == 'publish':
-                if len(parts) < 3:
-                    print("Usage: publish <lname> <fname>")
-                    print("  lname - local file path")
-                    print("  fname - name to publish as")
+                mode = None
+                if '--link' in parts:
+                    mode = 'link'
+                elif '--inplace' in parts:
+                    mode = 'inplace'
+                parts = [part for part in parts if part not in ('--link', '--inplace')]
+                if len(parts) >= 2 and os.path.isdir(parts[1]):
+                    # Bulk import: every file under the directory
+                    prefix = parts[2] if len(parts) > 2 else None
+                    success, message = client.publish_many(parts[1], prefix, mode)
+                    print(f"[CLIENT] {message}" if success else f"[ERROR] {message}")
+                elif len(parts) < 3:
+                    print("Usage: publish <lname> <fname> [--link|--inplace]")
+                    print("       publish <dir> [prefix] [--link|--inplace]")
+                    print("  lname     - local file path")
+                    print("  fname     - name to publish as")
+                    print("  dir       - publish every file under a directory")
+                    print("  --link    - hardlink/reflink/symlink instead of copying")
+                    print("  --inplace - serve the file from where it is")
+                    print("A copy identical to a repository file is hardlinked to it; files that")
+                    print("differ at all, even versions of one file, are each stored in full.")
                 else:
                     lname = parts[1]
                     fname = parts[2]
-                    success, message = client.publish(lname, fname)
+                    success, message = client.publish(lname, fname, mode)
                     if not success:
                         print(f"[ERROR] {message}")
                         
             elif cmd == 'fetch':
                 if len(parts) < 2:
-                    print("Usage: fetch <fname>")
+                    print("Usage: fetch <fname> [--swarm]")
+                    print("  --swarm - download ranges from all peers in parallel")
                 else:
                     fname = parts[1]
-                    success, message = client.fetch(fname)
+                    swarm = '--swarm' in parts[2:]
+                    success, message = client.fetch(fname, swarm=swarm)
                     if not success:
                         print(f"[ERROR] {message}")
                         
+            elif cmd == 'search':
+                words = [part for part in parts[1:] if not part.startswith('--')]
+                if len(words) != 1:
+                    print("Usage: search <query> [--prefix|--substring|--glob]")
+                    print("  query - part of a filename; with * ? [...] it is a glob")
+                    continue
+                flags = [part[2:] for part in parts[1:] if part in ('--prefix', '--substring', '--glob')]
+                cursor = None
+                while True:
+                    success, results, cursor = client.search(words[0], flags[0] if flags else None,
+                                                             cursor=cursor)
+                    if not success:
+                        print(f"[ERROR] {results}")
+                        break
+                    if not results and cursor is None:
+                        print("No matching files")
+                    for entry in results:
+                        print(f"  - {entry['filename']} ({entry['peers']} peer(s))")
+                    if cursor is None:
+                        break
+                    if input("More? [y/N] ").strip().lower() != 'y':
+                        break
+                    
             elif cmd == 'list':
                 files = client.list_repository_files()
                 if files:
                     print(f"\nLocal repository ({len(files)} files):")
                     for f in files:
-                        filepath = client.repository_path / f
-                        size = filepath.stat().st_size
-                        print(f"  - {f} ({size} bytes)")
+                        filepath = client.resolve_path(f)
+                        try:
+                            size = f"{filepath.stat().st_size} bytes"
+                        except OSError:
+                            size = "missing"
+                        print(f"  - {f} ({size})")
                 else:
                     print("Repository is empty")
                     
+            elif cmd == 'limit':
+                if len(parts) == 1:
+                    for direction, rates in client.limits.describe().items():
+                        print(f"  {direction:<8} total {format_rate(rates['total'])}, "
+                              f"per connection {format_rate(rates['per_connection'])}")
+                elif len(parts) < 3 or parts[1] not in ('up', 'down'):
+                    print("Usage: limit <up|down> <rate> [--conn]")
+                    print("  rate   - bytes per second, e.g. 512K, 10M (0 = unlimited)")
+                    print("  --conn - limit each connection instead of the total")
+                else:
+                    try:
+                        rate = parse_rate(parts[2])
+                    except ValueError:
+                        print(f"[ERROR] Invalid rate: {parts[2]}")
+                        continue
+                    direction = 'upload' if parts[1] == 'up' else 'download'
+                    per_connection = '--conn' in parts[3:]
+                    client.limits.set(direction, rate, per_connection)
+                    scope = 'per connection' if per_connection else 'total'
+                    print(f"[CLIENT] {direction.capitalize()} limit ({scope}): {format_rate(rate)}")
+                    
+            elif cmd == 'stats':
+                peers = client.peer_stats.summary()
+                if peers:
+                    print(f"\n{'Peer':<16} {'Transfers':>9} {'Bytes':>12} {'MB/s':>8} {'RTT ms':>8} {'Failures':>8}")
+                    for name, entry in sorted(peers.items()):
+                        rate = '-' if entry['throughput'] is None else f"{entry['throughput'] / 1e6:.2f}"
+                        rtt = '-' if entry['rtt'] is None else f"{entry['rtt'] * 1000:.1f}"
+                        print(f"{name:<16} {entry['transfers']:>9} {entry['bytes']:>12} {rate:>8} "
+                              f"{rtt:>8} {entry['failures']:>8}")
+                else:
+                    print("No transfers recorded yet")
+                uploads = client.uploads
+                print(f"Uploads: {uploads.active}/{uploads.slots} slots busy, "
+                      f"{len(uploads.waiting)} queued, {uploads.rejected} turned away")
+                cache = client.compression_cache
+                print(f"Compressed block cache: {len(cache.blocks)} blocks, {cache.size} bytes, "
+                      f"{cache.hits} hits, {cache.misses} misses")
+                    
             else:
                 print(f"Unknown command: {cmd}")
                 print("Type 'help' or see available commands above")
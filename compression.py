@@ -0,0 +1,295 @@
+"""
+P2P File Sharing - Transfer Compression
+Negotiated per-block compression of file data, with a cache of compressed
+blocks on the serving side
+"""
+
+import math
+import os
+import struct
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+from protocol import ProtocolError, recv_exact
+from transfer import BLOCK_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Each block is sent as a frame: flag (1 = compressed, 0 = stored), payload
+# length, and the block's uncompressed length, followed by the payload
+FRAME_HEADER = struct.Struct('!BII')
+STORED, COMPRESSED = 0, 1
+
+# Files whose format is already compressed; they are always sent as they are
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.zip', '.7z', '.rar', '.jar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.ogg', '.flac', '.aac', '.mp4', '.mkv', '.avi', '.mov', '.webm',
+}
+
+# Sampled bytes above this entropy (bits per byte, 8 is random) are not compressed
+MAX_ENTROPY = 7.5
+SAMPLE_SIZE = 16 * 1024
+SAMPLES = 3
+
+# Ranges shorter than this are not worth a codec
+MIN_COMPRESS_SIZE = 4096
+
+# Bytes of compressed blocks a seeder keeps for the next downloader
+CACHE_BYTES = 64 * 1024 * 1024
+
+# Files whose compress-or-not decision is remembered, least recently used first out
+DECISION_ENTRIES = 4096
+
+
+class _Codec:
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        # (data, uncompressed length) -> bytes; never produces more than that
+        # length, and raises ProtocolError if the data would expand further
+        self.decompress = decompress
+
+
+def _too_large(size):
+    return ProtocolError(f"Block decompresses to more than {size} bytes")
+
+
+def _zstd_decompress(data, size):
+    # One-shot decompression trusts the size in the frame header; a stream
+    # reader only produces what is read from it
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        output = bytearray()
+        while len(output) < size:
+            chunk = reader.read(size - len(output))
+            if not chunk:
+                break
+            output += chunk
+        if reader.read(1):
+            raise _too_large(size)
+    return bytes(output)
+
+
+def _lz4_decompress(data, size):
+    decompressor = lz4_frame.LZ4FrameDecompressor()
+    output = decompressor.decompress(data, max_length=size)
+    if not decompressor.eof:
+        raise _too_large(size) if len(output) == size else ProtocolError("Truncated lz4 frame")
+    return output
+
+
+def _zlib_decompress(data, size):
+    decompressor = zlib.decompressobj()
+    output = decompressor.decompress(data, size)
+    if decompressor.unconsumed_tail:
+        raise _too_large(size)
+    return output
+
+
+def _codecs():
+    codecs = {}
+    if zstandard is not None:
+        # (De)compressor objects are not thread-safe, so each block gets its own
+        codecs['zstd'] = _Codec(
+            'zstd', lambda data: zstandard.ZstdCompressor(level=3).compress(data), _zstd_decompress)
+    if lz4_frame is not None:
+        codecs['lz4'] = _Codec('lz4', lz4_frame.compress, _lz4_decompress)
+    codecs['zlib'] = _Codec('zlib', lambda data: zlib.compress(data, 1), _zlib_decompress)
+    return codecs
+
+
+# Supported codecs, best first
+CODECS = _codecs()
+
+
+def available_codecs():
+    """Names of the codecs this process can use, in order of preference"""
+    return list(CODECS)
+
+
+def entropy(data):
+    """Shannon entropy of data in bits per byte"""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in Counter(data).values())
+
+
+class CompressionCache:
+    """Compressed blocks of recently served files, least recently used first out
+
+    Blocks are keyed by file path and version (size and modification
+    time), codec, offset and length, so a changed file is never served
+    from stale entries. The decision whether a file is worth compressing
+    at all is remembered for the latest version of up to decision_entries
+    files.
+    """
+
+    def __init__(self, capacity=CACHE_BYTES, decision_entries=DECISION_ENTRIES):
+        self.capacity = capacity
+        self.decision_entries = decision_entries
+        self.lock = threading.Lock()
+        self.blocks = OrderedDict()  # {key: frame bytes}
+        self.size = 0
+        self.decisions = OrderedDict()  # {path: ((size, mtime), bool)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            frame = self.blocks.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.blocks.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        if len(frame) > self.capacity:
+            return
+        with self.lock:
+            old = self.blocks.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.blocks[key] = frame
+            self.size += len(frame)
+            while self.size > self.capacity:
+                _, evicted = self.blocks.popitem(last=False)
+                self.size -= len(evicted)
+
+    def worth_compressing(self, path, f, version):
+        """False for compressed formats (by extension) and high-entropy data"""
+        key = str(path)
+        with self.lock:
+            entry = self.decisions.get(key)
+            if entry is not None and entry[0] == version:
+                self.decisions.move_to_end(key)
+                return entry[1]
+        if os.path.splitext(str(path))[1].lower() in COMPRESSED_EXTENSIONS:
+            decision = False
+        else:
+            # Sample the start, middle and end of the file
+            size = version[0]
+            position = f.tell()
+            sample = bytearray()
+            for index in range(SAMPLES):
+                f.seek(max(0, (size - SAMPLE_SIZE) * index // max(1, SAMPLES - 1)))
+                sample += f.read(SAMPLE_SIZE)
+            f.seek(position)
+            decision = entropy(sample) <= MAX_ENTROPY
+        with self.lock:
+            # A new version replaces the old one's entry
+            self.decisions.pop(key, None)
+            self.decisions[key] = (version, decision)
+            while len(self.decisions) > self.decision_entries:
+                self.decisions.popitem(last=False)
+        return decision
+
+
+def choose_codec(offered, path, f, length, cache):
+    """The first offered codec we support, or None if the data should go as is"""
+    if not offered or length < MIN_COMPRESS_SIZE:
+        return None
+    stat = os.fstat(f.fileno())
+    if not cache.worth_compressing(path, f, (stat.st_size, stat.st_mtime_ns)):
+        return None
+    for name in offered:
+        if name in CODECS:
+            return name
+    return None
+
+
+def send_compressed(sock, f, size, codec_name, path, cache=None, block_size=BLOCK_SIZE,
+                    throttle=None):
+    """Stream size bytes from the file's current position as codec frames
+
+    A block that does not shrink is sent stored. Frames of whole blocks
+    are cached so other downloaders of the same file skip compressing
+    them. throttle (if given) is charged with the bytes on the wire.
+    """
+    codec = CODECS[codec_name]
+    stat = os.fstat(f.fileno())
+    version = (str(path), stat.st_size, stat.st_mtime_ns, codec_name)
+    offset = f.tell()
+    remaining = size
+    while remaining:
+        count = min(block_size, remaining)
+        key = version + (offset, count)
+        frame = cache.get(key) if cache is not None else None
+        if frame is None:
+            f.seek(offset)
+            data = f.read(count)
+            if len(data) < count:
+                raise EOFError(f"File ended with {remaining} bytes left to send")
+            packed = codec.compress(data)
+            if len(packed) < count:
+                frame = FRAME_HEADER.pack(COMPRESSED, len(packed), count) + packed
+            else:
+                frame = FRAME_HEADER.pack(STORED, count, count) + data
+            if cache is not None:
+                cache.put(key, frame)
+        sock.sendall(frame)
+        if throttle is not None:
+            throttle(len(frame))
+        offset += count
+        remaining -= count
+    f.seek(offset)
+
+
+class FrameReader:
+    """Receives codec frames and hands out the uncompressed data
+
+    A frame may straddle two recv_file_data calls (e.g. pieces smaller than
+    a block); the rest of it is kept for the next call. Frames larger than
+    a block, on the wire or decompressed, are rejected before they are
+    read or inflated any further.
+    """
+
+    def __init__(self, sock, codec_name, max_block=BLOCK_SIZE):
+        if codec_name not in CODECS:
+            raise ProtocolError(f"Unsupported codec: {codec_name}")
+        self.sock = sock
+        self.codec = CODECS[codec_name]
+        self.max_block = max_block
+        self.pending = memoryview(b'')
+        self.wire_bytes = 0
+
+    def _next_frame(self, throttle):
+        header = recv_exact(self.sock, FRAME_HEADER.size)
+        if header is None:
+            raise ConnectionError("Connection closed before the next block")
+        flag, length, size = FRAME_HEADER.unpack(header)
+        if length > self.max_block or size > self.max_block:
+            raise ProtocolError(f"Block too large: {size} bytes")
+        payload = recv_exact(self.sock, length) if length else b''
+        if payload is None:
+            raise ConnectionError("Connection closed mid-block")
+        self.wire_bytes += FRAME_HEADER.size + length
+        if throttle is not None:
+            throttle(FRAME_HEADER.size + length)
+        data = bytes(payload) if flag == STORED else self.codec.decompress(bytes(payload), size)
+        if len(data) != size:
+            raise ProtocolError(f"Block decoded to {len(data)} bytes, expected {size}")
+        return data
+
+    def recv_file_data(self, f, size, hasher=None, throttle=None):
+        """Write the next size uncompressed bytes to f (like transfer.recv_file_data)"""
+        remaining = size
+        while remaining:
+            if not self.pending:
+                self.pending = memoryview(self._next_frame(throttle))
+            chunk = self.pending[:remaining]
+            if hasher is not None:
+                hasher.update(chunk)
+            f.write(chunk)
+            self.pending = self.pending[len(chunk):]
+            remaining -= len(chunk)
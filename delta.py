@@ -0,0 +1,175 @@
+"""
+P2P File Sharing - Delta Sync
+rsync-style transfer of a new file version against an old copy the
+receiver already holds
+"""
+
+import hashlib
+import math
+import mmap
+import zlib
+
+from transfer import BLOCK_SIZE
+
+# Delta sync is only tried when the old copy is at least this large
+DELTA_MIN_SIZE = 1024 * 1024
+
+# Signature block size bounds (the size grows with the square root of the file)
+MIN_DELTA_BLOCK = 8 * 1024
+MAX_DELTA_BLOCK = 1024 * 1024
+
+# Modulus of the Adler-32 checksum
+_MOD = 65521
+
+
+def block_size_for(size):
+    """Power of two near sqrt(size), within the block size bounds"""
+    if size <= 1:
+        return MIN_DELTA_BLOCK
+    block = 1 << math.ceil(math.log2(math.sqrt(size)))
+    return max(MIN_DELTA_BLOCK, min(MAX_DELTA_BLOCK, block))
+
+
+def strong_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def signatures(path, block_size):
+    """[weak, strong] checksums of every block of a file
+
+    weak is Adler-32, which can be rolled along the new file one byte at a
+    time; strong confirms a weak match. The last block may be short.
+    """
+    result = []
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            result.append([zlib.adler32(block), strong_hash(block)])
+    return result
+
+
+def compute_delta(f, block_size, old_signatures, old_size):
+    """Describe an open file as copies from the old version plus new data
+
+    Returns ops in file order: ('copy', old_offset, length) or
+    ('data', new_offset, length). Blocks are first checked where the last
+    match leaves off. After a mismatch the weak checksum is rolled byte by
+    byte for one block to find data that has shifted (an insertion or a
+    deletion). While nothing matches, those searches happen only every
+    1, 2, 4, ... blocks, so an entirely new file costs little more than one
+    checksum per block.
+    """
+    size = _file_size(f)
+    if not size:
+        return []
+    full_blocks = old_size // block_size
+    table = {}  # {weak: [(strong, index)]} for full-length old blocks
+    for index, (weak, strong) in enumerate(old_signatures[:full_blocks]):
+        table.setdefault(weak, []).append((strong, index))
+    tail = None  # (length, weak, strong) of a short last old block
+    if old_size % block_size and len(old_signatures) > full_blocks:
+        tail = (old_size % block_size,) + tuple(old_signatures[full_blocks])
+
+    ops = []
+
+    def emit(kind, offset, length):
+        # Consecutive copies of consecutive old blocks become one op
+        if not length:
+            return
+        if ops and ops[-1][0] == kind and ops[-1][1] + ops[-1][2] == offset:
+            ops[-1] = (kind, ops[-1][1], ops[-1][2] + length)
+        else:
+            ops.append((kind, offset, length))
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        def lookup(weak, position):
+            candidates = table.get(weak)
+            if candidates:
+                strong = strong_hash(data[position:position + block_size])
+                for candidate, index in candidates:
+                    if candidate == strong:
+                        return index
+            return None
+
+        position = 0
+        literal = 0  # start of the new data not yet emitted
+        misses = 0  # blocks without a match since the last one
+        next_search = 0  # search again once misses reaches this
+        while position + block_size <= size:
+            index = lookup(zlib.adler32(data[position:position + block_size]), position)
+            if index is None and misses >= next_search:
+                index, position = _search(data, position, size, block_size, lookup)
+                next_search = 2 * next_search or 1
+            if index is not None:
+                emit('data', literal, position - literal)
+                emit('copy', index * block_size, block_size)
+                position += block_size
+                literal = position
+                misses = 0
+                next_search = 0
+            else:
+                position += block_size
+                misses += 1
+
+        if (tail is not None and size - position == tail[0]
+                and zlib.adler32(data[position:size]) == tail[1]
+                and strong_hash(data[position:size]) == tail[2]):
+            emit('data', literal, position - literal)
+            emit('copy', full_blocks * block_size, tail[0])
+        else:
+            emit('data', literal, size - literal)
+    return ops
+
+
+def _search(data, position, size, block_size, lookup):
+    """Roll the weak checksum over the next block of positions
+
+    Returns (index, position) of the first match, or (None, position) if
+    there is none.
+    """
+    weak = zlib.adler32(data[position:position + block_size])
+    a = weak & 0xffff
+    b = weak >> 16
+    end = min(position + block_size, size - block_size)
+    start = position
+    while position < end:
+        outgoing = data[position]
+        incoming = data[position + block_size]
+        a = (a - outgoing + incoming) % _MOD
+        b = (b - block_size * outgoing - 1 + a) % _MOD
+        position += 1
+        index = lookup((b << 16) | a, position)
+        if index is not None:
+            return index, position
+    return None, start
+
+
+def _file_size(f):
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(0)
+    return size
+
+
+def send_delta_data(sock, f, ops, throttle=None):
+    """Send the new data of a delta (the 'data' ops) in order"""
+    for kind, offset, length in ops:
+        if kind != 'data':
+            continue
+        f.seek(offset)
+        remaining = length
+        while remaining:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise EOFError(f"File ended with {remaining} bytes left to send")
+            sock.sendall(block)
+            remaining -= len(block)
+            if throttle is not None:
+                throttle(len(block))
+
+
+def wire_ops(ops):
+    """Ops as sent in the delta response: [old_offset, length] or [length]"""
+    return [[offset, length] if kind == 'copy' else [length] for kind, offset, length in ops]
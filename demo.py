@@ -4,18 +4,19 @@ This script demonstrates the core functionality programmatically
 """
 
 import time
-import json
 import socket
 from pathlib import Path
 
+from protocol import recv_message, send_message
+
 
 def send_request(host, port, request):
     """Helper function to send request to server"""
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect((host, port))
-        sock.send(json.dumps(request).encode('utf-8'))
-        response = json.loads(sock.recv(4096).decode('utf-8'))
+        send_message(sock, request)
+        response = recv_message(sock)
         sock.close()
         return response
     except Exception as e:
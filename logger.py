@@ -0,0 +1,71 @@
+"""
+P2P File Sharing - Console Logger
+Leveled, rate-limited replacement for the [SERVER] progress prints
+"""
+
+import threading
+import time
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'off': 100}
+
+# Lines per second the console gets before messages are dropped (and counted)
+LOG_RATE = 100
+
+
+class Logger:
+    """Prints '[PREFIX] message' lines at or above a level
+
+    Arguments are %-formatted only when a line is actually printed, so a
+    disabled level costs one comparison. At most rate lines per second
+    are printed; the rest are dropped and reported in a summary line once
+    the next second starts.
+    """
+
+    def __init__(self, prefix, level='info', rate=LOG_RATE):
+        self.prefix = prefix
+        self.set_level(level)
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.window = 0  # current whole second
+        self.printed = 0  # lines printed in the current second
+        self.dropped = 0  # lines dropped in the current second
+        self.suppressed_total = 0
+
+    def set_level(self, level):
+        if level not in LEVELS:
+            raise ValueError(f"Unknown log level: {level}")
+        self.level = level
+        self.threshold = LEVELS[level]
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.threshold
+
+    def log(self, level, message, *args):
+        if LEVELS[level] < self.threshold:
+            return
+        with self.lock:
+            now = int(time.monotonic())
+            if now != self.window:
+                if self.dropped:
+                    print(f"[{self.prefix}] ... {self.dropped} message(s) suppressed")
+                self.window = now
+                self.printed = 0
+                self.dropped = 0
+            if self.rate and self.printed >= self.rate:
+                self.dropped += 1
+                self.suppressed_total += 1
+                return
+            self.printed += 1
+        print(f"[{self.prefix}] {message % args if args else message}")
+
+    def debug(self, message, *args):
+        self.log('debug', message, *args)
+
+    def info(self, message, *args):
+        self.log('info', message, *args)
+
+    def warning(self, message, *args):
+        self.log('warning', message, *args)
+
+    def error(self, message, *args):
+        self.log('error', message, *args)
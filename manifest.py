@@ -0,0 +1,95 @@
+"""
+P2P File Sharing - Piece Manifests
+SHA-256 hash of every fixed-size piece of a file, plus a root hash over them
+"""
+
+import hashlib
+
+from transfer import BLOCK_SIZE, PIECE_SIZE
+
+
+def root_hash(pieces):
+    """Root hash of a file: SHA-256 over the concatenated piece digests"""
+    return hashlib.sha256(b''.join(bytes.fromhex(piece) for piece in pieces)).hexdigest()
+
+
+class ManifestBuilder:
+    """Builds a manifest incrementally from data fed in any chunk sizes"""
+
+    def __init__(self, piece_size=PIECE_SIZE):
+        self.piece_size = piece_size
+        self.pieces = []
+        self.size = 0
+        self.current = hashlib.sha256()
+        self.filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.piece_size - self.filled)
+            self.current.update(view[:take])
+            self.filled += take
+            self.size += take
+            view = view[take:]
+            if self.filled == self.piece_size:
+                self.pieces.append(self.current.hexdigest())
+                self.current = hashlib.sha256()
+                self.filled = 0
+
+    def finish(self):
+        """Return the manifest for everything fed so far"""
+        pieces = list(self.pieces)
+        if self.filled:
+            pieces.append(self.current.hexdigest())
+        return {
+            'size': self.size,
+            'piece_size': self.piece_size,
+            'pieces': pieces,
+            'root': root_hash(pieces)
+        }
+
+
+def copy_with_manifest(src_path, dest_path, block_size=BLOCK_SIZE):
+    """Copy a file and hash it in the same pass; returns the manifest
+
+    Hashing the blocks as they are copied means publishing reads the
+    source only once.
+    """
+    builder = ManifestBuilder()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        while True:
+            count = src.readinto(buffer)
+            if not count:
+                break
+            builder.update(view[:count])
+            dest.write(view[:count])
+    return builder.finish()
+
+
+def hash_file(path, block_size=BLOCK_SIZE):
+    """Build the manifest of a file by streaming it once"""
+    builder = ManifestBuilder()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            builder.update(view[:count])
+    return builder.finish()
+
+
+def is_valid_manifest(manifest):
+    """Cheap structural check of a manifest received over the network"""
+    try:
+        pieces = manifest['pieces']
+        size = manifest['size']
+        piece_size = manifest['piece_size']
+        return (isinstance(pieces, list) and piece_size > 0 and size >= 0
+                and len(pieces) == (size + piece_size - 1) // piece_size
+                and manifest['root'] == root_hash(pieces))
+    except (KeyError, TypeError, ValueError):
+        return False
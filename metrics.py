@@ -0,0 +1,196 @@
+"""
+P2P File Sharing - Tracker Metrics
+Request counters, latency and lock-wait histograms, gauges, and a
+Prometheus-style text endpoint
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds (10us .. 10s, roughly x2.5 apart)
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum and maximum"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return {
+            'count': self.count,
+            'mean_ms': ms(self.sum / self.count) if self.count else None,
+            'p50_ms': ms(self.quantile(0.50)),
+            'p99_ms': ms(self.quantile(0.99)),
+            'max_ms': ms(self.max),
+        }
+
+
+class Metrics:
+    """Thread-safe collection of the tracker's measurements
+
+    Requests are counted and timed per command, contended lock
+    acquisitions per lock kind. Gauges are functions sampled when the
+    metrics are read, so they cost nothing on the request path.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}  # {command: Histogram}
+        self.errors = {}  # {command: count}
+        self.lock_waits = {}  # {lock kind: Histogram}
+        self.connections = 0
+        self.connections_total = 0
+        self.gauges = {}  # {name: (help, function)}
+
+    def observe_request(self, command, seconds, ok):
+        with self.lock:
+            histogram = self.requests.get(command)
+            if histogram is None:
+                histogram = self.requests[command] = Histogram()
+                self.errors[command] = 0
+            histogram.observe(seconds)
+            if not ok:
+                self.errors[command] += 1
+
+    def observe_lock_wait(self, kind, seconds):
+        with self.lock:
+            histogram = self.lock_waits.get(kind)
+            if histogram is None:
+                histogram = self.lock_waits[kind] = Histogram()
+            histogram.observe(seconds)
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.connections -= 1
+
+    def gauge(self, name, help_text, function):
+        """Report function() as the gauge name whenever metrics are read"""
+        self.gauges[name] = (help_text, function)
+
+    def snapshot(self):
+        """Everything as a JSON-friendly dict (the `stats` command)"""
+        with self.lock:
+            result = {
+                'uptime_sec': round(time.time() - self.started, 1),
+                'connections': self.connections,
+                'connections_total': self.connections_total,
+                'requests': {command: dict(histogram.summary(), errors=self.errors[command])
+                             for command, histogram in sorted(self.requests.items())},
+                'lock_waits': {kind: histogram.summary()
+                               for kind, histogram in sorted(self.lock_waits.items())},
+            }
+        for name, (_, function) in self.gauges.items():
+            result[name] = function()
+        return result
+
+    def render_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+
+        def histogram_lines(name, help_text, label, histograms):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{{{label}="{key}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+
+        with self.lock:
+            lines.append("# HELP p2p_requests_total Requests handled, by command")
+            lines.append("# TYPE p2p_requests_total counter")
+            for command, histogram in sorted(self.requests.items()):
+                lines.append(f'p2p_requests_total{{command="{command}"}} {histogram.count}')
+            lines.append("# HELP p2p_request_errors_total Requests answered with an error, by command")
+            lines.append("# TYPE p2p_request_errors_total counter")
+            for command, errors in sorted(self.errors.items()):
+                lines.append(f'p2p_request_errors_total{{command="{command}"}} {errors}')
+            histogram_lines('p2p_request_seconds', 'Request handling time', 'command', self.requests)
+            histogram_lines('p2p_lock_wait_seconds', 'Time spent waiting for contended locks',
+                            'lock', self.lock_waits)
+            lines.append("# HELP p2p_connections Open client connections")
+            lines.append("# TYPE p2p_connections gauge")
+            lines.append(f"p2p_connections {self.connections}")
+            lines.append("# HELP p2p_connections_total Client connections accepted")
+            lines.append("# TYPE p2p_connections_total counter")
+            lines.append(f"p2p_connections_total {self.connections_total}")
+
+        for name, (help_text, function) in sorted(self.gauges.items()):
+            lines.append(f"# HELP p2p_{name} {help_text}")
+            lines.append(f"# TYPE p2p_{name} gauge")
+            lines.append(f"p2p_{name} {function()}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves GET /metrics in Prometheus text format from a background thread"""
+
+    def __init__(self, metrics, host='0.0.0.0', port=9100):
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass  # scrapes would flood the console
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,158 @@
+"""
+P2P File Sharing - Partial Downloads
+On-disk state that lets an interrupted download resume where it stopped
+"""
+
+import json
+import os
+import threading
+import time
+
+from transfer import PIECE_SIZE
+
+PARTIAL_DIR = '.partial'
+SAVE_INTERVAL = 1.0
+
+
+def _to_runs(indices):
+    """Compress a set of piece indices into sorted [start, end) runs"""
+    runs = []
+    for index in sorted(indices):
+        if runs and runs[-1][1] == index:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1])
+    return runs
+
+
+def _from_runs(runs):
+    done = set()
+    for start, end in runs:
+        done.update(range(start, end))
+    return done
+
+
+class PartialDownload:
+    """A download in progress, kept as <name>.part plus a JSON sidecar
+
+    The file is split into fixed-size pieces. The sidecar records which
+    pieces have been written (and verified, when the download has a
+    manifest) so a later attempt only requests the rest.
+    Both files live in the repository's .partial directory until the
+    download completes and the data is moved into place.
+    """
+
+    def __init__(self, directory, filename, size, piece_size=PIECE_SIZE, root=None, done=()):
+        self.directory = directory
+        self.filename = filename
+        self.size = size
+        self.piece_size = piece_size
+        self.root = root
+        self.done = set(done)
+        self.part_path = directory / (filename + '.part')
+        self.state_path = directory / (filename + '.part.json')
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save = 0.0
+
+    @classmethod
+    def open(cls, repository_path, filename, size, piece_size=PIECE_SIZE, root=None):
+        """Resume the saved state for filename, or start a new download
+
+        Saved state is only reused if it describes a file of the same size,
+        piece size and root hash; otherwise it is discarded.
+        """
+        directory = repository_path / PARTIAL_DIR
+        directory.mkdir(exist_ok=True)
+        partial = cls(directory, filename, size, piece_size, root)
+        partial.part_path.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            with open(partial.state_path) as f:
+                state = json.load(f)
+            if (state['size'] == size and state['piece_size'] == piece_size
+                    and state.get('root') == root and partial.part_path.exists()):
+                partial.done = _from_runs(state['done'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if not partial.done:
+            with open(partial.part_path, 'wb') as f:
+                f.truncate(size)
+        partial.save(force=True)
+        return partial
+
+    @property
+    def piece_count(self):
+        return (self.size + self.piece_size - 1) // self.piece_size
+
+    def piece_range(self, index):
+        """Byte (offset, length) of one piece"""
+        offset = index * self.piece_size
+        return offset, min(self.piece_size, self.size - offset)
+
+    def done_bytes(self):
+        with self.lock:
+            return sum(self.piece_range(index)[1] for index in self.done)
+
+    def missing_ranges(self, max_length=None):
+        """Contiguous (offset, length) ranges of pieces not yet downloaded
+
+        Ranges are piece-aligned and, if max_length is given, no longer
+        than max_length (rounded down to whole pieces, minimum one piece).
+        """
+        max_pieces = None
+        if max_length is not None:
+            max_pieces = max(1, max_length // self.piece_size)
+        ranges = []
+        with self.lock:
+            start = None
+            for index in range(self.piece_count + 1):
+                missing = index < self.piece_count and index not in self.done
+                if missing and start is None:
+                    start = index
+                if start is not None and (not missing or index - start == max_pieces):
+                    ranges.append((start, index))
+                    start = index if missing else None
+        return [(first * self.piece_size,
+                 min(last * self.piece_size, self.size) - first * self.piece_size)
+                for first, last in ranges]
+
+    def mark_done(self, index):
+        with self.lock:
+            self.done.add(index)
+            self.dirty = True
+
+    def is_complete(self):
+        with self.lock:
+            return len(self.done) == self.piece_count
+
+    def save(self, force=False):
+        """Write the sidecar, at most once per SAVE_INTERVAL unless forced"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and (not self.dirty or now - self.last_save < SAVE_INTERVAL):
+                return
+            state = {
+                'filename': self.filename,
+                'size': self.size,
+                'piece_size': self.piece_size,
+                'root': self.root,
+                'done': _to_runs(self.done)
+            }
+            temp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.state_path)
+            self.dirty = False
+            self.last_save = now
+
+    def finish(self, dest_path):
+        """Move the completed data into place and remove the sidecar"""
+        os.replace(self.part_path, dest_path)
+        self.state_path.unlink(missing_ok=True)
+
+    def discard(self):
+        """Delete the partial data and its state"""
+        self.part_path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
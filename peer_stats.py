@@ -0,0 +1,95 @@
+"""
+P2P File Sharing - Peer Statistics
+Per-peer throughput, latency and failure history kept by a client
+"""
+
+import json
+import os
+import threading
+import time
+
+PEER_STATS_FILE = '.peer_stats.json'
+
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.3
+
+
+def _ewma(old, sample):
+    return sample if old is None else old + EWMA_ALPHA * (sample - old)
+
+
+class PeerStats:
+    """What this client has measured about each remote peer
+
+    Totals (bytes, seconds, transfers, failures) are kept alongside
+    exponentially weighted averages of throughput and round-trip time, so
+    recent behaviour counts most. The summary is saved as JSON in the
+    repository and loaded again on the next start.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.peers = {}  # {hostname: {...}}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self.peers = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _entry(self, hostname):
+        entry = self.peers.get(hostname)
+        if entry is None:
+            entry = self.peers[hostname] = {
+                'transfers': 0,
+                'bytes': 0,
+                'seconds': 0.0,
+                'failures': 0,
+                'throughput': None,  # bytes per second
+                'rtt': None,  # seconds
+                'last_used': None
+            }
+        return entry
+
+    def record_transfer(self, hostname, nbytes, seconds):
+        with self.lock:
+            entry = self._entry(hostname)
+            entry['transfers'] += 1
+            entry['bytes'] += nbytes
+            entry['seconds'] += seconds
+            if seconds > 0 and nbytes:
+                entry['throughput'] = _ewma(entry['throughput'], nbytes / seconds)
+            entry['last_used'] = time.time()
+
+    def record_failure(self, hostname):
+        with self.lock:
+            entry = self._entry(hostname)
+            entry['failures'] += 1
+            entry['last_used'] = time.time()
+
+    def record_rtt(self, hostname, seconds):
+        with self.lock:
+            entry = self._entry(hostname)
+            entry['rtt'] = _ewma(entry['rtt'], seconds)
+
+    def get(self, hostname):
+        """A copy of one peer's statistics, or None if it was never used"""
+        with self.lock:
+            entry = self.peers.get(hostname)
+            return dict(entry) if entry else None
+
+    def summary(self):
+        """Copies of every peer's statistics: {hostname: {...}}"""
+        with self.lock:
+            return {hostname: dict(entry) for hostname, entry in self.peers.items()}
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps(self.peers, separators=(',', ':'))
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(temp_path, 'w') as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
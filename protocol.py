@@ -0,0 +1,99 @@
+"""
+P2P File Sharing - Wire Protocol
+Length-prefixed JSON message framing shared by the server and clients
+"""
+
+import json
+import struct
+
+
+# Every message is a 4-byte big-endian payload length followed by UTF-8 JSON
+HEADER = struct.Struct('!I')
+HEADER_SIZE = HEADER.size
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+RECV_SIZE = 65536
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends a malformed or oversized frame"""
+
+
+def encode_message(message):
+    """Serialize a message into a single length-prefixed frame"""
+    payload = json.dumps(message).encode('utf-8')
+    if len(payload) > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"Message too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload)) + payload
+
+
+class MessageDecoder:
+    """Incremental frame decoder for a byte stream
+
+    Bytes are fed as they arrive from the socket; every complete frame
+    is returned as its raw JSON payload, and any trailing partial frame
+    is kept until the rest of it is fed.
+    """
+
+    def __init__(self, max_size=MAX_MESSAGE_SIZE):
+        self.max_size = max_size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes and return the list of complete payloads"""
+        self.buffer += data
+        payloads = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER_SIZE:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_size:
+                raise ProtocolError(f"Frame too large: {length} bytes")
+            end = offset + HEADER_SIZE + length
+            if len(self.buffer) < end:
+                break
+            payloads.append(bytes(self.buffer[offset + HEADER_SIZE:end]))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return payloads
+
+    def pending(self):
+        """Number of buffered bytes belonging to an incomplete frame"""
+        return len(self.buffer)
+
+
+def send_message(sock, message):
+    """Send one framed message over a socket"""
+    sock.sendall(encode_message(message))
+
+
+def recv_exact(sock, size):
+    """Read exactly size bytes, or return None on a clean EOF before any byte"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            if received == 0:
+                return None
+            raise ConnectionError("Connection closed mid-message")
+        received += count
+    return bytes(buffer)
+
+
+def recv_message(sock, max_size=MAX_MESSAGE_SIZE):
+    """Receive one framed message, or None if the peer closed the connection
+
+    Reads exactly one frame and nothing more, so raw data that follows
+    the message on the same socket (e.g. file contents) is left unread.
+    """
+    header = recv_exact(sock, HEADER_SIZE)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > max_size:
+        raise ProtocolError(f"Frame too large: {length} bytes")
+    payload = recv_exact(sock, length) if length else b''
+    if payload is None:
+        raise ConnectionError("Connection closed mid-message")
+    return json.loads(payload)
@@ -0,0 +1,129 @@
+"""
+P2P File Sharing - Rate Limiting
+Token buckets that shape upload and download bandwidth
+"""
+
+import threading
+import time
+import weakref
+
+DIRECTIONS = ('upload', 'download')
+
+# Seconds of traffic an idle bucket may save up and then send at once
+BURST_SECONDS = 0.5
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(text):
+    """Bytes per second from '0', '512K', '10M', '1.5G' (0 means unlimited)"""
+    text = text.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    unit = text[-1:] if text[-1:] in _UNITS else ''
+    value = float(text[:len(text) - len(unit)])
+    if not 0 <= value < float('inf'):
+        raise ValueError(f"Invalid rate: {text}")
+    return int(value * _UNITS[unit])
+
+
+def format_rate(rate):
+    if not rate:
+        return 'unlimited'
+    for unit in ('G', 'M', 'K'):
+        if rate >= _UNITS[unit]:
+            return f"{rate / _UNITS[unit]:g}{unit}B/s"
+    return f"{rate}B/s"
+
+
+class TokenBucket:
+    """Limits a byte stream to rate bytes per second (0 means unlimited)
+
+    consume() takes the tokens at once, letting the bucket go into debt,
+    and sleeps until the debt is paid off. Callers therefore get bandwidth
+    in the order they asked for it: transfers that share a bucket and send
+    equal blocks take turns and each gets an equal share.
+    """
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            if not self.rate:
+                self.tokens = 0.0  # no credit saved up while unlimited
+            self.rate = rate
+            self.tokens = min(self.tokens, self._burst())
+
+    def _burst(self):
+        return self.rate * BURST_SECONDS
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self._burst(), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, count):
+        with self.lock:
+            if not self.rate:
+                return
+            self._refill(time.monotonic())
+            self.tokens -= count
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+class Throttle:
+    """Charges every block of one transfer to all of its buckets"""
+
+    def __init__(self, *buckets):
+        self.buckets = buckets
+
+    def __call__(self, count):
+        for bucket in self.buckets:
+            bucket.consume(count)
+
+
+class RateLimits:
+    """Global and per-connection limits for uploads and downloads
+
+    Each direction has one bucket shared by all of its transfers and a
+    per-connection rate that every transfer gets its own bucket for.
+    Changes apply to transfers already running.
+    """
+
+    def __init__(self, upload=0, download=0, connection_upload=0, connection_download=0):
+        self.lock = threading.Lock()
+        self.total = {'upload': TokenBucket(upload), 'download': TokenBucket(download)}
+        self.per_connection = {'upload': connection_upload, 'download': connection_download}
+        self.connections = {direction: weakref.WeakSet() for direction in DIRECTIONS}
+
+    def set(self, direction, rate, per_connection=False):
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {', '.join(DIRECTIONS)}")
+        if not per_connection:
+            self.total[direction].set_rate(rate)
+            return
+        with self.lock:
+            self.per_connection[direction] = rate
+            buckets = list(self.connections[direction])
+        for bucket in buckets:
+            bucket.set_rate(rate)
+
+    def throttle(self, direction):
+        """A Throttle for one new transfer"""
+        with self.lock:
+            connection = TokenBucket(self.per_connection[direction])
+            self.connections[direction].add(connection)
+        return Throttle(connection, self.total[direction])
+
+    def describe(self):
+        return {direction: {'total': self.total[direction].rate,
+                            'per_connection': self.per_connection[direction]}
+                for direction in DIRECTIONS}
@@ -0,0 +1,524 @@
+"""
+P2P File Sharing - Sharded Tracker State
+Client registry and file index split into independently locked shards
+"""
+
+import bisect
+import heapq
+import threading
+import time
+
+DEFAULT_SHARDS = 16
+
+
+class RWLock:
+    """Any number of readers or a single writer
+
+    A waiting writer blocks new readers, so a steady stream of lookups
+    cannot starve publishes. Use `with lock.read:` / `with lock.write:`.
+    If on_wait is set it is called with the seconds spent blocked, for
+    acquisitions that had to wait.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writing = False
+        self.writers_waiting = 0
+        self.read = _ReadGuard(self)
+        self.write = _WriteGuard(self)
+        self.on_wait = None
+
+    def acquire_read(self):
+        with self.condition:
+            if self.writing or self.writers_waiting:
+                started = time.perf_counter()
+                while self.writing or self.writers_waiting:
+                    self.condition.wait()
+                if self.on_wait:
+                    self.on_wait(time.perf_counter() - started)
+            self.readers += 1
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            if self.writing or self.readers:
+                started = time.perf_counter()
+                self.writers_waiting += 1
+                while self.writing or self.readers:
+                    self.condition.wait()
+                self.writers_waiting -= 1
+                if self.on_wait:
+                    self.on_wait(time.perf_counter() - started)
+            self.writing = True
+
+    def release_write(self):
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+
+class _ReadGuard:
+    def __init__(self, lock):
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire_read()
+
+    def __exit__(self, *exc_info):
+        self.lock.release_read()
+
+
+class _WriteGuard:
+    def __init__(self, lock):
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire_write()
+
+    def __exit__(self, *exc_info):
+        self.lock.release_write()
+
+
+def _insert_sorted(listing, names):
+    """Add new names to a sorted list in place"""
+    if len(names) > 1:
+        # Two sorted runs; the sort merges them in linear time
+        listing.extend(sorted(names))
+        listing.sort()
+    elif names:
+        bisect.insort(listing, names[0])
+
+
+class HostShard:
+    """Registered clients whose hostnames hash to this shard"""
+
+    def __init__(self):
+        self.lock = RWLock()
+        # {hostname: {'ip', 'port', 'files': {filenames}, 'roots': {filename: root}, 'last_seen'}}
+        self.clients = {}
+        self.listings = {}  # {hostname: sorted filenames}, pages of discover
+
+
+class FileShard:
+    """Index entries for the filenames that hash to this shard"""
+
+    def __init__(self):
+        self.lock = RWLock()
+        self.index = {}  # {filename: {hostnames}} - inverted index for fetch
+        # {filename: {root: manifest}} for each version some host still holds,
+        # most recently published last
+        self.manifests = {}
+        self.root_holders = {}  # {filename: {root: number of hosts holding it}}
+
+    def hold_version(self, filename, root):
+        holders = self.root_holders.setdefault(filename, {})
+        holders[root] = holders.get(root, 0) + 1
+
+    def release_version(self, filename, root):
+        """A host stopped holding a version; forget its manifest once nobody does"""
+        holders = self.root_holders.get(filename)
+        if not holders or root not in holders:
+            return
+        holders[root] -= 1
+        if holders[root]:
+            return
+        del holders[root]
+        if not holders:
+            del self.root_holders[filename]
+        versions = self.manifests.get(filename)
+        if versions is not None:
+            versions.pop(root, None)
+            if not versions:
+                del self.manifests[filename]
+
+    def add_manifest(self, filename, manifest):
+        """Make manifest the newest version of filename"""
+        versions = self.manifests.setdefault(filename, {})
+        versions.pop(manifest['root'], None)
+        versions[manifest['root']] = manifest
+
+    def latest_manifest(self, filename):
+        versions = self.manifests.get(filename)
+        return versions[next(reversed(versions))] if versions else None
+
+
+class Registry:
+    """Tracker state: clients sharded by hostname, the file index by filename
+
+    Operations on different hosts or files take different locks, and
+    read-only lookups (fetch, discover, ping) share them. When a host
+    shard and file shards are both needed, the host shard is locked
+    first and the file shards one at a time after it; fetch never holds
+    both, so lock order cannot deadlock.
+
+    With host_ttl set, hosts not heard from for that many seconds are
+    evicted by expire(). Deadlines sit in a heap with one entry per host;
+    a heartbeat only updates last_seen, and an entry found to be stale
+    when it reaches the top is pushed back with the host's real deadline.
+    A sweep therefore only touches hosts whose deadline has come up.
+    The expiry lock is taken before any shard lock.
+
+    If journal is set, every change is passed to it as an operation dict
+    while the host's shard is still locked, so per-host operations are
+    journaled in the order they were applied; apply() replays them.
+
+    If on_index_change is set it is called as on_index_change(added,
+    removed) with the filenames that entered or left the file index,
+    after the file shard locks are released (the host shard may still be
+    held). A name can be reported as removed and then added again by
+    racing calls; listeners must allow for that.
+    """
+
+    def __init__(self, shards=DEFAULT_SHARDS, host_ttl=None):
+        self.host_shards = [HostShard() for _ in range(max(1, shards))]
+        self.file_shards = [FileShard() for _ in range(max(1, shards))]
+        self.host_ttl = host_ttl
+        self.expiry = []  # heap of (deadline, hostname)
+        self.scheduled = set()  # hostnames with an entry in the heap
+        self.expiry_lock = threading.Lock()
+        self.journal = None  # callable receiving each change, e.g. StateStore.log
+        self.on_index_change = None  # callable(added, removed), e.g. SearchIndex.update
+
+    def observe_lock_waits(self, callback):
+        """Report contended shard lock waits as callback(kind, seconds)"""
+        for shard in self.host_shards:
+            shard.lock.on_wait = lambda seconds: callback('host_shard', seconds)
+        for shard in self.file_shards:
+            shard.lock.on_wait = lambda seconds: callback('file_shard', seconds)
+
+    def host_shard(self, hostname):
+        return self.host_shards[hash(hostname) % len(self.host_shards)]
+
+    def file_shard(self, filename):
+        return self.file_shards[hash(filename) % len(self.file_shards)]
+
+    def _group_by_file_shard(self, filenames):
+        groups = {}
+        for filename in filenames:
+            groups.setdefault(hash(filename) % len(self.file_shards), []).append(filename)
+        return [(self.file_shards[index], names) for index, names in groups.items()]
+
+    def register(self, hostname, ip, port):
+        """Add a host; re-registering starts it with an empty file list"""
+        shard = self.host_shard(hostname)
+        now = time.time()
+        with shard.lock.write:
+            self._remove_locked(shard, hostname)
+            shard.clients[hostname] = {
+                'ip': ip,
+                'port': port,
+                'files': set(),
+                'roots': {},  # {filename: root hash of the version this host holds}
+                'last_seen': now,
+                'load': 0  # uploads in progress, as last reported in a heartbeat
+            }
+            shard.listings[hostname] = []
+            if self.journal:
+                self.journal({'op': 'register', 'host': hostname, 'ip': ip, 'port': port})
+        self._schedule(hostname, now)
+
+    def _schedule(self, hostname, now):
+        if self.host_ttl:
+            with self.expiry_lock:
+                if hostname not in self.scheduled:
+                    self.scheduled.add(hostname)
+                    heapq.heappush(self.expiry, (now + self.host_ttl, hostname))
+
+    def touch(self, hostname, load=None):
+        """Record that a host is alive, and its load if given
+
+        Returns False if the host is not registered.
+        """
+        shard = self.host_shard(hostname)
+        # Only last_seen and load change, and expire() re-checks last_seen under the write lock
+        with shard.lock.read:
+            info = shard.clients.get(hostname)
+            if info is None:
+                return False
+            info['last_seen'] = time.time()
+            if load is not None:
+                info['load'] = load
+            return True
+
+    def expire(self, now=None):
+        """Evict hosts not heard from within host_ttl; returns their names"""
+        if not self.host_ttl:
+            return []
+        now = time.time() if now is None else now
+        expired = []
+        while True:
+            with self.expiry_lock:
+                if not self.expiry or self.expiry[0][0] > now:
+                    return expired
+                _, hostname = heapq.heappop(self.expiry)
+                shard = self.host_shard(hostname)
+                with shard.lock.write:
+                    info = shard.clients.get(hostname)
+                    if info is None:
+                        self.scheduled.discard(hostname)
+                        continue
+                    deadline = info['last_seen'] + self.host_ttl
+                    if deadline > now:
+                        # Heard from since this entry was pushed
+                        heapq.heappush(self.expiry, (deadline, hostname))
+                        continue
+                    self._remove_locked(shard, hostname)
+                    if self.journal:
+                        self.journal({'op': 'remove', 'host': hostname})
+                self.scheduled.discard(hostname)
+                expired.append(hostname)
+
+    def publish(self, hostname, entries):
+        """Record files held by a host; returns False if it is not registered
+
+        entries are dicts with 'filename' and an optional validated
+        'manifest'. The file index is updated one shard at a time.
+        """
+        shard = self.host_shard(hostname)
+        with shard.lock.write:
+            info = shard.clients.get(hostname)
+            if info is None:
+                return False
+            files = info['files']
+            changed = {}
+            previous = {}  # {filename: root the host held before this publish}
+            new = []
+            for entry in entries:
+                filename = entry['filename']
+                manifest = entry.get('manifest')
+                if filename not in files:
+                    files.add(filename)
+                    new.append(filename)
+                    changed.setdefault(filename, None)
+                if manifest is not None:
+                    previous.setdefault(filename, info['roots'].get(filename))
+                    info['roots'][filename] = manifest['root']
+                    changed[filename] = manifest
+            info['last_seen'] = time.time()
+            _insert_sorted(shard.listings[hostname], new)
+
+            added = []
+            for file_shard, filenames in self._group_by_file_shard(changed):
+                with file_shard.lock.write:
+                    for filename in filenames:
+                        holders = file_shard.index.get(filename)
+                        if holders is None:
+                            holders = file_shard.index[filename] = set()
+                            added.append(filename)
+                        holders.add(hostname)
+                        manifest = changed[filename]
+                        if manifest is not None:
+                            if previous[filename] != manifest['root']:
+                                if previous[filename]:
+                                    file_shard.release_version(filename, previous[filename])
+                                file_shard.hold_version(filename, manifest['root'])
+                            # The newest published version becomes the one fetch hands out
+                            file_shard.add_manifest(filename, manifest)
+            if added and self.on_index_change:
+                self.on_index_change(added, ())
+            if changed and self.journal:
+                self.journal({'op': 'publish', 'host': hostname, 'files': [
+                    {'filename': filename, 'manifest': manifest} if manifest else {'filename': filename}
+                    for filename, manifest in changed.items()
+                ]})
+        return True
+
+    def fetch(self, filename, exclude=None):
+        """Return (peers, manifest) for a file, skipping the host exclude
+
+        The manifest is that of the newest published version some host
+        still holds; hosts holding another version are left out. Peers come
+        least loaded first.
+        """
+        file_shard = self.file_shard(filename)
+        with file_shard.lock.read:
+            holders = list(file_shard.index.get(filename, ()))
+            manifest = file_shard.latest_manifest(filename)
+        root = manifest['root'] if manifest else None
+
+        by_shard = {}
+        for hostname in holders:
+            if hostname != exclude:
+                by_shard.setdefault(hash(hostname) % len(self.host_shards), []).append(hostname)
+        peers = []
+        for index, hostnames in by_shard.items():
+            shard = self.host_shards[index]
+            with shard.lock.read:
+                for hostname in hostnames:
+                    info = shard.clients.get(hostname)
+                    if info is None or filename not in info['files']:
+                        continue  # removed since the index was read
+                    peer_root = info['roots'].get(filename)
+                    if root and peer_root and peer_root != root:
+                        continue  # holds an older version of the file
+                    peers.append({'hostname': hostname, 'ip': info['ip'], 'port': info['port'],
+                                  'load': info['load']})
+        peers.sort(key=lambda peer: peer['load'])
+        return peers, manifest
+
+    def files_of(self, hostname, cursor=None, limit=None):
+        """A page of a host's files in name order, or None if it is not registered
+
+        Returns (files, next_cursor, total): up to limit names after cursor
+        (all of them without a limit), the name to continue after if more
+        remain (else None), and how many files the host has. Only the page
+        is copied under the lock.
+        """
+        shard = self.host_shard(hostname)
+        with shard.lock.read:
+            listing = shard.listings.get(hostname)
+            if listing is None:
+                return None
+            start = bisect.bisect_right(listing, cursor) if cursor is not None else 0
+            end = len(listing) if limit is None else min(start + limit, len(listing))
+            files = listing[start:end]
+            total = len(listing)
+        next_cursor = files[-1] if files and end < total else None
+        return files, next_cursor, total
+
+    def holder_count(self, filename):
+        """Number of hosts holding a file"""
+        file_shard = self.file_shard(filename)
+        with file_shard.lock.read:
+            return len(file_shard.index.get(filename, ()))
+
+    def filenames(self):
+        """Yield every indexed filename, one file shard at a time"""
+        for file_shard in self.file_shards:
+            with file_shard.lock.read:
+                names = list(file_shard.index)
+            yield from names
+
+    def last_seen(self, hostname):
+        """Time a host was last heard from, or None if it is not registered"""
+        shard = self.host_shard(hostname)
+        with shard.lock.read:
+            info = shard.clients.get(hostname)
+            return info['last_seen'] if info else None
+
+    def remove(self, hostname):
+        """Forget a host and drop its files from the index"""
+        shard = self.host_shard(hostname)
+        with shard.lock.write:
+            removed = self._remove_locked(shard, hostname)
+            if removed and self.journal:
+                self.journal({'op': 'remove', 'host': hostname})
+            return removed
+
+    def _remove_locked(self, shard, hostname):
+        """Remove a host while its shard is write-locked"""
+        info = shard.clients.pop(hostname, None)
+        if info is None:
+            return False
+        del shard.listings[hostname]
+        removed = []
+        for file_shard, filenames in self._group_by_file_shard(info['files']):
+            with file_shard.lock.write:
+                for filename in filenames:
+                    root = info['roots'].get(filename)
+                    if root:
+                        file_shard.release_version(filename, root)
+                    holders = file_shard.index.get(filename)
+                    if holders is not None:
+                        holders.discard(hostname)
+                        if not holders:
+                            del file_shard.index[filename]
+                            file_shard.manifests.pop(filename, None)
+                            file_shard.root_holders.pop(filename, None)
+                            removed.append(filename)
+        if removed and self.on_index_change:
+            self.on_index_change((), removed)
+        return True
+
+    def clients(self):
+        """Snapshot of every registered host: {hostname: info}"""
+        snapshot = {}
+        for shard in self.host_shards:
+            with shard.lock.read:
+                for hostname, info in shard.clients.items():
+                    snapshot[hostname] = dict(info, files=set(info['files']), roots=dict(info['roots']))
+        return snapshot
+
+    def apply(self, op):
+        """Replay one journaled operation"""
+        if op['op'] == 'register':
+            self.register(op['host'], op['ip'], op['port'])
+        elif op['op'] == 'publish':
+            self.publish(op['host'], op['files'])
+        elif op['op'] == 'remove':
+            self.remove(op['host'])
+        else:
+            raise ValueError(f"Unknown operation: {op['op']}")
+
+    def dump(self):
+        """Yield the whole state as records for a snapshot, shard by shard
+
+        Host records come first, then one record per manifest still held,
+        oldest first. Each shard is read under its lock, but the dump as a
+        whole is not atomic; replaying the journal written since the dump
+        started makes it consistent again.
+        """
+        for shard in self.host_shards:
+            with shard.lock.read:
+                records = [{'host': hostname, 'ip': info['ip'], 'port': info['port'],
+                            'files': list(info['files']), 'roots': dict(info['roots'])}
+                           for hostname, info in shard.clients.items()]
+            yield from records
+        for file_shard in self.file_shards:
+            with file_shard.lock.read:
+                records = [{'file': filename, 'manifest': manifest}
+                           for filename, versions in file_shard.manifests.items()
+                           for manifest in versions.values()]
+            yield from records
+
+    def restore(self, record):
+        """Load one record produced by dump()"""
+        if 'host' in record:
+            hostname = record['host']
+            shard = self.host_shard(hostname)
+            now = time.time()
+            with shard.lock.write:
+                self._remove_locked(shard, hostname)
+                shard.clients[hostname] = {
+                    'ip': record['ip'],
+                    'port': record['port'],
+                    'files': set(record['files']),
+                    'roots': record['roots'],
+                    'last_seen': now,  # restored hosts get a full ttl to heartbeat again
+                    'load': 0
+                }
+                shard.listings[hostname] = sorted(shard.clients[hostname]['files'])
+                added = []
+                for file_shard, filenames in self._group_by_file_shard(record['files']):
+                    with file_shard.lock.write:
+                        for filename in filenames:
+                            if filename not in file_shard.index:
+                                file_shard.index[filename] = set()
+                                added.append(filename)
+                            file_shard.index[filename].add(hostname)
+                            root = record['roots'].get(filename)
+                            if root:
+                                file_shard.hold_version(filename, root)
+                if added and self.on_index_change:
+                    self.on_index_change(added, ())
+            self._schedule(hostname, now)
+        else:
+            file_shard = self.file_shard(record['file'])
+            with file_shard.lock.write:
+                if record['manifest']['root'] in file_shard.root_holders.get(record['file'], ()):
+                    file_shard.add_manifest(record['file'], record['manifest'])
+
+    def client_count(self):
+        return sum(len(shard.clients) for shard in self.host_shards)
+
+    def file_count(self):
+        return sum(len(shard.index) for shard in self.file_shards)
+
+    def manifest_count(self):
+        return sum(len(shard.manifests) for shard in self.file_shards)
@@ -0,0 +1,125 @@
+"""
+P2P File Sharing - Repository Import
+Brings published files into a client repository without copying where possible
+"""
+
+import errno
+import json
+import os
+import shutil
+import threading
+
+from manifest import copy_with_manifest, hash_file
+
+IMPORT_MODES = ('copy', 'link', 'inplace')
+REGISTRY_FILE = '.published.json'
+
+# Linux FICLONE ioctl: share the source's extents (btrfs, XFS with reflink=1, ...)
+FICLONE = 0x40049409
+
+
+def reflink(src_path, dest_path):
+    """Create dest_path as a copy-on-write clone of src_path"""
+    import fcntl
+
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dest.close()
+            os.unlink(dest_path)
+            raise
+
+
+def link_into(src_path, dest_path):
+    """Place src_path at dest_path without copying data if possible
+
+    Tries a hardlink first, then a reflink, then a symlink. Only when the
+    source is on another device (where none of the no-copy options can
+    work, or a symlink would leave the repository depending on another
+    mount) is the data copied. Returns (method, manifest-or-None); the
+    manifest is only computed here when a copy was made.
+    """
+    if os.path.lexists(dest_path):
+        os.unlink(dest_path)
+    try:
+        os.link(src_path, dest_path)
+        return 'hardlink', None
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            manifest = copy_with_manifest(src_path, dest_path)
+            shutil.copystat(src_path, dest_path)
+            return 'copy', manifest
+
+    # Same device but no hardlinks (e.g. FAT, some network filesystems)
+    try:
+        reflink(src_path, dest_path)
+        return 'reflink', None
+    except (OSError, ImportError):
+        pass
+    os.symlink(os.path.abspath(src_path), dest_path)
+    return 'symlink', None
+
+
+def place_file(src_path, dest_path, mode):
+    """Import one file into the repository; returns (method, manifest)
+
+    A copy is written to a temporary file and renamed over dest_path, so
+    an existing repository file that is a link (to the user's source, or
+    to another repository file) is replaced rather than written through.
+    """
+    if mode == 'link':
+        method, manifest = link_into(src_path, dest_path)
+        if manifest is None:
+            manifest = hash_file(src_path)
+        return method, manifest
+    temp_path = dest_path.with_name(dest_path.name + '.import')
+    try:
+        manifest = copy_with_manifest(src_path, temp_path)
+        shutil.copystat(src_path, temp_path)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return 'copy', manifest
+
+
+class PublishedRegistry:
+    """Files served in place from outside the repository
+
+    Maps published names to absolute source paths and is persisted as
+    JSON in the repository so in-place publications survive a restart.
+    """
+
+    def __init__(self, repository_path):
+        self.path = repository_path / REGISTRY_FILE
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def add(self, filename, source_path):
+        with self.lock:
+            self.entries[filename] = os.path.abspath(source_path)
+
+    def remove(self, filename):
+        with self.lock:
+            return self.entries.pop(filename, None) is not None
+
+    def get(self, filename):
+        with self.lock:
+            return self.entries.get(filename)
+
+    def names(self):
+        with self.lock:
+            return list(self.entries)
+
+    def save(self):
+        with self.lock:
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.path)
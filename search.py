@@ -0,0 +1,231 @@
+"""
+P2P File Sharing - Filename Search
+Prefix, substring and glob lookups over the names in the tracker's file index
+"""
+
+import bisect
+import fnmatch
+import re
+import threading
+
+from registry import RWLock
+
+MODES = ('prefix', 'substring', 'glob')
+
+# Substrings are found through the names containing each of their n-grams
+GRAM = 3
+
+# When the rarest n-gram of a query is in more than this share of all names,
+# walking the sorted names is cheaper than intersecting the n-gram sets
+WALK_SHARE = 0.1
+
+# Results per page when the request gives no limit, and the most it may ask for
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def default_mode(query):
+    """glob if the query has wildcards, substring otherwise"""
+    return 'glob' if any(c in query for c in '*?[') else 'substring'
+
+
+def grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def glob_literals(pattern):
+    """Literal runs of a glob pattern; the first is its fixed prefix (maybe '')
+
+    Bracket sets follow fnmatch: '[!...]' negates, a ']' right after the
+    opening bracket is part of the set, and a '[' that is never closed is
+    an ordinary character.
+    """
+    runs = ['']
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c in '*?':
+            runs.append('')
+        elif c == '[':
+            j = i
+            if j < len(pattern) and pattern[j] == '!':
+                j += 1
+            if j < len(pattern) and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                runs[-1] += c
+            else:
+                i = j + 1
+                runs.append('')
+        else:
+            runs[-1] += c
+    return runs
+
+
+def _add_grams(index, name):
+    for gram in grams(name):
+        holders = index.get(gram)
+        if holders is None:
+            index[gram] = {name}
+        else:
+            holders.add(name)
+
+
+class SearchIndex:
+    """Published filenames in sorted order, plus an n-gram index
+
+    A prefix is a range of the sorted list found by bisection. A
+    substring (or the literal parts of a glob) narrows the search to the
+    names holding all of its n-grams, the smallest set first, and every
+    candidate is then checked against the query itself. Matching is case
+    sensitive, like filenames.
+
+    Results come in name order; a page ends with the name to pass as the
+    cursor for the next one. The index is built from names() on the first
+    search, so a tracker nobody searches pays nothing for it, and
+    update() keeps it current after that. The build runs without the
+    index lock; updates arriving meanwhile are queued and replayed on top
+    of it, so publishes never wait for a build. The index may briefly
+    hold names that have just left the file index; callers check results
+    against the registry and purge() the stale ones.
+    """
+
+    def __init__(self, names):
+        self.names_source = names  # callable yielding every indexed filename
+        self.lock = RWLock()
+        self.build_lock = threading.Lock()
+        self.built = False
+        self.pending = None  # updates queued while a build runs
+        self.names = []  # sorted
+        self.grams = {}  # {n-gram: {filename}}
+
+    def _build(self):
+        with self.build_lock:
+            if self.built:
+                return
+            with self.lock.write:
+                self.pending = []
+            names = sorted(set(self.names_source()))
+            index = {}
+            for name in names:
+                _add_grams(index, name)
+            with self.lock.write:
+                self.names = names
+                self.grams = index
+                for added, removed in self.pending:
+                    self._update_locked(added, removed)
+                self.pending = None
+                self.built = True
+
+    def _index_locked(self, name):
+        _add_grams(self.grams, name)
+
+    def _unindex_locked(self, name):
+        for gram in grams(name):
+            holders = self.grams.get(gram)
+            if holders is not None:
+                holders.discard(name)
+                if not holders:
+                    del self.grams[gram]
+
+    def update(self, added=(), removed=()):
+        """Names that entered and left the file index"""
+        with self.lock.write:
+            if self.pending is not None:
+                self.pending.append((list(added), list(removed)))
+            elif self.built:
+                self._update_locked(added, removed)
+
+    def _update_locked(self, added, removed):
+        self._remove_locked(removed)
+        new = [name for name in added if not self._contains_locked(name)]
+        for name in new:
+            self._index_locked(name)
+        if len(new) > 1:
+            # Two sorted runs; the sort merges them in linear time
+            self.names.extend(sorted(set(new)))
+            self.names.sort()
+        elif new:
+            bisect.insort(self.names, new[0])
+
+    def _contains_locked(self, name):
+        position = bisect.bisect_left(self.names, name)
+        return position < len(self.names) and self.names[position] == name
+
+    def _remove_locked(self, removed):
+        removed = [name for name in removed if self._contains_locked(name)]
+        for name in removed:
+            self._unindex_locked(name)
+        if len(removed) > 1:
+            gone = set(removed)
+            self.names = [name for name in self.names if name not in gone]
+        elif removed:
+            del self.names[bisect.bisect_left(self.names, removed[0])]
+
+    def purge(self, names, holder_count):
+        """Drop names that holder_count still reports no holders for"""
+        with self.lock.write:
+            self._remove_locked([name for name in names if not holder_count(name)])
+
+    def search(self, query, mode, limit=DEFAULT_LIMIT, cursor=None):
+        """Up to limit matching names after cursor, and the next cursor (or None)"""
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if not self.built:
+            self._build()
+
+        if mode == 'prefix':
+            prefix, required, match = query, (), None
+        elif mode == 'substring':
+            prefix, required, match = '', grams(query), lambda name: query in name
+        else:
+            runs = glob_literals(query)
+            prefix = runs[0]
+            required = set().union(*(grams(run) for run in runs))
+            match = re.compile(fnmatch.translate(query)).match
+
+        with self.lock.read:
+            candidates = self._candidates_locked(required) if required else None
+            if candidates is not None:
+                start = bisect.bisect_right(candidates, cursor) if cursor is not None else 0
+            else:
+                # No selective n-grams: walk the sorted names from the prefix
+                required = ()
+                candidates = self.names
+                start = bisect.bisect_left(candidates, prefix)
+                if cursor is not None:
+                    start = max(start, bisect.bisect_right(candidates, cursor))
+            results = []
+            for position in range(start, len(candidates)):
+                name = candidates[position]
+                if not name.startswith(prefix):
+                    if required:
+                        continue
+                    break  # past the end of the prefix range
+                if match is None or match(name):
+                    results.append(name)
+                    if len(results) > limit:
+                        break
+        if len(results) > limit:
+            del results[limit:]
+            return results, results[-1]
+        return results, None
+
+    def _candidates_locked(self, required):
+        """Sorted names holding every n-gram in required
+
+        None if even the rarest n-gram is too common to be worth it.
+        """
+        sets = sorted((self.grams.get(gram, set()) for gram in required), key=len)
+        if not sets[0]:
+            return []
+        if len(sets[0]) > WALK_SHARE * len(self.names):
+            return None
+        candidates = set(sets[0])
+        for other in sets[1:]:
+            candidates &= other
+            if not candidates:
+                break
+        return sorted(candidates)
@@ -3,32 +3,106 @@ P2P File Sharing - Central Server
 Tracks connected clients and their file repositories
 """
 
+import argparse
 import socket
 import threading
 import json
 import time
 from datetime import datetime
 
+from async_engine import AsyncioEngine
+from logger import LEVELS, Logger
+from manifest import is_valid_manifest
+from metrics import Metrics, MetricsServer
+from protocol import MessageDecoder, ProtocolError, RECV_SIZE, send_message
+from registry import DEFAULT_SHARDS, Registry
+from search import DEFAULT_LIMIT, MAX_LIMIT, MODES, SearchIndex, default_mode
+from storage import StateStore
+
+
+ENGINES = ('threaded', 'asyncio')
+
+# Hosts silent for HOST_TTL seconds are evicted; expiry is checked every SWEEP_INTERVAL
+HOST_TTL = 60.0
+SWEEP_INTERVAL = 1.0
+
+# Files per discover reply when the request gives no limit, and the most it may ask for
+DISCOVER_PAGE = 1000
+MAX_DISCOVER_PAGE = 10000
+
+
+def is_count(value, minimum=0):
+    """Whether a request field is an integer of at least minimum (JSON true/false are not)"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= minimum
+
 
 class P2PServer:
-    def __init__(self, host='0.0.0.0', port=5000):
+    def __init__(self, host='0.0.0.0', port=5000, engine='threaded', backlog=128, shards=DEFAULT_SHARDS,
+                 host_ttl=HOST_TTL, state_dir=None, log_level='info', metrics_port=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
         self.host = host
         self.port = port
-        self.clients = {}  # {hostname: {'ip': ip, 'port': port, 'files': [filenames], 'last_seen': timestamp}}
-        self.lock = threading.Lock()
+        self.engine = engine
+        self.backlog = backlog
+        # Clients and the file index, split into shards with their own locks
+        self.host_ttl = host_ttl
+        self.registry = Registry(shards, host_ttl)
+        # Filename search, built on the first search request
+        self.search = SearchIndex(self.registry.filenames)
+        self.registry.on_index_change = self.search.update
         self.running = False
         self.server_socket = None
+        self.async_engine = None
+        self.sweeper_stop = threading.Event()
+        
+        # With a state directory, changes are logged there and replayed on start
+        self.state_dir = state_dir
+        self.store = None
+        
+        # Progress messages and instrumentation (stats command, optional /metrics endpoint)
+        self.log = Logger('SERVER', log_level)
+        self.metrics = Metrics()
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.registry.observe_lock_waits(self.metrics.observe_lock_wait)
+        self.metrics.gauge('clients', 'Registered clients', self.registry.client_count)
+        self.metrics.gauge('indexed_files', 'Distinct published filenames', self.registry.file_count)
+        self.metrics.gauge('manifests', 'Files with a piece manifest', self.registry.manifest_count)
+        self.metrics.gauge('threads', 'Live threads in the server process', threading.active_count)
+        self.metrics.gauge('expiry_heap', 'Entries in the host expiry heap', lambda: len(self.registry.expiry))
+        self.metrics.gauge('log_suppressed', 'Log lines dropped by the rate limit',
+                           lambda: self.log.suppressed_total)
         
     def start(self):
         """Start the server"""
+        if self.state_dir:
+            self.recover_state()
+            
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(self.backlog)
+        self.port = self.server_socket.getsockname()[1]
         self.running = True
         
-        print(f"[SERVER] Started on {self.host}:{self.port}")
+        self.log.info("Started on %s:%s (%s engine)", self.host, self.port, self.engine)
         
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics, self.host, self.metrics_port)
+            self.metrics_server.start()
+            self.log.info("Metrics at http://%s:%s/metrics", self.host, self.metrics_server.port)
+        
+        if self.host_ttl:
+            sweeper = threading.Thread(target=self.sweep_expired, daemon=True)
+            sweeper.start()
+            
+        if self.engine == 'asyncio':
+            # All connections are served from one event loop thread
+            self.async_engine = AsyncioEngine(self)
+            self.async_engine.start(self.server_socket)
+            return
+            
         # Start accepting connections
         accept_thread = threading.Thread(target=self.accept_connections, daemon=True)
         accept_thread.start()
@@ -38,7 +112,7 @@ class P2PServer:
         while self.running:
             try:
                 client_socket, address = self.server_socket.accept()
-                print(f"[SERVER] New connection from {address}")
+                self.log.info("New connection from %s", address)
                 
                 # Handle client in a new thread
                 client_thread = threading.Thread(
@@ -49,75 +123,166 @@ class P2PServer:
                 client_thread.start()
             except Exception as e:
                 if self.running:
-                    print(f"[SERVER] Error accepting connection: {e}")
+                    self.log.error("Error accepting connection: %s", e)
                     
+    def recover_state(self):
+        """Load the saved registry from state_dir and start logging to it"""
+        started = time.perf_counter()
+        self.store = StateStore(self.state_dir, logger=self.log)
+        records, operations = self.store.recover(self.registry)
+        self.store.open(self.registry)
+        self.metrics.gauge('state_log_batches', 'fsynced state log writes', lambda: self.store.batches)
+        self.log.info("Recovered %d client(s) and %d file(s) from %s "
+                      "(%d snapshot records, %d logged operations, %.2fs)",
+                      self.registry.client_count(), self.registry.file_count(), self.state_dir,
+                      records, operations, time.perf_counter() - started)
+        
+    def wait_durable(self):
+        """Block until the changes made by this thread's requests are on disk"""
+        if self.store:
+            seq = self.store.pending_seq()
+            if seq:
+                self.store.wait(seq)
+                
+    def sweep_expired(self):
+        """Evict hosts whose heartbeats stopped, until the server stops"""
+        while not self.sweeper_stop.wait(SWEEP_INTERVAL):
+            for hostname in self.registry.expire():
+                self.log.info("Expired client: %s (no heartbeat for %gs)", hostname, self.host_ttl)
+                
     def handle_client(self, client_socket, address):
         """Handle client requests"""
+        decoder = MessageDecoder()
+        self.metrics.connection_opened()
         try:
             while self.running:
-                data = client_socket.recv(4096).decode('utf-8')
+                data = client_socket.recv(RECV_SIZE)
                 if not data:
                     break
                     
-                try:
-                    request = json.loads(data)
-                    command = request.get('command')
-                    
-                    if command == 'register':
-                        response = self.handle_register(request)
-                    elif command == 'publish':
-                        response = self.handle_publish(request)
-                    elif command == 'fetch':
-                        response = self.handle_fetch(request)
-                    elif command == 'discover':
-                        response = self.handle_discover(request)
-                    elif command == 'ping':
-                        response = self.handle_ping(request)
-                    else:
-                        response = {'status': 'error', 'message': 'Unknown command'}
-                        
-                    client_socket.send(json.dumps(response).encode('utf-8'))
-                    
-                except json.JSONDecodeError:
-                    error_response = {'status': 'error', 'message': 'Invalid JSON'}
-                    client_socket.send(json.dumps(error_response).encode('utf-8'))
+                # A single read may carry several requests, or only part of one
+                responses = [self.handle_request(payload) for payload in decoder.feed(data)]
+                # Replies are only sent once the changes they confirm are durable
+                self.wait_durable()
+                for response in responses:
+                    send_message(client_socket, response)
                     
+        except ProtocolError as e:
+            self.log.warning("Protocol error from %s: %s", address, e)
         except Exception as e:
-            print(f"[SERVER] Error handling client {address}: {e}")
+            self.log.error("Error handling client %s: %s", address, e)
         finally:
+            self.metrics.connection_closed()
             client_socket.close()
             
+    def handle_request(self, payload):
+        """Decode one request payload and dispatch it to its handler"""
+        started = time.perf_counter()
+        try:
+            request = json.loads(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.metrics.observe_request('invalid', time.perf_counter() - started, False)
+            return {'status': 'error', 'message': 'Invalid JSON'}
+            
+        if not isinstance(request, dict):
+            self.metrics.observe_request('invalid', time.perf_counter() - started, False)
+            return {'status': 'error', 'message': 'Invalid request'}
+            
+        command = request.get('command')
+        
+        # A failing handler answers with an error; dropping the connection
+        # would also fail every other request pipelined on it
+        try:
+            if command == 'register':
+                response = self.handle_register(request)
+            elif command == 'publish':
+                response = self.handle_publish(request)
+            elif command == 'fetch':
+                response = self.handle_fetch(request)
+            elif command == 'discover':
+                response = self.handle_discover(request)
+            elif command == 'search':
+                response = self.handle_search(request)
+            elif command == 'ping':
+                response = self.handle_ping(request)
+            elif command == 'heartbeat':
+                response = self.handle_heartbeat(request)
+            elif command == 'stats':
+                response = self.handle_stats(request)
+            else:
+                command = 'unknown'  # keeps arbitrary names out of the metrics
+                response = {'status': 'error', 'message': 'Unknown command'}
+        except Exception as e:
+            self.log.error("Error handling %s request: %s", command, e)
+            response = {'status': 'error', 'message': 'Invalid request'}
+            
+        self.metrics.observe_request(command, time.perf_counter() - started,
+                                     response['status'] == 'success')
+            
+        # Echo the request id so pipelined clients can match replies
+        if 'request_id' in request:
+            response['request_id'] = request['request_id']
+        return response
+            
     def handle_register(self, request):
         """Register a new client"""
         hostname = request.get('hostname')
         ip = request.get('ip')
         port = request.get('port')
+        if not isinstance(hostname, str) or not hostname:
+            return {'status': 'error', 'message': 'Invalid hostname'}
         
-        with self.lock:
-            self.clients[hostname] = {
-                'ip': ip,
-                'port': port,
-                'files': [],
-                'last_seen': time.time()
-            }
+        self.registry.register(hostname, ip, port)
             
-        print(f"[SERVER] Registered client: {hostname} ({ip}:{port})")
-        return {'status': 'success', 'message': 'Client registered'}
+        self.log.info("Registered client: %s (%s:%s)", hostname, ip, port)
+        return {'status': 'success', 'message': 'Client registered', 'ttl': self.host_ttl}
+        
+    def handle_heartbeat(self, request):
+        """Keep a client registered; an unknown client must register again
+
+        The optional 'load' (uploads in progress) orders fetch results.
+        """
+        load = request.get('load')
+        if not is_count(load):
+            load = None
+        if self.registry.touch(request.get('hostname'), load):
+            return {'status': 'success', 'ttl': self.host_ttl}
+        return {'status': 'error', 'message': 'Client not registered', 'registered': False}
         
     def handle_publish(self, request):
-        """Handle file publish from client"""
+        """Handle file publish from client
+
+        A request names one file ('filename', optional 'manifest') or a
+        batch of them ('files': [{'filename': ..., 'manifest': ...}, ...]);
+        a batch takes the host's shard lock once and each file shard once.
+        """
         hostname = request.get('hostname')
-        filename = request.get('filename')
+        if not isinstance(hostname, str):
+            return {'status': 'error', 'message': 'Invalid hostname'}
+        if 'files' in request:
+            entries = request['files']
+            if not isinstance(entries, list):
+                return {'status': 'error', 'message': 'Invalid file list'}
+        else:
+            entries = [{'filename': request.get('filename'), 'manifest': request.get('manifest')}]
+            
+        # Validate outside the lock; hashing the piece lists is the costly part
+        for entry in entries:
+            if (not isinstance(entry, dict) or not isinstance(entry.get('filename'), str)
+                    or not entry['filename']):
+                return {'status': 'error', 'message': 'Invalid file entry'}
+            manifest = entry.get('manifest')
+            if manifest is not None and not is_valid_manifest(manifest):
+                return {'status': 'error', 'message': f"Invalid manifest for {entry['filename']}"}
         
-        with self.lock:
-            if hostname not in self.clients:
-                return {'status': 'error', 'message': 'Client not registered'}
-                
-            if filename not in self.clients[hostname]['files']:
-                self.clients[hostname]['files'].append(filename)
-                self.clients[hostname]['last_seen'] = time.time()
+        if not self.registry.publish(hostname, entries):
+            return {'status': 'error', 'message': 'Client not registered'}
                 
-        print(f"[SERVER] {hostname} published: {filename}")
+        if 'files' in request:
+            self.log.info("%s published %d file(s)", hostname, len(entries))
+            return {'status': 'success', 'message': f'{len(entries)} files published', 'published': len(entries)}
+        filename = entries[0]['filename']
+        self.log.info("%s published: %s", hostname, filename)
         return {'status': 'success', 'message': f'File {filename} published'}
         
     def handle_fetch(self, request):
@@ -125,80 +290,157 @@ class P2PServer:
         filename = request.get('filename')
         requesting_hostname = request.get('hostname')
         
-        peers = []
-        with self.lock:
-            for hostname, info in self.clients.items():
-                if filename in info['files'] and hostname != requesting_hostname:
-                    peers.append({
-                        'hostname': hostname,
-                        'ip': info['ip'],
-                        'port': info['port']
-                    })
+        # Only the hosts holding the file are visited
+        peers, manifest = self.registry.fetch(filename, exclude=requesting_hostname)
                     
         if peers:
-            print(f"[SERVER] Found {len(peers)} peer(s) with file: {filename}")
-            return {'status': 'success', 'peers': peers}
+            self.log.info("Found %d peer(s) with file: %s", len(peers), filename)
+            response = {'status': 'success', 'peers': peers}
+            if manifest:
+                response['manifest'] = manifest
+            return response
         else:
             return {'status': 'error', 'message': f'No peers found with file: {filename}'}
             
+    def handle_stats(self, request):
+        """Report the server's metrics"""
+        return {'status': 'success', 'stats': self.metrics.snapshot()}
+        
     def handle_discover(self, request):
-        """Discover files from a specific hostname"""
+        """Discover files from a specific hostname
+
+        Files come in name order, 'limit' at a time; a page that is not the
+        last carries 'next_cursor' to pass back as 'cursor'.
+        """
         hostname = request.get('hostname')
+        limit = request.get('limit', DISCOVER_PAGE)
+        if not is_count(limit, 1):
+            return {'status': 'error', 'message': 'Invalid limit'}
+        cursor = request.get('cursor')
+        if cursor is not None and not isinstance(cursor, str):
+            return {'status': 'error', 'message': 'Invalid cursor'}
         
-        with self.lock:
-            if hostname in self.clients:
-                files = self.clients[hostname]['files']
-                return {
-                    'status': 'success',
-                    'hostname': hostname,
-                    'files': files
-                }
+        page = self.registry.files_of(hostname, cursor, min(limit, MAX_DISCOVER_PAGE))
+        if page is not None:
+            files, next_cursor, total = page
+            return {
+                'status': 'success',
+                'hostname': hostname,
+                'files': files,
+                'next_cursor': next_cursor,
+                'total': total
+            }
+        else:
+            return {'status': 'error', 'message': f'Host {hostname} not found'}
+                
+    def handle_search(self, request):
+        """Find published filenames by prefix, substring or glob pattern
+
+        Results are in name order, limit at a time; a page that is not the
+        last carries 'next_cursor' to pass back as 'cursor'. Each result
+        gives the number of peers holding the file.
+        """
+        query = request.get('query')
+        if not isinstance(query, str):
+            return {'status': 'error', 'message': 'Invalid query'}
+        mode = request.get('mode') or default_mode(query)
+        if mode not in MODES:
+            return {'status': 'error', 'message': f"mode must be one of {', '.join(MODES)}"}
+        limit = request.get('limit', DEFAULT_LIMIT)
+        if not is_count(limit, 1):
+            return {'status': 'error', 'message': 'Invalid limit'}
+        cursor = request.get('cursor')
+        if cursor is not None and not isinstance(cursor, str):
+            return {'status': 'error', 'message': 'Invalid cursor'}
+            
+        names, next_cursor = self.search.search(query, mode, min(limit, MAX_LIMIT), cursor)
+        results = []
+        stale = []
+        for name in names:
+            count = self.registry.holder_count(name)
+            if count:
+                results.append({'filename': name, 'peers': count})
             else:
-                return {'status': 'error', 'message': f'Host {hostname} not found'}
+                stale.append(name)
+        if stale:
+            self.search.purge(stale, self.registry.holder_count)
+        return {'status': 'success', 'query': query, 'mode': mode, 'results': results,
+                'next_cursor': next_cursor}
                 
     def handle_ping(self, request):
         """Check if a host is alive"""
         hostname = request.get('hostname')
         
-        with self.lock:
-            if hostname in self.clients:
-                last_seen = self.clients[hostname]['last_seen']
-                current_time = time.time()
-                time_diff = current_time - last_seen
-                
-                # Consider alive if seen in last 60 seconds
-                is_alive = time_diff < 60
-                
-                return {
-                    'status': 'success',
-                    'hostname': hostname,
-                    'alive': is_alive,
-                    'last_seen': datetime.fromtimestamp(last_seen).strftime('%Y-%m-%d %H:%M:%S')
-                }
-            else:
-                return {'status': 'error', 'message': f'Host {hostname} not found'}
+        last_seen = self.registry.last_seen(hostname)
+        if last_seen is not None:
+            current_time = time.time()
+            time_diff = current_time - last_seen
+            
+            # Consider alive if seen within the heartbeat expiry window
+            is_alive = time_diff < (self.host_ttl or HOST_TTL)
+            
+            return {
+                'status': 'success',
+                'hostname': hostname,
+                'alive': is_alive,
+                'last_seen': datetime.fromtimestamp(last_seen).strftime('%Y-%m-%d %H:%M:%S')
+            }
+        else:
+            return {'status': 'error', 'message': f'Host {hostname} not found'}
                 
+    def remove_client(self, hostname):
+        """Forget a client and drop its files from the index"""
+        return self.registry.remove(hostname)
+        
     def stop(self):
         """Stop the server"""
         self.running = False
+        self.sweeper_stop.set()
+        if self.async_engine:
+            self.async_engine.stop()
         if self.server_socket:
             self.server_socket.close()
-        print("[SERVER] Stopped")
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.store:
+            self.store.close()
+        self.log.info("Stopped")
         
     def get_client_list(self):
         """Get list of connected clients"""
-        with self.lock:
-            return dict(self.clients)
+        return self.registry.clients()
 
 
 def main():
-    server = P2PServer(host='0.0.0.0', port=5000)
+    parser = argparse.ArgumentParser(description='P2P File Sharing - Central Server')
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=5000, help='port to listen on (default: 5000)')
+    parser.add_argument('--engine', choices=ENGINES, default='threaded',
+                        help='connection engine: one thread per client or a single asyncio loop')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS,
+                        help=f'lock shards for the client registry and file index (default: {DEFAULT_SHARDS})')
+    parser.add_argument('--host-ttl', type=float, default=HOST_TTL,
+                        help=f'evict clients silent for this many seconds, 0 to never evict (default: {HOST_TTL:g})')
+    parser.add_argument('--state-dir',
+                        help='persist the registry in this directory and restore it on start')
+    parser.add_argument('--log-level', choices=list(LEVELS), default='info',
+                        help="console messages to show; 'off' disables them (default: info)")
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics over HTTP on this port at /metrics')
+    args = parser.parse_args()
+    
+    server = P2PServer(host=args.host, port=args.port, engine=args.engine, shards=args.shards,
+                       host_ttl=args.host_ttl, state_dir=args.state_dir,
+                       log_level=args.log_level, metrics_port=args.metrics_port)
     server.start()
     
     print("\nServer Commands:")
     print("  discover <hostname> - Discover files from a host")
+    print("  search <query> [prefix|substring|glob] - Find published files by name")
     print("  ping <hostname> - Check if a host is alive")
     print("  list - List all connected clients")
+    print("  stats - Show request, lock and connection metrics")
+    print("  log <level> - Set console messages: debug, info, warning, error or off")
     print("  quit - Stop the server")
     
     try:
@@ -225,9 +467,31 @@ def main():
                 hostname = parts[1]
                 result = server.handle_discover({'hostname': hostname})
                 if result['status'] == 'success':
-                    print(f"\nFiles on {hostname}:")
-                    for f in result['files']:
-                        print(f"  - {f}")
+                    print(f"\nFiles on {hostname} ({result['total']}):")
+                    while True:
+                        for f in result['files']:
+                            print(f"  - {f}")
+                        if result['next_cursor'] is None:
+                            break
+                        result = server.handle_discover({'hostname': hostname,
+                                                         'cursor': result['next_cursor']})
+                        if result['status'] != 'success':
+                            break  # the host went away meanwhile
+                else:
+                    print(f"Error: {result['message']}")
+            elif cmd == 'search' and len(parts) > 1:
+                words = parts[1].rsplit(maxsplit=1)
+                if len(words) == 2 and words[1] in MODES:
+                    query, mode = words
+                else:
+                    query, mode = parts[1], None
+                result = server.handle_search({'query': query, 'mode': mode})
+                if result['status'] == 'success':
+                    print(f"\n{len(result['results'])} match(es) ({result['mode']}):")
+                    for entry in result['results']:
+                        print(f"  - {entry['filename']} ({entry['peers']} peer(s))")
+                    if result['next_cursor']:
+                        print("  ... more results, narrow the search")
                 else:
                     print(f"Error: {result['message']}")
             elif cmd == 'ping' and len(parts) > 1:
@@ -238,6 +502,25 @@ def main():
                     print(f"{hostname} is {status} (last seen: {result['last_seen']})")
                 else:
                     print(f"Error: {result['message']}")
+            elif cmd == 'stats':
+                stats = server.metrics.snapshot()
+                print(f"\nUptime {stats['uptime_sec']}s, {stats['connections']} open connection(s), "
+                      f"{stats['threads']} thread(s)")
+                print(f"Clients: {stats['clients']}, indexed files: {stats['indexed_files']}, "
+                      f"manifests: {stats['manifests']}")
+                print("Requests:")
+                for command, summary in stats['requests'].items():
+                    print(f"  {command:<10} {summary['count']:>8} requests, {summary['errors']} err, "
+                          f"p50 {summary['p50_ms']}ms, p99 {summary['p99_ms']}ms, max {summary['max_ms']}ms")
+                for kind, summary in stats['lock_waits'].items():
+                    print(f"Lock waits ({kind}): {summary['count']}, p99 {summary['p99_ms']}ms, "
+                          f"max {summary['max_ms']}ms")
+            elif cmd == 'log' and len(parts) > 1:
+                try:
+                    server.log.set_level(parts[1].lower())
+                    print(f"Log level set to {parts[1].lower()}")
+                except ValueError as e:
+                    print(f"Error: {e}")
             else:
                 print("Unknown command")
                 
@@ -0,0 +1,136 @@
+"""
+P2P File Sharing - Tracker Session
+Persistent, pipelined client connection to the central server
+"""
+
+import itertools
+import json
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from protocol import MessageDecoder, ProtocolError, RECV_SIZE, send_message
+
+
+class TrackerSession:
+    """Long-lived connection to the tracker shared by all client requests
+
+    Requests are tagged with a request_id and written without waiting for
+    earlier replies, so several can be in flight on the one socket. A
+    reader thread matches each reply to its request by that id. If the
+    connection drops, in-flight requests fail and the next request
+    reconnects transparently.
+    """
+
+    def __init__(self, host, port, timeout=10.0, retries=3, retry_delay=0.5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self.lock = threading.Lock()  # guards sock and pending
+        self.send_lock = threading.Lock()  # keeps frames from interleaving
+        self.sock = None
+        self.pending = {}  # {request_id: (socket, Future)}
+        self.request_ids = itertools.count(1)
+        self.closed = False
+
+    def connect(self):
+        """Open the connection if it is not already open"""
+        with self.lock:
+            return self._ensure_connected()
+
+    def _ensure_connected(self):
+        if self.closed:
+            raise ConnectionError("Session closed")
+        if self.sock is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock = sock
+            reader = threading.Thread(target=self._read_replies, args=(sock,), daemon=True)
+            reader.start()
+        return self.sock
+
+    def submit(self, request):
+        """Send a request without waiting; returns a Future for the reply"""
+        future = Future()
+        with self.lock:
+            sock = self._ensure_connected()
+            request_id = next(self.request_ids)
+            future.request_id = request_id
+            self.pending[request_id] = (sock, future)
+        # Sending outside self.lock lets the reader keep draining replies
+        try:
+            with self.send_lock:
+                send_message(sock, dict(request, request_id=request_id))
+        except OSError as e:
+            with self.lock:
+                self._drop_locked(sock, e)
+        return future
+
+    def request(self, request, timeout=None):
+        """Send a request and wait for its reply, reconnecting if needed"""
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(self.retries + 1):
+            future = self.submit(request)
+            try:
+                return future.result(timeout)
+            except TimeoutError:
+                with self.lock:
+                    self.pending.pop(future.request_id, None)
+                raise
+            except (ConnectionError, OSError):
+                if self.closed or attempt == self.retries:
+                    raise
+                time.sleep(self.retry_delay * (attempt + 1))
+
+    def _read_replies(self, sock):
+        """Dispatch replies from one connection to their waiting requests"""
+        decoder = MessageDecoder()
+        error = ConnectionError("Connection to server closed")
+        try:
+            while True:
+                data = sock.recv(RECV_SIZE)
+                if not data:
+                    break
+                for payload in decoder.feed(data):
+                    response = json.loads(payload)
+                    request_id = response.pop('request_id', None)
+                    with self.lock:
+                        entry = self.pending.pop(request_id, None)
+                    if entry is not None:
+                        entry[1].set_result(response)
+        except (OSError, ProtocolError, ValueError) as e:
+            error = ConnectionError(f"Connection to server lost: {e}")
+        with self.lock:
+            self._drop_locked(sock, error)
+
+    def _drop_locked(self, sock, error):
+        """Forget a dead connection and fail the requests still waiting on it"""
+        if self.sock is sock:
+            self.sock = None
+        try:
+            # shutdown() wakes the reader thread's recv(); close() alone does not
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+        if not isinstance(error, ConnectionError):
+            error = ConnectionError(str(error))
+        for request_id, (owner, future) in list(self.pending.items()):
+            if owner is sock:
+                del self.pending[request_id]
+                future.set_exception(error)
+
+    def close(self):
+        """Close the session and fail any outstanding requests"""
+        with self.lock:
+            self.closed = True
+            if self.sock is not None:
+                self._drop_locked(self.sock, ConnectionError("Session closed"))
@@ -0,0 +1,294 @@
+"""
+P2P File Sharing - Durable Tracker State
+Append-only operation log with group commit, plus compacted snapshots
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from logger import Logger
+
+SNAPSHOT_FILE = 'snapshot.jsonl'
+LOG_PREFIX = 'oplog-'
+LOG_SUFFIX = '.jsonl'
+
+# Logged operations between snapshots
+COMPACT_AFTER = 100000
+
+# Pause before retrying a failed log write, doubling up to the maximum
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+
+
+def _sync_directory(directory):
+    """fsync a directory so renames and new files in it survive a crash"""
+    try:
+        fd = os.open(directory, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except OSError:
+        return  # not supported on this platform (e.g. Windows)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class StateStore:
+    """Persists a Registry as a snapshot plus a log of later operations
+
+    The registry journals each change to log(), which only appends it to
+    an in-memory buffer. A flusher thread writes out and fsyncs whatever
+    has accumulated as one batch, so concurrent requests share a single
+    fsync (group commit). Callers wait for their operations with wait()
+    or on_durable() before replying.
+
+    The log is split into numbered segments. After compact_after
+    operations the flusher starts a new segment and a background thread
+    writes a snapshot of the registry; once it is in place the older
+    segments are deleted. Recovery loads the snapshot and replays the
+    segments written since it was started.
+
+    A batch whose write or fsync fails is not acknowledged. It is retried,
+    with a growing pause, in a new segment, because the old one may end in
+    a torn or unsynced write. Replaying the part of a batch that did reach
+    the old segment a second time leaves the registry unchanged.
+    """
+
+    def __init__(self, directory, compact_after=COMPACT_AFTER, logger=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.compact_after = compact_after
+
+        self.condition = threading.Condition()
+        self.buffer = []  # encoded operations not yet written
+        self.last_seq = 0  # sequence number of the newest logged operation
+        self.durable_seq = 0  # every operation up to this one is on disk
+        self.callbacks = []  # [(seq, callback)] waiting for durability
+        self.local = threading.local()
+        self.logger = logger or Logger('SERVER')
+        self.batches = 0  # fsynced log writes
+
+        self.registry = None
+        self.generation = 0
+        self.log_file = None
+        self.write_failed = False  # the current segment may hold a torn batch
+        self.since_snapshot = 0
+        self.compact_requested = False
+        self.snapshot_thread = None
+        self.flusher = None
+        self.closed = False
+
+    def _segment_path(self, generation):
+        return self.directory / f"{LOG_PREFIX}{generation:08d}{LOG_SUFFIX}"
+
+    def _segments(self):
+        """Generations of the log segments on disk, oldest first"""
+        generations = []
+        for path in self.directory.glob(f"{LOG_PREFIX}*{LOG_SUFFIX}"):
+            try:
+                generations.append(int(path.name[len(LOG_PREFIX):-len(LOG_SUFFIX)]))
+            except ValueError:
+                continue
+        return sorted(generations)
+
+    def recover(self, registry):
+        """Load the saved state into registry; returns (records, operations)
+
+        A line that does not parse ends its segment: it can only be the
+        tail of a write that a crash cut short.
+        """
+        first_generation = 0
+        records = 0
+        try:
+            with open(self.directory / SNAPSHOT_FILE, 'rb') as f:
+                first_generation = json.loads(f.readline())['generation']
+                for line in f:
+                    registry.restore(json.loads(line))
+                    records += 1
+        except FileNotFoundError:
+            pass
+
+        operations = 0
+        generations = [g for g in self._segments() if g >= first_generation]
+        for generation in generations:
+            with open(self._segment_path(generation), 'rb') as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        break
+                    registry.apply(op)
+                    operations += 1
+
+        # New operations go to a fresh segment after the ones replayed
+        self.generation = max(generations + [first_generation - 1]) + 1
+        self.since_snapshot = operations
+        return records, operations
+
+    def open(self, registry):
+        """Start journaling registry's changes"""
+        self.registry = registry
+        self.log_file = open(self._segment_path(self.generation), 'ab')
+        _sync_directory(self.directory)
+        registry.journal = self.log
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def log(self, op):
+        """Queue one operation; returns its sequence number"""
+        line = (json.dumps(op, separators=(',', ':')) + '\n').encode()
+        with self.condition:
+            self.last_seq += 1
+            seq = self.last_seq
+            self.buffer.append(line)
+            self.condition.notify_all()
+        self.local.seq = seq
+        return seq
+
+    def pending_seq(self):
+        """Newest sequence number logged by this thread since the last call (0 if none)"""
+        seq = getattr(self.local, 'seq', 0)
+        self.local.seq = 0
+        return seq
+
+    def is_durable(self, seq):
+        return seq <= self.durable_seq
+
+    def wait(self, seq, timeout=None):
+        """Block until operation seq is on disk; returns False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.durable_seq >= seq, timeout)
+
+    def on_durable(self, seq, callback):
+        """Call callback (from the flusher thread) once operation seq is on disk"""
+        with self.condition:
+            if self.durable_seq < seq:
+                self.callbacks.append((seq, callback))
+                return
+        callback()
+
+    def compact(self):
+        """Ask for a snapshot now instead of after compact_after operations"""
+        with self.condition:
+            self.compact_requested = True
+            self.condition.notify_all()
+
+    def _roll_segment(self):
+        """Continue the log in a new segment (flusher thread only)"""
+        try:
+            self.log_file.close()
+        except OSError:
+            pass
+        self.generation += 1
+        self.log_file = open(self._segment_path(self.generation), 'ab')
+        _sync_directory(self.directory)
+
+    def _write_batch(self, batch):
+        if self.write_failed:
+            self._roll_segment()
+            self.write_failed = False
+        self.log_file.write(b''.join(batch))
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+
+    def _flush_loop(self):
+        delay = RETRY_DELAY
+        while True:
+            with self.condition:
+                while not (self.buffer or self.closed
+                           or (self.compact_requested and self.snapshot_thread is None)):
+                    self.condition.wait()
+                if not self.buffer and self.closed:
+                    return
+                batch, self.buffer = self.buffer, []
+                last = self.last_seq
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except OSError as e:
+                    # Nothing in the batch is acknowledged until a retry syncs it
+                    self.write_failed = True
+                    with self.condition:
+                        self.buffer[:0] = batch
+                        closed = self.closed
+                    if closed:
+                        self.logger.error("Failed to write state log, %d operation(s) lost: %s",
+                                          len(batch), e)
+                        return
+                    self.logger.error("Failed to write state log (retrying in %gs): %s", delay, e)
+                    time.sleep(delay)
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+                    continue
+                delay = RETRY_DELAY
+
+            with self.condition:
+                self.durable_seq = last
+                self.batches += bool(batch)
+                ready = [callback for seq, callback in self.callbacks if seq <= last]
+                self.callbacks = [(seq, callback) for seq, callback in self.callbacks if seq > last]
+                self.condition.notify_all()
+                self.since_snapshot += len(batch)
+                compact = ((self.compact_requested or self.since_snapshot >= self.compact_after)
+                           and self.snapshot_thread is None)
+                if compact:
+                    self.compact_requested = False
+                    self.since_snapshot = 0
+            for callback in ready:
+                try:
+                    callback()
+                except Exception as e:
+                    # e.g. the event loop of a stopped server
+                    self.logger.warning("State log callback failed: %s", e)
+
+            if compact:
+                # Everything already logged is in the old segment and in the registry
+                try:
+                    self._roll_segment()
+                except OSError as e:
+                    self.logger.error("Failed to start a new state log segment: %s", e)
+                    self.write_failed = True  # the next write tries again
+                    continue
+                self.snapshot_thread = threading.Thread(
+                    target=self._write_snapshot, args=(self.generation,), daemon=True)
+                self.snapshot_thread.start()
+
+    def _write_snapshot(self, generation):
+        """Dump the registry, then drop the segments the snapshot replaces"""
+        path = self.directory / SNAPSHOT_FILE
+        temp_path = path.with_name(path.name + '.tmp')
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(json.dumps({'generation': generation}).encode() + b'\n')
+                for record in self.registry.dump():
+                    f.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+            _sync_directory(self.directory)
+            for old in self._segments():
+                if old < generation:
+                    self._segment_path(old).unlink(missing_ok=True)
+        except OSError as e:
+            self.logger.error("Failed to write state snapshot: %s", e)
+        finally:
+            with self.condition:
+                self.snapshot_thread = None
+                self.condition.notify_all()
+
+    def close(self):
+        """Write out everything logged so far and stop the flusher"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.flusher:
+            self.flusher.join()
+        snapshot_thread = self.snapshot_thread
+        if snapshot_thread:
+            snapshot_thread.join()
+        if self.log_file:
+            self.log_file.close()
@@ -0,0 +1,235 @@
+"""
+P2P File Sharing - Swarm Download
+Downloads one file in byte ranges from several peers in parallel
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from uploads import PeerBusy
+
+RANGE_SIZE = 4 * 1024 * 1024
+
+
+class _Range:
+    """One byte range of the file and its download state"""
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+        self.done = False
+        self.workers = 0  # peers currently downloading this range
+        self.transfers = set()  # their Transfers, cancelled once one finishes
+        self.peer = None
+        self.started = 0.0
+
+
+class Transfer:
+    """One assignment of a range to a peer, which the swarm may cancel
+
+    fetch_range registers what aborts it (e.g. shutting its socket down)
+    with on_cancel(); a callback registered after cancel() runs at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.callbacks = []
+
+    def on_cancel(self, callback):
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except OSError:
+                pass  # already closed
+
+
+class SwarmDownload:
+    """Schedules the ranges of a file over a set of peers
+
+    A bounded pool of workers repeatedly takes the next pending range and
+    assigns it to the usable peer with the fewest ranges in flight. A range
+    that fails (including a stall hitting the socket timeout) goes back to
+    the front of the queue for another peer, and a peer is dropped after
+    max_failures errors. Once the queue is empty, idle workers duplicate the
+    oldest range still in flight on a different peer, so one slow peer
+    cannot hold up the end of the download. When either copy completes,
+    the other is cancelled and its peer is not charged with a failure.
+    Nor is a peer that raises PeerBusy. If it is still serving other
+    ranges of this download, it is given no more than that many at once
+    from then on; otherwise it gets no ranges until its retry hint has
+    passed.
+
+    fetch_range(peer, offset, length, transfer) must write that range of
+    the file in place and raise on any failure. It should register a way
+    to abort with transfer.on_cancel() and stop writing once
+    transfer.cancelled is set. It may return a list of (offset, length)
+    sub-ranges whose data failed verification; only those are queued
+    again, and the peer is charged with a failure.
+    """
+
+    def __init__(self, peers, size, fetch_range, workers=4, range_size=RANGE_SIZE,
+                 max_failures=3, endgame_after=2.0, ranges=None):
+        self.peers = list(peers)
+        self.fetch_range = fetch_range
+        self.workers = max(1, min(workers, len(self.peers) * 2))
+        self.max_failures = max_failures
+        self.endgame_after = endgame_after
+
+        if ranges is None:
+            ranges = [(offset, min(range_size, size - offset))
+                      for offset in range(0, size, range_size)]
+        self.ranges = [_Range(offset, length) for offset, length in ranges]
+        self.pending = deque(self.ranges)
+        self.remaining = len(self.ranges)
+
+        self.condition = threading.Condition()
+        self.in_flight = {peer['hostname']: 0 for peer in self.peers}
+        self.failures = {peer['hostname']: 0 for peer in self.peers}
+        self.bytes_from = {peer['hostname']: 0 for peer in self.peers}
+        self.busy_until = {peer['hostname']: 0.0 for peer in self.peers}
+        self.max_in_flight = {peer['hostname']: float('inf') for peer in self.peers}
+        self.errors = []
+
+    def run(self):
+        """Download every range; raises ConnectionError if peers run out"""
+        if not self.ranges:
+            return self.bytes_from
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for future in [pool.submit(self._worker) for _ in range(self.workers)]:
+                future.result()
+        if self.remaining:
+            detail = f": {self.errors[-1]}" if self.errors else ""
+            raise ConnectionError(f"No usable peers left with {self.remaining} range(s) missing{detail}")
+        return self.bytes_from
+
+    def _usable_peers(self, exclude=()):
+        return [peer for peer in self.peers
+                if self.failures[peer['hostname']] < self.max_failures
+                and peer['hostname'] not in exclude]
+
+    def _ready(self, peers, now):
+        """The peers not backing off after a busy reply and below their limit"""
+        return [peer for peer in peers if self.busy_until[peer['hostname']] <= now
+                and self.in_flight[peer['hostname']] < self.max_in_flight[peer['hostname']]]
+
+    def _least_busy(self, peers):
+        return min(peers, key=lambda peer: (self.in_flight[peer['hostname']],
+                                            self.failures[peer['hostname']]))
+
+    def _next_assignment(self):
+        """Block until there is work; returns (range, peer, transfer) or None when finished"""
+        with self.condition:
+            while True:
+                if not self.remaining:
+                    return None
+                usable = self._usable_peers()
+                if not usable:
+                    return None
+                now = time.monotonic()
+                peers = self._ready(usable, now)
+
+                # Skip ranges another worker finished as a duplicate
+                while self.pending and self.pending[0].done:
+                    self.pending.popleft()
+                if self.pending and peers:
+                    chunk = self.pending.popleft()
+                    return self._assign(chunk, self._least_busy(peers))
+
+                # End game: help with the oldest range stuck on another peer
+                stuck = [chunk for chunk in self.ranges
+                         if not chunk.done and chunk.workers == 1
+                         and now - chunk.started >= self.endgame_after]
+                if stuck:
+                    chunk = min(stuck, key=lambda c: c.started)
+                    helpers = self._ready(self._usable_peers(exclude={chunk.peer}), now)
+                    if helpers:
+                        return self._assign(chunk, self._least_busy(helpers))
+
+                # Wake up for the end game, or when the first backing-off peer may be asked again
+                timeout = min([self.endgame_after] + [self.busy_until[peer['hostname']] - now
+                                                      for peer in usable
+                                                      if self.busy_until[peer['hostname']] > now])
+                self.condition.wait(timeout=timeout)
+
+    def _assign(self, chunk, peer):
+        chunk.workers += 1
+        chunk.peer = peer['hostname']
+        if chunk.workers == 1:
+            chunk.started = time.monotonic()
+        self.in_flight[peer['hostname']] += 1
+        transfer = Transfer()
+        chunk.transfers.add(transfer)
+        return chunk, peer, transfer
+
+    def _release(self, chunk, hostname, transfer):
+        chunk.workers -= 1
+        chunk.transfers.discard(transfer)
+        self.in_flight[hostname] -= 1
+
+    def _worker(self):
+        while True:
+            assignment = self._next_assignment()
+            if assignment is None:
+                return
+            chunk, peer, transfer = assignment
+            hostname = peer['hostname']
+            try:
+                leftover = self.fetch_range(peer, chunk.offset, chunk.length, transfer)
+            except PeerBusy as e:
+                with self.condition:
+                    self._release(chunk, hostname, transfer)
+                    if self.in_flight[hostname]:
+                        # It caps uploads per peer at the ones it is already serving us
+                        self.max_in_flight[hostname] = self.in_flight[hostname]
+                    else:
+                        self.busy_until[hostname] = time.monotonic() + e.retry_after
+                    if not chunk.done and chunk.workers == 0:
+                        self.pending.appendleft(chunk)
+                    self.condition.notify_all()
+            except Exception as e:
+                with self.condition:
+                    self._release(chunk, hostname, transfer)
+                    if not transfer.cancelled:
+                        self.failures[hostname] += 1
+                        self.errors.append(f"{hostname}: {e}")
+                    if not chunk.done and chunk.workers == 0:
+                        self.pending.appendleft(chunk)
+                    self.condition.notify_all()
+            else:
+                with self.condition:
+                    self._release(chunk, hostname, transfer)
+                    losers = ()
+                    if not chunk.done:
+                        chunk.done = True
+                        losers, chunk.transfers = chunk.transfers, set()
+                        self.remaining -= 1
+                        self.bytes_from[hostname] += chunk.length
+                        if leftover:
+                            # Re-fetch only the parts that failed verification
+                            self.failures[hostname] += 1
+                            self.errors.append(f"{hostname}: sent corrupt data")
+                            for offset, length in leftover:
+                                self.bytes_from[hostname] -= length
+                                retry = _Range(offset, length)
+                                self.ranges.append(retry)
+                                self.pending.appendleft(retry)
+                                self.remaining += 1
+                    self.condition.notify_all()
+                # The duplicate of a finished range only holds up the end of the download
+                for loser in losers:
+                    loser.cancel()
@@ -3,20 +3,43 @@ Test script for P2P File Sharing Application
 Run this after starting the server to verify functionality
 """
 
-import socket
 import json
+import random
+import socket
+import tempfile
+import threading
 import time
 import os
+from contextlib import contextmanager
 from pathlib import Path
 
+from client import P2PClient
+from delta import MIN_DELTA_BLOCK, compute_delta, signatures
+from manifest import hash_file
+from protocol import recv_message, send_message
+from registry import Registry
+from storage import SNAPSHOT_FILE, StateStore
+
+
+@contextmanager
+def scratch_directory():
+    """Run the body in a fresh temporary working directory"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield Path(directory)
+        finally:
+            os.chdir(previous)
+
 
 def send_request(host, port, request):
     """Send a request to server and get response"""
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect((host, port))
-        sock.send(json.dumps(request).encode('utf-8'))
-        response = json.loads(sock.recv(4096).decode('utf-8'))
+        send_message(sock, request)
+        response = recv_message(sock)
         sock.close()
         return response
     except Exception as e:
@@ -215,6 +238,641 @@ def test_multiple_clients(host='127.0.0.1', port=5000):
         return False
 
 
+def test_republish_deduplicated():
+    """Test 9: Republish Over a Deduplicated Name (local, no server needed)"""
+    print("\n=== Test 9: Republish Over a Deduplicated Name ===")
+    
+    with scratch_directory() as directory:
+        (directory / 'same.txt').write_text('same\n')
+        (directory / 'different.txt').write_text('different\n')
+        client = P2PClient('dedup_client', client_port=7009)
+        repository = client.repository_path
+        
+        # Publishing records the manifest in the chunk index (see announce)
+        for filename in ('P1', 'P2'):
+            method, manifest = client.import_file('same.txt', filename)
+            client.chunks.add(filename, manifest)
+        assert method == 'deduplicated', method
+        assert os.path.samefile(repository / 'P1', repository / 'P2')
+        
+        # New content under P2 must replace the shared inode, not write through it
+        method, manifest = client.import_file('different.txt', 'P2')
+        client.chunks.add('P2', manifest)
+        assert method == 'copy', method
+        assert not os.path.samefile(repository / 'P1', repository / 'P2')
+        assert (repository / 'P1').read_text() == 'same\n'
+        assert (repository / 'P2').read_text() == 'different\n'
+        assert client.chunks.get('P1')['root'] == hash_file(repository / 'P1')['root']
+        
+        # The same holds for a name first imported as a link to the user's file
+        client.import_file('same.txt', 'P3', 'link')
+        client.import_file('different.txt', 'P3')
+        assert (directory / 'same.txt').read_text() == 'same\n'
+        assert (repository / 'P3').read_text() == 'different\n'
+        
+    print("✓ Republishing replaced the linked file and left its twin and source intact")
+    return True
+
+
+def delta_between(old, new, block_size=MIN_DELTA_BLOCK):
+    """Ops for turning old into new, and the new file rebuilt from them"""
+    with scratch_directory() as directory:
+        (directory / 'old').write_bytes(old)
+        (directory / 'new').write_bytes(new)
+        with open(directory / 'new', 'rb') as f:
+            ops = compute_delta(f, block_size, signatures(directory / 'old', block_size), len(old))
+    rebuilt = b''.join(old[offset:offset + length] if kind == 'copy' else new[offset:offset + length]
+                       for kind, offset, length in ops)
+    data_bytes = sum(length for kind, _, length in ops if kind == 'data')
+    return ops, rebuilt, data_bytes
+
+
+def test_delta_insertion():
+    """Test 10: Delta After an Insertion (local)"""
+    print("\n=== Test 10: Delta After an Insertion ===")
+    
+    old = random.Random(10).randbytes(40 * MIN_DELTA_BLOCK)
+    inserted = b'inserted bytes ' * 7
+    cut = 5 * MIN_DELTA_BLOCK + 123
+    new = old[:cut] + inserted + old[cut:]
+    ops, rebuilt, data_bytes = delta_between(old, new)
+    
+    assert rebuilt == new
+    # The rolling checksum finds the shifted blocks: only about one block is resent
+    assert data_bytes <= 2 * MIN_DELTA_BLOCK + len(inserted), data_bytes
+    assert [kind for kind, _, _ in ops] == ['copy', 'data', 'copy'], ops
+    print(f"✓ Rebuilt the file sending {data_bytes} of {len(new)} bytes")
+    return True
+
+
+def test_delta_deletion():
+    """Test 11: Delta After a Deletion (local)"""
+    print("\n=== Test 11: Delta After a Deletion ===")
+    
+    old = random.Random(11).randbytes(40 * MIN_DELTA_BLOCK)
+    cut = 17 * MIN_DELTA_BLOCK + 5
+    new = old[:cut] + old[cut + 300:]
+    ops, rebuilt, data_bytes = delta_between(old, new)
+    
+    assert rebuilt == new
+    assert data_bytes <= 2 * MIN_DELTA_BLOCK, data_bytes
+    assert [kind for kind, _, _ in ops] == ['copy', 'data', 'copy'], ops
+    print(f"✓ Rebuilt the file sending {data_bytes} of {len(new)} bytes")
+    return True
+
+
+def test_delta_new_file():
+    """Test 12: Delta of an Entirely New File (local)"""
+    print("\n=== Test 12: Delta of an Entirely New File ===")
+    
+    old = random.Random(12).randbytes(40 * MIN_DELTA_BLOCK)
+    new = random.Random(13).randbytes(50 * MIN_DELTA_BLOCK + 77)
+    ops, rebuilt, data_bytes = delta_between(old, new)
+    
+    assert rebuilt == new
+    # Nothing matches: one coalesced data op covering the whole file
+    assert ops == [('data', 0, len(new))], ops
+    print(f"✓ Sent the new file as a single {data_bytes}-byte data op")
+    return True
+
+
+def test_delta_short_final_block():
+    """Test 13: Delta With a Short Final Block (local)"""
+    print("\n=== Test 13: Delta With a Short Final Block ===")
+    
+    tail = 1000
+    old = random.Random(14).randbytes(30 * MIN_DELTA_BLOCK + tail)
+    middle = 12 * MIN_DELTA_BLOCK
+    new = old[:middle] + bytes(100) + old[middle + 100:]
+    ops, rebuilt, data_bytes = delta_between(old, new)
+    
+    assert rebuilt == new
+    assert data_bytes == MIN_DELTA_BLOCK, data_bytes
+    # The partial last block is matched and copied, not resent
+    assert ops[-1] == ('copy', 13 * MIN_DELTA_BLOCK, len(old) - 13 * MIN_DELTA_BLOCK), ops
+    
+    # A changed short tail is sent as data
+    changed = old[:-tail] + bytes(tail)
+    ops, rebuilt, data_bytes = delta_between(old, changed)
+    assert rebuilt == changed
+    assert ops[-1] == ('data', len(old) - tail, tail), ops
+    print("✓ The short final block was copied when unchanged and resent when changed")
+    return True
+
+
+def registry_state(registry):
+    """Registry.dump() in a canonical order, for comparing two registries"""
+    records = []
+    for record in registry.dump():
+        if 'files' in record:
+            record = dict(record, files=sorted(record['files']))
+        records.append(json.dumps(record, sort_keys=True))
+    return sorted(records)
+
+
+def recovered_state(directory):
+    """State of a fresh registry loaded from a state directory"""
+    registry = Registry()
+    StateStore(directory).recover(registry)
+    return registry_state(registry)
+
+
+def open_store(directory, **options):
+    registry = Registry()
+    store = StateStore(directory, **options)
+    store.recover(registry)
+    store.open(registry)
+    return registry, store
+
+
+def wait_for_snapshot(store, directory, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not (directory / SNAPSHOT_FILE).exists() or store.snapshot_thread is not None:
+        assert time.monotonic() < deadline, "snapshot was not written"
+        time.sleep(0.01)
+
+
+def manifest_for(name, version=1):
+    return {'size': 3, 'piece_size': 1024, 'pieces': [f'{name}-{version}'], 'root': f'{name}-{version}'}
+
+
+def test_recovery_torn_log_line():
+    """Test 14: Recovery From a Torn Log Line (local)"""
+    print("\n=== Test 14: Recovery From a Torn Log Line ===")
+    
+    with scratch_directory() as directory:
+        registry, store = open_store(directory)
+        registry.register('host1', '127.0.0.1', 7001)
+        registry.publish('host1', [{'filename': 'a.txt', 'manifest': manifest_for('a')},
+                                   {'filename': 'b.txt'}])
+        store.close()
+        expected = registry_state(registry)
+        
+        # A crash cut the last write short
+        segment = sorted(directory.glob('oplog-*'))[-1]
+        with open(segment, 'ab') as f:
+            f.write(b'{"op":"publish","host":"host1","fi')
+        assert recovered_state(directory) == expected
+        
+        # Operations logged after the restart go to a new segment and survive
+        registry, store = open_store(directory)
+        registry.publish('host1', [{'filename': 'c.txt'}])
+        store.close()
+        assert recovered_state(directory) == registry_state(registry)
+        assert any('c.txt' in record for record in recovered_state(directory))
+        
+    print("✓ The torn line was ignored and later operations were recovered")
+    return True
+
+
+def test_recovery_after_snapshot_crash():
+    """Test 15: Crash Between Snapshot and Segment Cleanup (local)"""
+    print("\n=== Test 15: Crash Between Snapshot and Segment Cleanup ===")
+    
+    with scratch_directory() as directory:
+        registry, store = open_store(directory)
+        registry.register('host1', '127.0.0.1', 7001)
+        registry.publish('host1', [{'filename': 'a.txt'}])
+        registry.register('host2', '127.0.0.1', 7002)
+        
+        # The snapshot is renamed into place, but the crash comes before the
+        # segments it replaces are deleted
+        store._segments = lambda: []
+        store.compact()
+        wait_for_snapshot(store, directory)
+        del store._segments
+        
+        registry.publish('host2', [{'filename': 'b.txt'}])
+        store.close()
+        assert len(list(directory.glob('oplog-*'))) >= 2
+        
+        # Only the operation logged after the snapshot is replayed
+        recovered = Registry()
+        records, operations = StateStore(directory).recover(recovered)
+        assert operations == 1
+        assert registry_state(recovered) == registry_state(registry)
+        
+    print("✓ Segments older than the snapshot were skipped on recovery")
+    return True
+
+
+def test_snapshot_during_publishes():
+    """Test 16: Snapshots While Publishes Continue (local)"""
+    print("\n=== Test 16: Snapshots While Publishes Continue ===")
+    
+    with scratch_directory() as directory:
+        registry, store = open_store(directory, compact_after=50)
+        hosts = [f'host{i}' for i in range(4)]
+        for port, hostname in enumerate(hosts, 7000):
+            registry.register(hostname, '127.0.0.1', port)
+            
+        def publish(hostname):
+            for index in range(300):
+                registry.publish(hostname, [{'filename': f'{hostname}/file{index}',
+                                             'manifest': manifest_for(f'{hostname}{index}')}])
+                
+        threads = [threading.Thread(target=publish, args=(hostname,)) for hostname in hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store.close()
+        
+        assert (directory / SNAPSHOT_FILE).exists()
+        assert recovered_state(directory) == registry_state(registry)
+        
+    print("✓ State recovered from snapshots taken mid-publish matches the registry")
+    return True
+
+
+def test_failed_log_write_not_acknowledged():
+    """Test 27: A Failed Log Write Is Not Acknowledged (local)"""
+    print("\n=== Test 27: A Failed Log Write Is Not Acknowledged ===")
+    
+    real_fsync = os.fsync
+    failing = threading.Event()
+    
+    def fsync(fd):
+        if failing.is_set():
+            raise OSError(5, 'Input/output error')
+        real_fsync(fd)
+        
+    with scratch_directory() as directory:
+        registry, store = open_store(directory)
+        registry.register('host1', '127.0.0.1', 7001)
+        assert store.wait(store.pending_seq(), timeout=5)
+        
+        os.fsync = fsync
+        try:
+            failing.set()
+            registry.publish('host1', [{'filename': 'a.txt'}])
+            seq = store.pending_seq()
+            assert not store.wait(seq, timeout=0.3)
+            assert not store.is_durable(seq)
+            failing.clear()
+            assert store.wait(seq, timeout=10)
+        finally:
+            os.fsync = real_fsync
+        store.close()
+        
+        # The retry went to a fresh segment
+        assert len(list(directory.glob('oplog-*'))) >= 2
+        assert recovered_state(directory) == registry_state(registry)
+        
+    print("✓ The operation was acknowledged only after a retry reached the disk")
+    return True
+
+
+def test_recovery_replay_matches():
+    """Test 17: Replay Reproduces the Registry (local)"""
+    print("\n=== Test 17: Replay Reproduces the Registry ===")
+    
+    rng = random.Random(17)
+    with scratch_directory() as directory:
+        registry, store = open_store(directory, compact_after=40)
+        hosts = [f'host{i}' for i in range(6)]
+        for step in range(400):
+            hostname = rng.choice(hosts)
+            action = rng.random()
+            if action < 0.1:
+                registry.register(hostname, '127.0.0.1', 7000 + step)
+            elif action < 0.15:
+                registry.remove(hostname)
+            else:
+                name = f'file{rng.randrange(30)}'
+                manifest = manifest_for(name, rng.randrange(3)) if rng.random() < 0.5 else None
+                registry.publish(hostname, [{'filename': name, 'manifest': manifest}])
+        store.close()
+        expected = registry_state(registry)
+        
+        assert recovered_state(directory) == expected
+        # Recovering again, and after a restart with no new operations, gives the same state
+        registry, store = open_store(directory)
+        store.close()
+        assert registry_state(registry) == expected
+        assert recovered_state(directory) == expected
+        
+    print(f"✓ Replay reproduced {len(expected)} records")
+    return True
+
+
+def register_test_host(host, port, hostname, client_port):
+    return send_request(host, port, {
+        'command': 'register',
+        'hostname': hostname,
+        'ip': '127.0.0.1',
+        'port': client_port
+    })
+
+
+def test_batch_publish(host='127.0.0.1', port=5000):
+    """Test 18: Batched Publish"""
+    print("\n=== Test 18: Batched Publish ===")
+    
+    register_test_host(host, port, 'batch_client', 7010)
+    
+    request = {
+        'command': 'publish',
+        'hostname': 'batch_client',
+        'files': [{'filename': f'batch_{i}.txt'} for i in range(3)]
+    }
+    response = send_request(host, port, request)
+    if response['status'] != 'success' or response.get('published') != 3:
+        print(f"✗ Batched publish failed: {response.get('message', 'Unknown error')}")
+        return False
+        
+    # One bad entry rejects the whole batch
+    request['files'] = [{'filename': 'batch_rejected.txt'}, {'filename': ''}]
+    rejected = send_request(host, port, request)
+    
+    response = send_request(host, port, {'command': 'discover', 'hostname': 'batch_client'})
+    files = response.get('files', [])
+    if rejected['status'] != 'error' or 'batch_rejected.txt' in files:
+        print("✗ A batch with an invalid entry should publish nothing")
+        return False
+    if sorted(files) != [f'batch_{i}.txt' for i in range(3)]:
+        print(f"✗ Expected the three batched files, discovered {files}")
+        return False
+        
+    print("✓ Batch of 3 published; a batch with an invalid entry was rejected")
+    return True
+
+
+def test_discover_pages(host='127.0.0.1', port=5000):
+    """Test 19: Paginated Discover"""
+    print("\n=== Test 19: Paginated Discover ===")
+    
+    register_test_host(host, port, 'page_client', 7011)
+    expected = [f'page_{i:02d}.txt' for i in range(7)]
+    send_request(host, port, {
+        'command': 'publish',
+        'hostname': 'page_client',
+        'files': [{'filename': name} for name in reversed(expected)]
+    })
+    
+    files = []
+    cursor = None
+    pages = 0
+    while True:
+        response = send_request(host, port, {
+            'command': 'discover',
+            'hostname': 'page_client',
+            'limit': 3,
+            'cursor': cursor
+        })
+        if response['status'] != 'success' or len(response['files']) > 3 or response['total'] != 7:
+            print(f"✗ Bad discover page: {response}")
+            return False
+        files.extend(response['files'])
+        pages += 1
+        cursor = response['next_cursor']
+        if cursor is None or pages > 7:
+            break
+            
+    if files != expected or pages != 3:
+        print(f"✗ Expected {expected} in 3 pages, got {files} in {pages}")
+        return False
+        
+    for limit in (0, True):
+        response = send_request(host, port, {'command': 'discover', 'hostname': 'page_client', 'limit': limit})
+        if response['status'] != 'error':
+            print(f"✗ A limit of {limit!r} should be rejected")
+            return False
+        
+    print(f"✓ Discovered {len(files)} files in {pages} pages, in name order")
+    return True
+
+
+def test_search(host='127.0.0.1', port=5000):
+    """Test 20: Search by Prefix, Substring and Glob"""
+    print("\n=== Test 20: Search by Prefix, Substring and Glob ===")
+    
+    register_test_host(host, port, 'search_client', 7012)
+    send_request(host, port, {
+        'command': 'publish',
+        'hostname': 'search_client',
+        'files': [{'filename': name} for name in (
+            'search_docs/report-2023.txt',
+            'search_docs/report-2024.txt',
+            'search_docs/notes.md',
+            'search_media/clip.mp4'
+        )]
+    })
+    
+    cases = [
+        ('search_docs/', 'prefix', ['search_docs/notes.md', 'search_docs/report-2023.txt',
+                                    'search_docs/report-2024.txt']),
+        ('report-202', 'substring', ['search_docs/report-2023.txt', 'search_docs/report-2024.txt']),
+        ('search_*/*.m[dp]*', 'glob', ['search_docs/notes.md', 'search_media/clip.mp4']),
+        ('search_no_such_file', 'substring', []),
+    ]
+    for query, mode, expected in cases:
+        response = send_request(host, port, {'command': 'search', 'query': query, 'mode': mode})
+        if response['status'] != 'success':
+            print(f"✗ {mode} search for {query!r} failed: {response.get('message', 'Unknown error')}")
+            return False
+        names = [result['filename'] for result in response['results']]
+        if names != expected or any(result['peers'] < 1 for result in response['results']):
+            print(f"✗ {mode} search for {query!r} returned {names}, expected {expected}")
+            return False
+        print(f"✓ {mode} {query!r}: {len(names)} result(s)")
+        
+    response = send_request(host, port, {'command': 'search', 'query': 'x', 'mode': 'regex'})
+    if response['status'] != 'error':
+        print("✗ An unknown search mode should be rejected")
+        return False
+        
+    return True
+
+
+def test_search_pages(host='127.0.0.1', port=5000):
+    """Test 21: Search Cursor Paging"""
+    print("\n=== Test 21: Search Cursor Paging ===")
+    
+    register_test_host(host, port, 'search_page_client', 7013)
+    expected = [f'search_page/{i:02d}.dat' for i in range(5)]
+    send_request(host, port, {
+        'command': 'publish',
+        'hostname': 'search_page_client',
+        'files': [{'filename': name} for name in expected]
+    })
+    
+    names = []
+    cursor = None
+    pages = 0
+    while True:
+        response = send_request(host, port, {
+            'command': 'search',
+            'query': 'search_page/',
+            'mode': 'prefix',
+            'limit': 2,
+            'cursor': cursor
+        })
+        if response['status'] != 'success' or len(response['results']) > 2:
+            print(f"✗ Bad search page: {response}")
+            return False
+        names.extend(result['filename'] for result in response['results'])
+        pages += 1
+        cursor = response['next_cursor']
+        if cursor is None or pages > 5:
+            break
+            
+    if names != expected or pages != 3:
+        print(f"✗ Expected {expected} in 3 pages, got {names} in {pages}")
+        return False
+        
+    response = send_request(host, port, {'command': 'search', 'query': 'search_page/', 'limit': True})
+    if response['status'] != 'error':
+        print("✗ A limit of True should be rejected")
+        return False
+        
+    print(f"✓ Paged through {len(names)} results, 2 at a time")
+    return True
+
+
+def test_heartbeat(host='127.0.0.1', port=5000):
+    """Test 22: Heartbeat"""
+    print("\n=== Test 22: Heartbeat ===")
+    
+    register_test_host(host, port, 'heartbeat_client', 7014)
+    
+    response = send_request(host, port, {'command': 'heartbeat', 'hostname': 'heartbeat_client', 'load': 2})
+    if response['status'] != 'success' or not response.get('ttl'):
+        print(f"✗ Heartbeat failed: {response.get('message', 'Unknown error')}")
+        return False
+    print(f"✓ Heartbeat accepted, registration lasts {response['ttl']}s")
+    
+    response = send_request(host, port, {'command': 'heartbeat', 'hostname': 'never_registered'})
+    if response['status'] != 'error' or response.get('registered') is not False:
+        print("✗ A heartbeat from an unknown host should ask it to register")
+        return False
+    print("✓ Unknown host was told to register again")
+    return True
+
+
+def test_stats(host='127.0.0.1', port=5000):
+    """Test 23: Server Stats"""
+    print("\n=== Test 23: Server Stats ===")
+    
+    before = send_request(host, port, {'command': 'stats'})
+    send_request(host, port, {'command': 'ping', 'hostname': 'test_client'})
+    response = send_request(host, port, {'command': 'stats'})
+    
+    if before['status'] != 'success' or response['status'] != 'success':
+        print(f"✗ Stats failed: {response.get('message', 'Unknown error')}")
+        return False
+    stats = response['stats']
+    pings_before = before['stats']['requests'].get('ping', {}).get('count', 0)
+    if stats['requests'].get('ping', {}).get('count') != pings_before + 1:
+        print("✗ The ping request was not counted")
+        return False
+    if 'clients' not in stats or 'uptime_sec' not in stats:
+        print(f"✗ Stats are missing fields: {sorted(stats)}")
+        return False
+        
+    print(f"✓ Stats report {stats['clients']} clients, uptime {stats['uptime_sec']}s")
+    return True
+
+
+def test_fetch_after_newest_holder_leaves():
+    """Test 24: Fetch After the Newest Version's Holder Leaves (local)"""
+    print("\n=== Test 24: Fetch After the Newest Version's Holder Leaves ===")
+    
+    registry = Registry()
+    registry.register('host1', '127.0.0.1', 7001)
+    registry.register('host2', '127.0.0.1', 7002)
+    registry.publish('host1', [{'filename': 'f.txt', 'manifest': manifest_for('f', 1)}])
+    registry.publish('host2', [{'filename': 'f.txt', 'manifest': manifest_for('f', 2)}])
+    
+    peers, manifest = registry.fetch('f.txt')
+    assert [peer['hostname'] for peer in peers] == ['host2'] and manifest['root'] == 'f-2'
+    
+    # A snapshot keeps both versions
+    restored = Registry()
+    for record in registry.dump():
+        restored.restore(record)
+        
+    for current in (registry, restored):
+        current.remove('host2')
+        peers, manifest = current.fetch('f.txt')
+        assert [peer['hostname'] for peer in peers] == ['host1'], peers
+        assert manifest == manifest_for('f', 1)
+        
+    # Re-registering drops what the host held, and a replaced version is forgotten
+    registry.register('host2', '127.0.0.1', 7002)
+    registry.publish('host2', [{'filename': 'f.txt', 'manifest': manifest_for('f', 2)}])
+    registry.register('host2', '127.0.0.1', 7002)
+    assert registry.fetch('f.txt')[1]['root'] == 'f-1'
+    registry.publish('host1', [{'filename': 'f.txt', 'manifest': manifest_for('f', 3)}])
+    assert [record['manifest']['root'] for record in registry.dump() if 'file' in record] == ['f-3']
+    
+    print("✓ Remaining holders of the older version were still returned")
+    return True
+
+
+def test_no_dedupe_onto_linked_import():
+    """Test 25: Deduplication Skips Linked Imports (local)"""
+    print("\n=== Test 25: Deduplication Skips Linked Imports ===")
+    
+    with scratch_directory() as directory:
+        (directory / 'user_src.txt').write_text('same\n')
+        (directory / 'other.txt').write_text('same\n')
+        client = P2PClient('linked_client', client_port=7025)
+        repository = client.repository_path
+        
+        method, manifest = client.import_file('user_src.txt', 'A', 'link')
+        client.chunks.add('A', manifest)
+        
+        # A copy of the same content must not become a link to the user's file
+        method, manifest = client.import_file('other.txt', 'C')
+        client.chunks.add('C', manifest)
+        assert method == 'copy', method
+        assert not os.path.samefile(repository / 'C', directory / 'user_src.txt')
+        
+        # The mark survives a restart; owned copies are still deduplicated
+        client.save_chunks()
+        client = P2PClient('linked_client', client_port=7025)
+        method, manifest = client.import_file('other.txt', 'D')
+        assert method == 'deduplicated', method
+        assert os.path.samefile(repository / 'D', repository / 'C')
+        assert not os.path.samefile(repository / 'D', directory / 'user_src.txt')
+        
+        (directory / 'user_src.txt').write_text('edited\n')
+        assert (repository / 'C').read_text() == 'same\n'
+        
+    print("✓ Copies were never linked to the user's source file")
+    return True
+
+
+def test_peer_paths_stay_in_repository():
+    """Test 26: Peers Cannot Read Outside the Repository (local)"""
+    print("\n=== Test 26: Peers Cannot Read Outside the Repository ===")
+    
+    with scratch_directory() as directory:
+        (directory / 'secret.txt').write_text('secret\n')
+        client = P2PClient('path_client', client_port=7026)
+        (client.repository_path / 'shared.txt').write_text('shared\n')
+        
+        def ask(request):
+            ours, theirs = socket.socketpair()
+            with ours, theirs:
+                if request['command'] == 'stat':
+                    client.serve_stat(ours, request)
+                else:
+                    client.serve_download(ours, request)
+                return recv_message(theirs)
+                
+        assert ask({'command': 'stat', 'filename': 'shared.txt'})['size'] == 7
+        for filename in ('../secret.txt', str(directory / 'secret.txt'), 'sub/../../secret.txt',
+                         '.chunks.json', '..', '', None, 7):
+            for command in ('stat', 'download'):
+                response = ask({'command': command, 'filename': filename})
+                assert response['status'] == 'error', (command, filename, response)
+                
+    print("✓ Names outside the repository were refused")
+    return True
+
+
 def run_all_tests():
     """Run all tests"""
     print("=" * 60)
@@ -232,7 +890,26 @@ def run_all_tests():
         test_ping,
         test_fetch_nonexistent,
         test_fetch_existing,
-        test_multiple_clients
+        test_multiple_clients,
+        test_republish_deduplicated,
+        test_delta_insertion,
+        test_delta_deletion,
+        test_delta_new_file,
+        test_delta_short_final_block,
+        test_recovery_torn_log_line,
+        test_recovery_after_snapshot_crash,
+        test_snapshot_during_publishes,
+        test_recovery_replay_matches,
+        test_batch_publish,
+        test_discover_pages,
+        test_search,
+        test_search_pages,
+        test_heartbeat,
+        test_stats,
+        test_fetch_after_newest_holder_leaves,
+        test_no_dedupe_onto_linked_import,
+        test_peer_paths_stay_in_repository,
+        test_failed_log_write_not_acknowledged
     ]
     
     results = []
@@ -0,0 +1,122 @@
+"""
+P2P File Sharing - File Transfer
+Streams file data between sockets and disk in fixed-size blocks
+"""
+
+import errno
+import io
+import os
+import selectors
+
+BLOCK_SIZE = 256 * 1024
+PIECE_SIZE = 1024 * 1024  # unit of download progress tracking
+SENDFILE_CHUNK = 8 * 1024 * 1024
+
+# Errors meaning "os.sendfile cannot be used for this fd pair", not a failed transfer
+_SENDFILE_UNSUPPORTED = {
+    errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+    getattr(errno, 'ENOTSUP', errno.EINVAL), getattr(errno, 'EOPNOTSUPP', errno.EINVAL)
+}
+
+
+def send_file_data(sock, f, size, block_size=BLOCK_SIZE, zero_copy=True, throttle=None):
+    """Stream size bytes from an open binary file to a socket
+
+    The file's current position is the start of the data. When zero_copy
+    is set and the platform supports it, the kernel copies the data with
+    os.sendfile and the bytes never pass through Python; otherwise a
+    buffered loop is used. throttle (if given) is called with the size of
+    every block sent and may block to limit the rate; blocks are then at
+    most block_size bytes.
+    """
+    if zero_copy and hasattr(os, 'sendfile'):
+        chunk = SENDFILE_CHUNK if throttle is None else block_size
+        if _sendfile(sock, f, size, chunk, throttle):
+            return
+    _send_buffered(sock, f, size, block_size, throttle)
+
+
+def _sendfile(sock, f, size, chunk=SENDFILE_CHUNK, throttle=None):
+    """Send with os.sendfile; returns False if the kernel path is unavailable"""
+    try:
+        in_fd = f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return False
+    out_fd = sock.fileno()
+    offset = f.tell()
+    remaining = size
+    timeout = sock.gettimeout()
+    selector = None
+
+    try:
+        while remaining:
+            try:
+                sent = os.sendfile(out_fd, in_fd, offset, min(remaining, chunk))
+            except BlockingIOError:
+                # A socket with a timeout is non-blocking at the OS level
+                if selector is None:
+                    selector = selectors.DefaultSelector()
+                    selector.register(out_fd, selectors.EVENT_WRITE)
+                if not selector.select(timeout):
+                    raise TimeoutError("Timed out sending file data")
+                continue
+            except OSError as e:
+                if remaining == size and e.errno in _SENDFILE_UNSUPPORTED:
+                    return False
+                raise
+            if not sent:
+                raise EOFError(f"File ended with {remaining} bytes left to send")
+            offset += sent
+            remaining -= sent
+            if throttle is not None:
+                throttle(sent)
+    finally:
+        if selector is not None:
+            selector.close()
+        f.seek(offset)
+    return True
+
+
+def _send_buffered(sock, f, size, block_size=BLOCK_SIZE, throttle=None):
+    """Send through one preallocated buffer reused for every block"""
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    remaining = size
+    while remaining:
+        count = f.readinto(view[:min(block_size, remaining)])
+        if not count:
+            raise EOFError(f"File ended with {remaining} bytes left to send")
+        sock.sendall(view[:count])
+        remaining -= count
+        if throttle is not None:
+            throttle(count)
+
+
+def recv_file_data(sock, f, size, block_size=BLOCK_SIZE, hasher=None, throttle=None):
+    """Stream size bytes from a socket into an open binary file
+
+    Data is received with recv_into straight into a preallocated buffer
+    and written out one full block at a time, updating hasher (if given)
+    on the way and then calling throttle (if given) with the block size.
+    Raises ConnectionError if the peer closes the connection before size
+    bytes have arrived.
+    """
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    remaining = size
+    while remaining:
+        wanted = min(block_size, remaining)
+        filled = 0
+        while filled < wanted:
+            count = sock.recv_into(view[filled:wanted])
+            if not count:
+                raise ConnectionError(
+                    f"Connection closed with {remaining - filled} bytes left to receive"
+                )
+            filled += count
+        if hasher is not None:
+            hasher.update(view[:filled])
+        f.write(view[:filled])
+        remaining -= filled
+        if throttle is not None:
+            throttle(filled)
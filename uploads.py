@@ -0,0 +1,105 @@
+"""
+P2P File Sharing - Upload Admission
+Bounded upload slots with a wait queue and per-peer caps for the peer server
+"""
+
+import threading
+from collections import deque
+
+# Uploads served at once, downloads allowed to wait for a slot, and uploads per peer
+UPLOAD_SLOTS = 4
+UPLOAD_QUEUE = 16
+PER_PEER_UPLOADS = 2
+
+# Seconds a queued download waits for a slot before it is told to come back later
+QUEUE_WAIT = 5.0
+
+# Base retry hint (seconds) in busy replies, scaled by the length of the queue
+RETRY_AFTER = 1.0
+
+
+class PeerBusy(ConnectionError):
+    """A peer had no upload slot; try it again after retry_after seconds"""
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UploadSlots:
+    """Admission control for uploads
+
+    At most slots uploads run at once, so each gets the disk and link at
+    full speed. Further downloads wait in arrival order, up to queue_size
+    of them and for at most max_wait seconds each. A peer holds at most
+    per_peer active or queued uploads. acquire() returns False when a
+    download is not admitted; the caller answers it with a busy reply.
+    """
+
+    def __init__(self, slots=UPLOAD_SLOTS, queue_size=UPLOAD_QUEUE,
+                 per_peer=PER_PEER_UPLOADS, max_wait=QUEUE_WAIT):
+        self.slots = slots
+        self.queue_size = queue_size
+        self.per_peer = per_peer
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = deque()  # one ticket per queued download, oldest first
+        self.by_peer = {}  # {peer: active and queued uploads}
+        self.rejected = 0
+
+    def acquire(self, peer):
+        """Take an upload slot for peer, waiting in line if necessary"""
+        with self.condition:
+            if self.by_peer.get(peer, 0) >= self.per_peer:
+                self.rejected += 1
+                return False
+            if self.active < self.slots and not self.waiting:
+                self._admit(peer)
+                return True
+            if len(self.waiting) >= self.queue_size:
+                self.rejected += 1
+                return False
+
+            ticket = object()
+            self.waiting.append(ticket)
+            self.by_peer[peer] = self.by_peer.get(peer, 0) + 1
+            admitted = self.condition.wait_for(
+                lambda: self.waiting[0] is ticket and self.active < self.slots, self.max_wait)
+            if admitted:
+                self.waiting.popleft()
+                self.active += 1
+            else:
+                self.waiting.remove(ticket)
+                self._forget(peer)
+                self.rejected += 1
+            # The next download in line may be admitted too
+            self.condition.notify_all()
+            return admitted
+
+    def _admit(self, peer):
+        self.active += 1
+        self.by_peer[peer] = self.by_peer.get(peer, 0) + 1
+
+    def _forget(self, peer):
+        count = self.by_peer[peer] - 1
+        if count:
+            self.by_peer[peer] = count
+        else:
+            del self.by_peer[peer]
+
+    def release(self, peer):
+        with self.condition:
+            self.active -= 1
+            self._forget(peer)
+            self.condition.notify_all()
+
+    def load(self):
+        """Uploads running or waiting for a slot"""
+        with self.condition:
+            return self.active + len(self.waiting)
+
+    def retry_after(self):
+        """Seconds a rejected peer should wait before asking again"""
+        with self.condition:
+            return round(RETRY_AFTER * (1 + len(self.waiting) / self.slots), 1)